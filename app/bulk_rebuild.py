@@ -0,0 +1,123 @@
+import threading
+import time
+
+from pathlib import Path
+
+from jinja2 import Template
+
+from .named_manager import NamedManager
+from .zone_model import next_serial, serial_gt, set_zone_text_serial, zone_text_serial
+from .zone_validator import check_zone_text, VALIDATOR_DNSPYTHON, VALIDATOR_NAMED
+
+
+_templates: dict[str, Template] = {}  # Compiled once per worker process
+
+
+def _old_serial(job: dict, username: str) -> int | None:
+    try:
+        return zone_text_serial((Path(job['zones_dir']) / username).read_text())
+    except FileNotFoundError:
+        return None
+
+
+def _stage_zone(job: dict, username: str, zone: str) -> None:
+    '''Checks a zone and writes it to `job['staging_dir']`. Raises on a bad zone.'''
+    origin = f'{username}.{job["origin"]}'
+    if job['validator'] != VALIDATOR_NAMED:
+        check_zone_text(origin, zone)
+    staged = Path(job['staging_dir']) / username
+    staged.write_text(zone)
+    if job['validator'] != VALIDATOR_DNSPYTHON:
+        NamedManager.named_checkzone(origin, staged)
+
+
+def render_user_zones(job: dict, usernames: list[str]) -> list[tuple[str, str | None, str | None]]:
+    '''
+    Renders and checks a fresh zone for each user, into `job['staging_dir']`.
+    Runs in a worker process of the rebuild pool: `job` holds everything it
+    needs (template source, origin, public IP...). Returns (username, zone,
+    None) or (username, None, error) for each user.
+    '''
+    template = _templates.get(job['template'])
+    if template is None:
+        template = _templates[job['template']] = Template(job['template'])
+    results = []
+    for username in usernames:
+        try:
+            zone = template.render(origin=f'{username}.{job["origin"]}', serial=next_serial(_old_serial(job, username)),
+                                   ns_ip=job['ns_ip'], user_list=[], includes=[],
+                                   custom_records=job['custom_records'])
+            _stage_zone(job, username, zone)
+            results.append((username, zone, None))
+        except Exception as e:  # One broken user must not stop the others
+            results.append((username, None, str(e)))
+    return results
+
+
+def check_user_zones(job: dict, usernames: list[str], zones: list[str]) -> list[tuple[str, str | None, str | None]]:
+    '''
+    Checks imported zones into `job['staging_dir']`, as render_user_zones.
+    A zone whose serial is not greater than the one of the zone it replaces
+    gets a greater one, or secondaries would not transfer it.
+    '''
+    results = []
+    for username, zone in zip(usernames, zones):
+        try:
+            old, new = _old_serial(job, username), zone_text_serial(zone)
+            if old is not None and new is not None and not serial_gt(new, old):
+                zone = set_zone_text_serial(zone, next_serial(old))
+            _stage_zone(job, username, zone)
+            results.append((username, zone, None))
+        except Exception as e:
+            results.append((username, None, str(e)))
+    return results
+
+
+class RebuildProgress(object):
+    '''Progress of a bulk rebuild or import of the user zones, readable while it runs.'''
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.total = 0
+        self.checked = 0
+        self.written = 0
+        self.failed: dict[str, str] = {}  # username: error
+        self.started = None
+        self.finished = None
+        self.error = None
+
+    def start(self, total: int) -> None:
+        self.total = total
+        self.started = time.time()
+
+    def add_checked(self, count: int) -> None:
+        with self._lock:
+            self.checked += count
+
+    def add_written(self) -> None:
+        with self._lock:
+            self.written += 1
+
+    def fail(self, username: str, error: str) -> None:
+        with self._lock:
+            self.failed[username] = error
+
+    def finish(self, error: str | None = None) -> None:
+        self.error = error
+        self.finished = time.time()
+
+    @property
+    def running(self) -> bool:
+        return self.started is not None and self.finished is None
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                'running': self.running,
+                'total': self.total,
+                'checked': self.checked,
+                'written': self.written,
+                'failed': dict(self.failed),
+                'seconds': round((self.finished or time.time()) - self.started, 3) if self.started else 0,
+                'error': self.error,
+            }
@@ -0,0 +1,164 @@
+import contextlib
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+
+from collections import deque
+from datetime import datetime, timezone
+from pathlib import Path
+
+
+# Actions of the journal entries
+ACTION_EDIT = 'edit'  # Record edits: dyndns updates, the JSON zone API
+ACTION_ZONEFILE = 'zonefile'  # A whole zone file set by the user
+ACTION_RESTORE = 'restore'
+ACTION_RESET = 'reset'
+ACTION_CREATE = 'create'
+ACTION_REBUILD = 'rebuild'
+ACTION_IMPORT = 'import'
+
+
+class _JsonFormatter(logging.Formatter):
+    '''Entry (the record's msg, a dict) as a JSON line, with the time first.'''
+
+    def format(self, record: logging.LogRecord) -> str:
+        when = datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds')
+        return json.dumps({'time': when, **record.msg})
+
+
+class _JournalFileHandler(logging.handlers.RotatingFileHandler):
+    '''
+    RotatingFileHandler leaving the flushes to the listener, once per batch.
+    Worker processes share the file: a file rotated by another process is
+    opened again, and rotations are serialized by `rotate_lock`.
+    '''
+
+    def __init__(self, path: Path, max_bytes: int, backups: int, rotate_lock=None) -> None:
+        super().__init__(path, maxBytes=max_bytes, backupCount=backups, encoding='utf-8', delay=True)
+        self.rotate_lock = rotate_lock or contextlib.nullcontext()
+
+    def flush(self) -> None:
+        pass
+
+    def flush_batch(self) -> None:
+        super().flush()
+
+    def _rotated_elsewhere(self) -> bool:
+        if self.stream is None:
+            return False
+        try:
+            return os.stat(self.baseFilename).st_ino != os.fstat(self.stream.fileno()).st_ino
+        except FileNotFoundError:
+            return True
+
+    def _reopen(self) -> None:
+        self.stream.close()
+        self.stream = self._open()
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if self._rotated_elsewhere():
+            self._reopen()
+        return super().shouldRollover(record)
+
+    def doRollover(self) -> None:
+        with self.rotate_lock:
+            if self._rotated_elsewhere():
+                self._reopen()  # Another process rotated it meanwhile
+            else:
+                super().doRollover()
+
+
+class _JournalListener(logging.handlers.QueueListener):
+    '''Writes the queued entries and flushes the file once the queue is drained.'''
+
+    def handle(self, record: logging.LogRecord) -> None:
+        handler = self.handlers[0]
+        handler.handle(record)
+        if self.queue.empty():
+            with handler.lock:
+                handler.flush_batch()
+
+
+class ChangeJournal(object):
+    '''
+    Append-only journal of the user zone changes, one JSON object per line:
+    time, user, action, outcome, seconds and, when known, the record changes
+    (see UserZone.diff) or the error.
+
+    `record()` only formats the entry and puts it in a queue (a logging
+    QueueHandler); a listener thread, started on first use, writes what is
+    queued and flushes once per batch. The file is rotated at `max_bytes`,
+    keeping `backups` old files.
+    '''
+
+    def __init__(self, path: str | Path, max_bytes: int = 10 * 1024 * 1024, backups: int = 5,
+                 rotate_lock=None) -> None:
+        self.path = Path(path)
+        self._queue = queue.SimpleQueue()
+        self._handler = _JournalFileHandler(self.path, max_bytes, backups, rotate_lock)
+        self._handler.setFormatter(logging.Formatter('%(message)s'))
+        # Not behind a logger: the log level and logging.disable() do not apply to the journal
+        self._queue_handler = logging.handlers.QueueHandler(self._queue)
+        self._queue_handler.setFormatter(_JsonFormatter())
+        self._listener = _JournalListener(self._queue, self._handler)
+        self._lock = threading.Lock()
+        self._started = False
+
+    def _start(self) -> None:
+        with self._lock:
+            if not self._started:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self._listener.start()
+                self._started = True
+
+    def record(self, username: str, action: str, outcome: str, seconds: float | None = None,
+               changes: list[dict] | None = None, error: str | None = None) -> None:
+        if not self._started:
+            self._start()
+        entry = {'user': username, 'action': action, 'outcome': outcome}
+        if seconds is not None:
+            entry['seconds'] = round(seconds, 4)
+        if changes is not None:
+            entry['changes'] = [{k: v for k, v in change.items() if k != 'id'} for change in changes]
+        if error is not None:
+            entry['error'] = error
+        self._queue_handler.handle(logging.LogRecord('change-journal', logging.INFO, __file__, 0, entry, None, None))
+
+    def stop(self) -> None:
+        '''Writes what is queued and stops the listener.'''
+        with self._lock:
+            if self._started:
+                self._listener.stop()
+                self._handler.close()
+                self._started = False
+
+    def entries(self, username: str | None = None, limit: int = 100) -> list[dict]:
+        '''
+        Last `limit` entries, of `username` only if given, newest first. Reads
+        the journal and its rotated files, entries of other worker processes
+        included.
+        '''
+        with self._handler.lock:
+            self._handler.flush_batch()
+        files = [self.path.with_name(f'{self.path.name}.{i}') for i in range(self._handler.backupCount, 0, -1)]
+        files.append(self.path)
+        needle = f'"user": {json.dumps(username)}' if username is not None else ''
+        found = deque(maxlen=limit)
+        for path in files:
+            try:
+                with open(path, encoding='utf-8') as f:
+                    for line in f:
+                        if needle not in line:
+                            continue
+                        try:
+                            entry = json.loads(line)
+                        except ValueError:
+                            continue  # Cut by a crash
+                        if username is None or entry.get('user') == username:
+                            found.append(entry)
+            except FileNotFoundError:
+                continue
+        return list(reversed(found))
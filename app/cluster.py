@@ -0,0 +1,217 @@
+import fcntl
+import json
+import logging
+import os
+import psutil
+import socket
+import socketserver
+import threading
+import time
+
+from pathlib import Path
+
+from .fsutil import atomic_write_text
+from .named_manager import NamedReloadError
+
+
+logger = logging.getLogger(__name__)
+
+LEADER_RETRY = 2  # Seconds between attempts of a follower to become leader
+REMOTE_TIMEOUT = 30  # Seconds a follower waits for the leader to answer
+
+
+class InterProcessLock(object):
+    '''
+    Reentrant lock shared by the threads of this process and, through an
+    flock on `path`, by every worker process.
+    '''
+
+    def __init__(self, path: str | Path) -> None:
+        self.path = Path(path)
+        self._rlock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def acquire(self) -> None:
+        self._rlock.acquire()
+        if self._depth == 0:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            self._fd = fd
+        self._depth += 1
+
+    def release(self) -> None:
+        self._depth -= 1
+        if self._depth == 0:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+        self._rlock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+
+class Leadership(object):
+    '''
+    Leader election between worker processes: the leader is the process
+    holding an exclusive flock on `lock_path`. The lock is released by the
+    kernel when the leader dies, and a follower takes over.
+    '''
+
+    def __init__(self, lock_path: str | Path, ready_path: str | Path) -> None:
+        self.lock_path = Path(lock_path)
+        self.ready_path = Path(ready_path)
+        self.is_leader = False
+        self._fd = None
+        self._on_elected = []
+        self._thread = None
+
+    def try_acquire(self) -> bool:
+        if self.is_leader:
+            return True
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._fd = fd
+        self.is_leader = True
+        logger.info(f'Process {os.getpid()} is the leader')
+        for callback in self._on_elected:
+            callback()
+        return True
+
+    def on_elected(self, callback) -> None:
+        self._on_elected.append(callback)
+        if self.is_leader:
+            callback()
+
+    def watch(self) -> None:
+        '''Keeps trying to become leader in the background while this process is a follower.'''
+        if self.is_leader or self._thread:
+            return
+        self._thread = threading.Thread(target=self._watch, name='leader-election', daemon=True)
+        self._thread.start()
+
+    def _watch(self) -> None:
+        while not self.try_acquire():
+            time.sleep(LEADER_RETRY)
+
+    def mark_ready(self) -> None:
+        '''Tells the followers that the leader finished bootstrapping Bind.'''
+        me = psutil.Process()
+        atomic_write_text(self.ready_path, json.dumps({'pid': me.pid, 'create_time': me.create_time()}))
+
+    def leader_ready(self) -> bool:
+        try:
+            marker = json.loads(self.ready_path.read_text())
+            return psutil.Process(marker['pid']).create_time() == marker['create_time']
+        except (OSError, ValueError, KeyError, psutil.Error):
+            return False
+
+    def wait_for_leader(self, bootstrap, timeout: float = 120) -> None:
+        '''
+        Blocks a follower until the leader has bootstrapped Bind. If the
+        leader goes away meanwhile, this process may become leader and run
+        `bootstrap` itself.
+        '''
+        deadline = time.monotonic() + timeout
+        while not self.leader_ready():
+            if self.try_acquire():
+                bootstrap()
+                self.mark_ready()
+                return
+            if time.monotonic() > deadline:
+                raise TimeoutError('The leader did not bootstrap Bind in time')
+            time.sleep(0.5)
+
+
+def _apply(scheduler, request: dict) -> str:
+    if request['op'] == 'zone':
+        return scheduler.reload(request['name'], Path(request['zonefile']), Path(request['backup']))
+    return scheduler.rndc(*request['args'])
+
+
+class _ReloadRequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self) -> None:
+        try:
+            request = json.loads(self.rfile.readline())
+            output = _apply(self.server.scheduler, request)
+            response = {'ok': True, 'output': output}
+        except NamedReloadError as e:
+            response = {'ok': False, 'error': str(e)}
+        except Exception as e:
+            logger.error(f'Failed serving a reload request: {e}')
+            response = {'ok': False, 'error': f'Leader error: {e}'}
+        self.wfile.write(json.dumps(response).encode() + b'\n')
+
+
+class ReloadServer(socketserver.ThreadingUnixStreamServer):
+    '''Unix socket where the leader accepts reload requests from the followers.'''
+
+    daemon_threads = True
+
+    def __init__(self, path: str | Path, scheduler) -> None:
+        Path(path).unlink(missing_ok=True)
+        self.scheduler = scheduler
+        super().__init__(str(path), _ReloadRequestHandler)
+
+    def start(self) -> None:
+        threading.Thread(target=self.serve_forever, name='reload-server', daemon=True).start()
+
+
+class ClusterReloader(object):
+    '''
+    Same interface as ReloadScheduler. The leader applies the reloads with
+    its local scheduler, the followers forward them to the leader.
+    '''
+
+    def __init__(self, scheduler, leadership: Leadership, socket_path: str | Path) -> None:
+        self.scheduler = scheduler
+        self.leadership = leadership
+        self.socket_path = str(socket_path)
+        self._server = None
+        leadership.on_elected(self._serve)
+
+    def _serve(self) -> None:
+        self._server = ReloadServer(self.socket_path, self.scheduler)
+        self._server.start()
+
+    def reload(self, name: str, zonefile: Path, backup: Path) -> str:
+        return self._run({'op': 'zone', 'name': name, 'zonefile': str(zonefile), 'backup': str(backup)})
+
+    def rndc(self, *args) -> str:
+        return self._run({'op': 'rndc', 'args': list(args)})
+
+    def _run(self, request: dict) -> str:
+        if not self.leadership.is_leader:
+            return self._forward(request)
+        return _apply(self.scheduler, request)
+
+    def _forward(self, request: dict) -> str:
+        deadline = time.monotonic() + REMOTE_TIMEOUT
+        while True:
+            try:
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                    sock.settimeout(REMOTE_TIMEOUT)
+                    sock.connect(self.socket_path)
+                    sock.sendall(json.dumps(request).encode() + b'\n')
+                    response = json.loads(sock.makefile('rb').readline())
+                break
+            except (ConnectionRefusedError, FileNotFoundError):
+                # No leader listening right now, maybe taking over
+                if self.leadership.is_leader:
+                    return self._run(request)
+                if time.monotonic() > deadline:
+                    raise NamedReloadError('No leader process available to reload Bind')
+                time.sleep(0.2)
+        if not response['ok']:
+            raise NamedReloadError(response['error'])
+        return response['output']
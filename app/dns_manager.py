@@ -1,24 +1,42 @@
 import base64
-import ipaddress
 import dns.exception
 import dns.resolver
 import dns.zone
-import hashlib
-import hmac
 import logging
 import os
-import requests
 import secrets
 import shutil
-import re
+import threading
+import time
 
-from datetime import datetime, timedelta
-from typing import Dict
-from datetime import datetime
+import multiprocessing
+
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, Iterator
 from jinja2 import Environment, FileSystemLoader
 from pathlib import Path
 
-from .named_manager import NamedManager, NamedCheckConfError, NamedCheckZoneError, NamedReloadError
+from . import metrics
+from .bulk_rebuild import RebuildProgress, check_user_zones, render_user_zones
+from .change_journal import ChangeJournal, ACTION_CREATE, ACTION_EDIT, ACTION_RESET, ACTION_RESTORE, \
+    ACTION_ZONEFILE, ACTION_REBUILD, ACTION_IMPORT
+from .cluster import ClusterReloader, InterProcessLock, Leadership
+from .dynamic_update import DynamicUpdater, DynamicUpdateError, ZoneOutOfDate, UPDATE_KEY_NAME
+from .fsutil import atomic_write_text, atomic_write_text_if_changed
+from .manifest import VerificationManifest
+from .public_ip import PublicIpResolver, PublicIpNotFound, PUBLIC_IP_PROVIDERS
+from .named_manager import NamedManager, NamedCheckConfError, NamedCheckZoneError, NamedReloadError, NAMED_PID_FILE
+from .named_supervisor import NamedSupervisor
+from .reload_scheduler import ImmediateReloader, ReloadScheduler
+from .snapshots import SnapshotStore, SnapshotNotFound
+from .token_index import TokenIndex
+from .user_index import UserIndex, USER_SHARDS, user_shard
+from .zone_archive import ArchiveError
+from .zone_cache import ZoneCache, UserZoneView
+from .zone_model import UserZone, next_serial, serial_gt, set_zone_text_serial, zone_text_serial
+from .zone_validator import check_zone_text, ZoneValidationError, VALIDATORS, VALIDATOR_DNSPYTHON, VALIDATOR_NAMED
 
 # Bind globals
 BIND_DIR = '/etc/bind/'
@@ -26,7 +44,17 @@ MAIN_ZONE_FILE = '/etc/bind/main-zone'
 CUSTOM_RRS_FILE = '/etc/bind/custom-records'
 USER_ZONES_DIR = '/etc/bind/user-zones/'
 USER_TOKENS_DIR = '/etc/bind/user-tokens/'
+USER_INDEX_DIR = '/etc/bind/user-index/'
+USER_CONF_DIR = '/etc/bind/named.conf.users/'  # Zone statements of the users, one file per shard
+MAIN_ZONE_USERS_DIR = '/etc/bind/main-zone.users/'  # Delegations to the user zones, one file per shard
 BACKUPS_DIR = '/etc/bind/backups/'
+LOCKS_DIR = '/etc/bind/locks/'
+PUBLIC_IP_FILE = '/etc/bind/public-ip'
+QUARANTINE_DIR = '/etc/bind/quarantine/'
+VERIFIED_MANIFEST_FILE = '/etc/bind/verified.json'
+JOURNAL_FILE = '/etc/bind/journal/changes.jsonl'  # Change journal of the user zones
+UPDATE_KEY_FILE = '/etc/bind/named.conf.update'
+BIND_CONF_FILES = ['named.conf', 'named.conf.local', 'named.conf.rndc', 'named.conf.update', 'rndc.conf']  # In BIND_DIR
 
 # Templates globals
 TEMPLATES_DIR = 'templates/bind/'
@@ -35,17 +63,31 @@ NAMED_CONF_TEMPLATE = 'named.conf.j2'
 NAMED_CONF_LOCAL_TEMPLATE = 'named.conf.local.j2'
 NAMED_CONF_RNDC_TEMPLATE = 'named.conf.rndc.j2'
 RNDC_CONF_TEMPLATE = 'rndc.conf.j2'
+NAMED_CONF_UPDATE_TEMPLATE = 'named.conf.update.j2'
 USER_ZONE_TEMPLATE = 'user-zone.j2'
+NAMED_CONF_USERS_TEMPLATE = 'named.conf.users.j2'
+MAIN_ZONE_USERS_TEMPLATE = 'main-zone.users.j2'
+NAMED_CONF_SECONDARY_TEMPLATE = 'named.conf.secondary.j2'
 
 PUBLIC_IP_REFRESH = 1 # Hours to refresh the public IP
 USER_TOKEN_LENGTH = 16
+STARTUP_WORKERS = 8 # Zones verified in parallel at startup
+REBUILD_CHUNK = 100  # Zones per task of the bulk rebuild and import pool
+SNAPSHOT_PRUNE_INTERVAL = 24 # Hours between prunes of old backups
+NAMED_CHECK_INTERVAL = 5 # Seconds between checks that Bind runs, restarting it if it died
 
-logger = logging.getLogger(__name__)
-logging.basicConfig(level=logging.DEBUG)
+# How record edits reach Bind: zone file rewrite and reload, or DNS UPDATE (RFC 2136)
+ZONE_BACKEND_FILE = 'file'
+ZONE_BACKEND_UPDATE = 'update'
+ZONE_BACKENDS = (ZONE_BACKEND_FILE, ZONE_BACKEND_UPDATE)
 
+# What answers the DNS queries: Bind, or the DNS server of the app (app/dns_server.py)
+DNS_SERVER_NAMED = 'named'
+DNS_SERVER_BUILTIN = 'builtin'
+DNS_SERVERS = (DNS_SERVER_NAMED, DNS_SERVER_BUILTIN)
+
+logger = logging.getLogger(__name__)
 
-class PublicIpNotFound(Exception):
-    pass
 
 class BadZoneFile(Exception):
     pass
@@ -59,15 +101,53 @@ class ZoneCreationError(Exception):
 class RecordUpdateError(Exception):
     pass
 
+class RecordNotFound(Exception):
+    pass
+
+class ZoneVersionMismatch(Exception):
+    '''The zone is not the version the change was made from (If-Match).'''
+    pass
+
+class RecordBatchError(Exception):
+    '''Some entries of a batch update are wrong. `errors` maps entry index to message.'''
+    def __init__(self, errors: dict[int, str]) -> None:
+        super().__init__(f'{len(errors)} bad entries')
+        self.errors = errors
+
 
 
 
 
 class ZoneManager(object):
     
-    def __init__(self, origin) -> None:
-        self._public_ip = None
-        self._public_ip_last_date = datetime.now() - timedelta(hours=PUBLIC_IP_REFRESH*2)
+    def __init__(self, origin, reload_window: float = 0, reload_workers: int = 4,
+                 zone_validator: str = VALIDATOR_DNSPYTHON, multi_worker: bool = False,
+                 public_ip_providers: list[str] = PUBLIC_IP_PROVIDERS,
+                 public_ip_timeout: float = 3.0, backup_retention_days: float = 30,
+                 backup_keep_last: int = 20, secondaries: list[str] = [],
+                 zone_backend: str = ZONE_BACKEND_FILE, update_sync_interval: float = 60,
+                 dns_server: str = DNS_SERVER_NAMED, rebuild_workers: int = 0,
+                 journal_max_bytes: int = 10 * 1024 * 1024, journal_backups: int = 5,
+                 named_pid_file: str = NAMED_PID_FILE) -> None:
+        if zone_validator not in VALIDATORS:
+            raise ValueError(f'Unknown zone validator {zone_validator}, use one of {VALIDATORS}')
+        if zone_backend not in ZONE_BACKENDS:
+            raise ValueError(f'Unknown zone backend {zone_backend}, use one of {ZONE_BACKENDS}')
+        if dns_server not in DNS_SERVERS:
+            raise ValueError(f'Unknown DNS server {dns_server}, use one of {DNS_SERVERS}')
+        if dns_server == DNS_SERVER_BUILTIN and zone_backend == ZONE_BACKEND_UPDATE:
+            raise ValueError(f'The {ZONE_BACKEND_UPDATE} zone backend needs Bind as DNS server')
+        self.dns_server = dns_server
+        self.named = NamedSupervisor(named_pid_file) if dns_server == DNS_SERVER_NAMED else None
+        self.rebuild_workers = rebuild_workers or os.cpu_count() or 1
+        self.zone_validator = zone_validator
+        self.zone_backend = zone_backend
+        self.update_sync_interval = update_sync_interval
+        self.updater = DynamicUpdater(UPDATE_KEY_FILE)
+        # Secondary servers notified of every change, as in also-notify: "address" or "address port N"
+        self.secondaries = list(secondaries)
+        self.public_ips = PublicIpResolver(PUBLIC_IP_FILE, public_ip_providers, public_ip_timeout,
+                                           refresh=PUBLIC_IP_REFRESH*3600)
         self.origin = origin
         if not self.origin.endswith('.'):
             self.origin += '.'
@@ -75,135 +155,572 @@ class ZoneManager(object):
         self.jinja_env = Environment(loader=FileSystemLoader(TEMPLATES_DIR))
         Path(USER_ZONES_DIR).mkdir(exist_ok=True)
         Path(USER_TOKENS_DIR).mkdir(exist_ok=True)
-        bind_failed = False
+        self.tokens = TokenIndex(USER_TOKENS_DIR)
+        self.users = UserIndex(USER_INDEX_DIR)
+        self.snapshots = SnapshotStore(BACKUPS_DIR, backup_retention_days, backup_keep_last)
+        self._maintenance_threads = []
+        self.multi_worker = multi_worker
+        self.ready = threading.Event()
+        self.startup_error = None
+        self._startup_thread = None
+        if multi_worker:
+            # Several worker processes share /etc/bind: the leader bootstraps and reloads Bind
+            Path(LOCKS_DIR).mkdir(exist_ok=True)
+            (Path(LOCKS_DIR) / 'users').mkdir(exist_ok=True)
+            self._user_locks = {shard: InterProcessLock(Path(LOCKS_DIR) / 'users' / f'{shard}.lock')
+                                for shard in USER_SHARDS}
+            self.leadership = Leadership(Path(LOCKS_DIR) / 'leader.lock', Path(LOCKS_DIR) / 'bootstrap.ready')
+            if dns_server == DNS_SERVER_BUILTIN:
+                self.reloader = ImmediateReloader()
+            else:
+                self.reloader = ClusterReloader(ReloadScheduler(reload_window, workers=reload_workers),
+                                                self.leadership, Path(LOCKS_DIR) / 'reload.sock')
+            self.zones = ZoneCache(USER_ZONES_DIR)
+            self.config_lock = InterProcessLock(Path(LOCKS_DIR) / 'config.lock')
+            self.journal = ChangeJournal(JOURNAL_FILE, journal_max_bytes, journal_backups,
+                                         InterProcessLock(Path(LOCKS_DIR) / 'journal.lock'))
+        else:
+            self.leadership = None
+            self._user_locks = {shard: threading.RLock() for shard in USER_SHARDS}
+            if dns_server == DNS_SERVER_BUILTIN:
+                self.reloader = ImmediateReloader()
+            else:
+                self.reloader = ReloadScheduler(reload_window, workers=reload_workers)
+            self.zones = ZoneCache()
+            self.config_lock = threading.RLock()
+            self.journal = ChangeJournal(JOURNAL_FILE, journal_max_bytes, journal_backups)
+
+    def start(self) -> None:
+        '''Bootstraps Bind in a background thread. `ready` is set once the zones can be served.'''
+        if self._startup_thread:
+            return
+        self._startup_thread = threading.Thread(target=self._start, name='zone-startup', daemon=True)
+        self._startup_thread.start()
+
+    def _start(self) -> None:
+        try:
+            if self.multi_worker:
+                # Only the leader asks the providers, followers read the IP saved in PUBLIC_IP_FILE
+                self.leadership.on_elected(self.public_ips.start)
+                self.leadership.on_elected(self.start_maintenance)
+                if self.leadership.try_acquire():
+                    self.bootstrap()
+                    self.leadership.mark_ready()
+                else:
+                    logger.info('Waiting for the leader process to bootstrap Bind.')
+                    self.leadership.wait_for_leader(self.bootstrap)
+                self.leadership.watch()
+            else:
+                self.public_ips.start()
+                self.bootstrap()
+                self.start_maintenance()
+        except Exception as e:
+            logger.error(f'Startup failed: {e}')
+            self.startup_error = e
+            return
+        self.ready.set()
+
+    def start_maintenance(self) -> None:
+        '''
+        Starts the periodic jobs in background threads: pruning the old backups,
+        restarting Bind if it died and, with the update backend, writing the
+        zone journals to the zone files.
+        '''
+        if self._maintenance_threads:
+            return
+        if self.named:
+            self._start_periodic('named-supervisor', NAMED_CHECK_INTERVAL, self.named.ensure_running)
+        self._start_periodic('snapshot-prune', SNAPSHOT_PRUNE_INTERVAL * 3600,
+                             lambda: self.snapshots.prune(self.user_lock))
+        if self.zone_backend == ZONE_BACKEND_UPDATE:
+            self._start_periodic('zone-sync', self.update_sync_interval, self.sync_zones)
+
+    def _start_periodic(self, name: str, interval: float, job) -> None:
+        def run() -> None:
+            while True:
+                time.sleep(interval)
+                try:
+                    job()
+                except Exception as e:
+                    logger.error(f'Periodic job {name} failed: {e}')
+
+        thread = threading.Thread(target=run, name=name, daemon=True)
+        thread.start()
+        self._maintenance_threads.append(thread)
+
+    def sync_zones(self) -> None:
+        '''
+        Writes the changes Bind has in the zone journals to the zone files
+        (rndc sync), so the files read by the web app and other workers are current.
+        '''
+        self.reloader.rndc('sync')
+
+    def health(self) -> dict:
+        '''
+        Health of the DNS serving: with Bind, whether it runs, its zone count
+        and last (re)load times, cached by the NamedSupervisor; with the
+        built-in DNS server, the zones it serves (the main zone and the users').
+        '''
+        if self.named is None:
+            return {'status': 'ok', 'dns_server': self.dns_server, 'zones': len(self.users) + 1}
+        named = self.named.status()
+        return {'status': 'ok' if named['running'] else 'down', 'dns_server': self.dns_server, **named}
+
+    def bootstrap(self) -> None:
+        '''
+        Checks Bind config, main zone and user zones, and starts Bind.
+        Files unchanged since they last passed the checks (see VerificationManifest)
+        are not checked again. A broken user zone is quarantined and reset,
+        the rest of the zones are kept. With the built-in DNS server, Bind is
+        neither checked nor started.
+        '''
+        manifest = VerificationManifest(VERIFIED_MANIFEST_FILE)
+        uses_named = self.dns_server == DNS_SERVER_NAMED
+        named_running = uses_named and self.named.alive()
+        if named_running and self.zone_backend == ZONE_BACKEND_FILE:
+            # Zones that took DNS UPDATEs (update backend before) back to plain files
+            try:
+                NamedManager.rndc('sync', '-clean')
+            except NamedReloadError as e:
+                logger.error(f'Could not sync the zone journals: {e}')
+        changed = False
+        if not self.users.exists():
+            logger.info('Building the user index and the sharded Bind config.')
+            with self.config_lock:
+                self.users.rebuild(self.scan_user_zones())
+                self.reset_bind_conf()
+                self.reset_main_zone()
+            changed = True
+        else:
+            # Settings like the secondaries may have changed since the config was written
+            with self.config_lock:
+                self.reset_bind_conf()
+        if uses_named:
+            changed |= self.verify_bind_conf(manifest)
+        changed |= self.verify_main_zone(manifest)
+        changed |= self.verify_user_zones(manifest)
+        manifest.save()
+        if named_running and changed:
+            try:
+                NamedManager.reload()
+            except NamedReloadError as e:
+                logger.error(f'Could not reload Bind after startup checks: {e}')
+        if not uses_named:
+            logger.info('Zones passed checks, served by the built-in DNS server.')
+            return
+        if not self.named.ensure_running():
+            logger.error('Bind passed checks but could not be started, retrying in the background.')
+            return
+        logger.info('Bind passed checks and is running.')
+
+    def verify_bind_conf(self, manifest: VerificationManifest) -> bool:
+        '''Runs named-checkconf if a config file changed. Resets the config if it fails. Returns True if Bind must reload.'''
+        conf_files = [Path(BIND_DIR) / name for name in BIND_CONF_FILES]
+        conf_files += [Path(USER_CONF_DIR) / f'{shard}.conf' for shard in USER_SHARDS]
+        if all(manifest.is_verified(f) for f in conf_files):
+            return False
         try:
-            NamedManager.check_and_run(self.origin, MAIN_ZONE_FILE)
-            logger.info('Bind passed checks and is running.')
+            if all(f.exists() for f in conf_files):
+                NamedManager.named_checkconf()
+                for f in conf_files:
+                    manifest.record(f)
+                return True
+            logger.info('Bind config files missing.')
         except NamedCheckConfError as e:
-            bind_failed = True
             logger.error(f'ERROR in named-checkconf!!!!!!\n{e}')
-        except NamedCheckZoneError as e:
-            bind_failed = True
-            contents = Path(MAIN_ZONE_FILE).read_text()
-            logger.error(f'Main zone file:\n{contents}')
-            logger.error(f'ERROR in named-checkzone in main zone!!!!!!\n{e}')
-        if bind_failed:
+            self.backup()
+        logger.info('Resetting Bind config.')
+        with self.config_lock:
+            self.reset_bind_conf()
+            self.reset_rndc()
+        NamedManager.named_checkconf()
+        for f in conf_files:
+            manifest.record(f)
+        return True
+
+    def verify_main_zone(self, manifest: VerificationManifest) -> bool:
+        '''Checks the main zone (and its included shards) if it changed. Resets it if it fails. Returns True if reset.'''
+        zone_files = [Path(MAIN_ZONE_FILE)] + [Path(MAIN_ZONE_USERS_DIR) / shard for shard in USER_SHARDS]
+        if all(manifest.is_verified(f) for f in zone_files):
+            return False
+        try:
+            if all(f.exists() for f in zone_files):
+                self.check_zone_file(self.origin, MAIN_ZONE_FILE, allow_include=True)
+                for f in zone_files:
+                    manifest.record(f)
+                return False
+            logger.info('Main zone files missing.')
+        except BadZoneFile as e:
+            logger.error(f'ERROR in main zone!!!!!!\n{e}')
+        with self.config_lock:
+            self.reset_main_zone()
+        self.check_zone_file(self.origin, MAIN_ZONE_FILE, allow_include=True)
+        for f in zone_files:
+            manifest.record(f)
+        return True
+
+    def verify_user_zones(self, manifest: VerificationManifest) -> bool:
+        '''Checks the changed user zones in parallel. Quarantines the broken ones. Returns True if any was.'''
+        def verify(username: str) -> bool:
+            zonefile = Path(USER_ZONES_DIR) / username
+            if manifest.is_verified(zonefile):
+                return False
             try:
-                logger.info('Doing a backup and full Bind reset. All previous config is removed.')
-                self.backup()
-                self.full_reset()
-                logger.info('Trying to start bind after reset.')
-                NamedManager.check_and_run(self.origin, MAIN_ZONE_FILE)
-            except Exception:
-                logger.error(f'Failed resetting. Can not continue Bind.')
-                raise
+                self.check_zone_file(self.user_zone_origin(username), zonefile)
+                manifest.record(zonefile)
+                return False
+            except BadZoneFile as e:
+                logger.error(f'Zone of user {username} failed checks: {e}')
+            self.quarantine_user_zone(username)
+            manifest.record(zonefile)
+            return True
+
+        user_list = self.find_user_list()
+        with ThreadPoolExecutor(max_workers=STARTUP_WORKERS, thread_name_prefix='zone-verify') as executor:
+            quarantined = sum(executor.map(verify, user_list))
+        logger.info(f'Verified {len(user_list)} user zones, {quarantined} quarantined.')
+        return quarantined > 0
+
+    def quarantine_user_zone(self, username: str) -> None:
+        '''Moves a broken user zone to QUARANTINE_DIR and gives the user a fresh zone.'''
+        timestamp = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+        Path(QUARANTINE_DIR).mkdir(exist_ok=True)
+        with self.user_lock(username):
+            (Path(USER_ZONES_DIR) / username).replace(Path(QUARANTINE_DIR) / f'{username}.{timestamp}')
+            self.remove_journal(username)
+            self.reset_user_zonefile(username)
+        logger.info(f'Zone of user {username} quarantined as {username}.{timestamp}')
+
+    def check_zone_file(self, origin: str, zonefile: str | Path, allow_include: bool = False) -> None:
+        '''Checks a zone file with the configured validator. Raises BadZoneFile.'''
+        try:
+            if self.zone_validator != VALIDATOR_NAMED:
+                check_zone_text(origin, Path(zonefile).read_text(), allow_include=allow_include)
+            if self.zone_validator != VALIDATOR_DNSPYTHON:
+                NamedManager.named_checkzone(origin, zonefile)
+        except (OSError, ZoneValidationError, NamedCheckZoneError) as e:
+            raise BadZoneFile(e)
 
     @property
     def public_ip(self) -> str | None:
-        delta = datetime.now() - self._public_ip_last_date
-        if not self._public_ip or delta > timedelta(hours=PUBLIC_IP_REFRESH):
-            try:
-                self._public_ip = self.get_public_ip()
-                self._public_ip_last_date = datetime.now()
-            except PublicIpNotFound as e:
-                logger.error(f'Could not find public IP: {e}')
-        return self._public_ip
-
-    def full_reset(self) -> None:
-        self.reset_main_zone()
-        self.reset_all_user_zonefiles()
-        self.reset_bind_conf()
+        return self.public_ips.get()
+
+    def full_reset(self) -> RebuildProgress:
+        progress = self.reset_all_user_zonefiles()
         self.reset_rndc()
+        return progress
 
-    # def load_root_zone(self) -> None:
-    #     self.root = dns.zone.from_file(MAIN_ZONE_FILE, relativize=False)
-
-    # def check_zone_file_dnspython(self, zone_file: str, origin: str):
-    #     try:
-    #         logger.info(f'Checking zone file {zone_file}')
-    #         zone = dns.zone.from_file(zone_file, origin=origin)  # Change the origin accordingly
-    #         for name, node in zone.nodes.items():
-    #             print(f"Records for {name}:")
-    #             for record in node.rdatas:
-    #                 logger.debug(record)
-    #     except FileNotFoundError as e:
-    #         logger.error(f'File not found: {zone_file}')
-    #     except dns.exception.DNSException as e:
-    #         logger.error(f"Error reading zone file: {e}")
+    def user_lock(self, username: str):
+        '''
+        Lock serializing the changes to one user's zone (and its .tmp and .orig
+        files). Users share a fixed set of locks, one per user shard, so there
+        is no lock (or lock file) per user ever seen; never take two at once.
+        '''
+        return self._user_locks[user_shard(username)]
 
     def user_zone_origin(self, username):
         return username + '.' + self.origin;
 
     def get_user_zonefile(self, username: str) -> str:
+        return self.user_zone_view(username).text
+
+    def user_zone_view(self, username: str) -> UserZoneView:
+        '''Cached view of the user's zone. Creates the zone if it does not exist.'''
+        view = self.zones.get(username)
+        if view:
+            return view
         zonefile = Path(USER_ZONES_DIR) / username
         if not zonefile.exists():
             logger.info(f'Zone file does not exist for user: {username}')
-            self.reset_user_zonefile(username)
-            self.reset_bind_conf()
-        return zonefile.read_text()
-
-    # def zonefile_to_json(self, zonefile: str):
-    #     zone = dns.zone.from_file(zonefile, relativize=False)
-    #     for (name, node) in zone.items():
-    #         print(name)
-    #         for rdset in node:
-    #             type = rdset.rdtype
-    #             print(f'{dns.rdatatype.to_text(rdset.rdtype)}')
-    #             for rr in rdset:
-    #                 print(f'rr {rr}')
-    #         print()
-
-    def find_user_list(self):
-        return [f.name for f in Path(USER_ZONES_DIR).iterdir() if f.is_file()]
+            self.add_user_zone(username)
+        return self._cache_user_zone(username, self.read_user_zonefile(zonefile))
+
+    def read_user_zonefile(self, zonefile: Path) -> str:
+        with metrics.ZONE_FILE_SECONDS.labels('read').time():
+            return zonefile.read_text()
+
+    def _cache_user_zone(self, username: str, zone_data: str, zone: UserZone | None = None) -> UserZoneView:
+        if zone is None:
+            try:
+                zone = UserZone.from_text(self.user_zone_origin(username), zone_data)
+            except ZoneValidationError as e:
+                logger.warning(f'Zone of user {username} can not be parsed, record edits disabled: {e}')
+        return self.zones.put(username, zone_data, zone)
+
+    def add_user_zone(self, username: str) -> None:
+        '''
+        Creates a zone for a new user and loads it in the running Bind.
+        Only the new zone is loaded (rndc reconfig) and only the main zone is
+        reloaded for the new delegation. Only the config shard of the user is rewritten.
+        '''
+        with self.user_lock(username), self.config_lock:
+            self.reset_user_zonefile(username, ACTION_CREATE)
+            shard = self.users.add(username)
+            if shard:
+                self.write_user_shard(shard)
+        try:
+            self.reloader.rndc('reconfig')
+            self.reloader.rndc('reload', self.origin)
+        except NamedReloadError as e:
+            logger.error(f'Could not load the new zone of user {username} in Bind: {e}')
+
+    def find_user_list(self) -> list[str]:
+        return self.users.users()
+
+    def scan_user_zones(self) -> list[str]:
+        '''
+        Users with a zone file. Leaves out the .tmp and .orig files of zone
+        changes in progress and the Bind journals (.jnl, .jbk).
+        '''
+        return [f.name for f in Path(USER_ZONES_DIR).iterdir()
+                if f.is_file() and not f.name.startswith('.') and f.suffix not in ('.tmp', '.orig', '.jnl', '.jbk')]
+
+    def remove_journal(self, username: str) -> None:
+        '''Deletes the Bind journal of a user zone that is gone: a new zone must not continue it.'''
+        zonefile = Path(USER_ZONES_DIR) / username
+        for suffix in ('.jnl', '.jbk'):
+            zonefile.with_name(username + suffix).unlink(missing_ok=True)
 
     def reset_main_zone(self):
-        user_list = self.find_user_list()
-        self.reset_zonefile(self.origin, ZONEFILE_TEMPLATE, MAIN_ZONE_FILE, user_list)
+        '''Writes the main zone and every delegation shard (only the shards that changed).'''
+        Path(MAIN_ZONE_USERS_DIR).mkdir(exist_ok=True)
+        for shard in USER_SHARDS:
+            self.write_main_zone_shard(shard)
+        self.write_main_zone()
 
-    def set_user_zonefile(self, username: str, zone_data: str) -> None:
+    def write_main_zone(self) -> None:
+        includes = [str(Path(MAIN_ZONE_USERS_DIR) / shard) for shard in USER_SHARDS]
+        self.reset_zonefile(self.origin, ZONEFILE_TEMPLATE, MAIN_ZONE_FILE, includes=includes)
+
+    def write_main_zone_shard(self, shard: str) -> bool:
+        if not self.public_ip:
+            raise ZoneCreationError('No public IP')
+        data = self.jinja_env.get_template(MAIN_ZONE_USERS_TEMPLATE).render({
+            'origin': self.origin,
+            'ns_ip': self.public_ip,
+            'user_list': self.users.shard_users(shard),
+        })
+        return atomic_write_text_if_changed(Path(MAIN_ZONE_USERS_DIR) / shard, data)
+
+    def write_conf_shard(self, shard: str) -> bool:
+        data = self.jinja_env.get_template(NAMED_CONF_USERS_TEMPLATE).render({
+            'origin': self.origin,
+            'user_list': self.users.shard_users(shard),
+            'dynamic_update': self.zone_backend == ZONE_BACKEND_UPDATE,
+            'update_key_name': UPDATE_KEY_NAME,
+            **self.transfer_settings(),
+        })
+        return atomic_write_text_if_changed(Path(USER_CONF_DIR) / f'{shard}.conf', data)
+
+    def write_user_shard(self, shard: str) -> None:
+        '''Rewrites the Bind config and the main zone delegations of one shard of users.'''
+        self.write_conf_shard(shard)
+        if self.write_main_zone_shard(shard):
+            # A new serial: Bind reloads the main zone only if its own file changed, secondaries only if the serial grew
+            self.write_main_zone()
+
+    def set_user_zonefile(self, username: str, zone_data: str, if_match: set[str] | None = None) -> str:
+        '''Writes a whole zone, if it is still one of the versions `if_match` (if given). Returns the new ETag.'''
+        with self.user_lock(username):
+            if if_match is not None and not if_match & {'*', self.user_zone_view(username).etag}:
+                raise ZoneVersionMismatch(f'The zone of {username} changed')
+            self._set_user_zonefile(username, zone_data)
+            return self.cached_user_zone(username).etag
+
+    def _set_user_zonefile(self, username: str, zone_data: str, zone: UserZone | None = None,
+                           action: str = ACTION_ZONEFILE) -> None:
+        '''Writes a whole zone. `zone` is the already checked zone of record edits.'''
+        start = time.perf_counter()
         origin = username + '.' + self.origin
+        edited = zone is not None
+        if zone is None:
+            if self.zone_validator != VALIDATOR_NAMED:
+                try:
+                    zone = UserZone(check_zone_text(origin, zone_data))
+                except ZoneValidationError as e:
+                    metrics.ZONE_UPDATES.labels(metrics.UPDATE_BAD_ZONE).inc()
+                    self.journal.record(username, action, metrics.UPDATE_BAD_ZONE, error=str(e))
+                    raise BadZoneFile(e)
+            zone_data = self._grow_serial(username, zone_data, zone)
+        previous = self.zones.get(username)
+        self._snapshot_previous(username)
         tmp_zonefile = Path(USER_ZONES_DIR) / Path(username + '.tmp')
         try:
-            tmp_zonefile.write_text(zone_data)
-            msg = NamedManager.named_checkzone(origin, tmp_zonefile)
+            with metrics.ZONE_FILE_SECONDS.labels('write').time():
+                tmp_zonefile.write_text(zone_data)
+            if self.zone_validator != VALIDATOR_DNSPYTHON:
+                msg = NamedManager.named_checkzone(origin, tmp_zonefile)
         except OSError:
             tmp_zonefile.unlink(missing_ok=True)
             raise Exception('Internal file system error.')
         except NamedCheckZoneError as e:
             tmp_zonefile.unlink(missing_ok=True)
+            metrics.ZONE_UPDATES.labels(metrics.UPDATE_BAD_ZONE).inc()
+            self.journal.record(username, action, metrics.UPDATE_BAD_ZONE, error=str(e))
             raise BadZoneFile(e)
         except Exception:
             tmp_zonefile.unlink(missing_ok=True)
             raise ZoneFileCheckError('Unknown error checking the zone.')
-        zonefile = Path(USER_ZONES_DIR) / username
         try:
             self.replace_zone_if_reloads(tmp_zonefile, username)
         except NamedReloadError as e:
+            self.zones.invalidate(username)
+            metrics.ZONE_UPDATES.labels(metrics.UPDATE_RELOAD_FAILURE).inc()
+            self.journal.record(username, action, metrics.UPDATE_RELOAD_FAILURE, time.perf_counter() - start,
+                                error=str(e))
             raise BadZoneFile('Zone seems OK but there was an error reloading Bind.')
+        self._cache_user_zone(username, zone_data, zone)
+        self._snapshot(username, zone_data)
+        metrics.ZONE_UPDATES.labels(metrics.UPDATE_CHANGED).inc()
+        self.journal.record(username, action, metrics.UPDATE_CHANGED, time.perf_counter() - start,
+                            self._zone_changes(previous.zone if previous else None, zone, edited))
+
+    def _zone_changes(self, old: UserZone | None, new: UserZone | None, edited: bool = True) -> list[dict] | None:
+        '''
+        Record changes from `old` to `new` for the journal, None if a zone is
+        unknown (or can not be parsed). Only the touched names are compared if
+        `new` is a draft of record edits.
+        '''
+        if old is None or new is None:
+            return None
+        return old.diff(new, new.touched if edited else None)
+
+    def _grow_serial(self, username: str, zone_data: str, zone: UserZone | None) -> str:
+        '''
+        Whole zone written by the user with a serial greater than the current
+        one, or secondaries would not transfer it. Raises the serial if needed.
+        '''
+        try:
+            current = self.cached_user_zone(username)
+        except RecordUpdateError:
+            return zone_data
+        old_serial = current.zone.serial if current.zone else zone_text_serial(current.text)
+        new_serial = zone.serial if zone else zone_text_serial(zone_data)
+        if old_serial is None or new_serial is None or serial_gt(new_serial, old_serial):
+            return zone_data
+        serial = next_serial(old_serial)
+        data = set_zone_text_serial(zone_data, serial)
+        if data == zone_data:
+            logger.warning(f'Serial of the zone of {username} does not grow and could not be raised')
+            return zone_data
+        logger.info(f'Serial of the zone of {username} raised from {new_serial} to {serial}')
+        if zone:
+            zone.set_serial(serial)
+        return data
 
     def replace_zone_if_reloads(self, tmp_zonefile: Path, username: str) -> None:
+        if self.zone_backend == ZONE_BACKEND_UPDATE:
+            return self.replace_dynamic_zone(tmp_zonefile, username)
         zonefile = Path(USER_ZONES_DIR) / username
         zonefile_backup = zonefile.with_suffix('.orig')
         shutil.copy2(zonefile, zonefile_backup)
         tmp_zonefile.replace(zonefile)
         try:
-            NamedManager.reload()
-            zonefile_backup.unlink()
+            # Waits for the reload of the zone; on failure the scheduler has restored zonefile_backup
+            self.reloader.reload(self.user_zone_origin(username), zonefile, zonefile_backup)
+        except NamedReloadError:
+            logger.error(f'Passed named-checkzone but reload error for user {username}')
+            raise
+
+    def replace_dynamic_zone(self, tmp_zonefile: Path, username: str) -> None:
+        '''
+        Like replace_zone_if_reloads, for a zone taking DNS UPDATEs: Bind owns
+        its file, so the zone is frozen while the file is replaced and loaded
+        again by thawing it. The journal is dropped (or, with secondaries,
+        extended with the differences) by Bind itself.
+        '''
+        origin = self.user_zone_origin(username)
+        zonefile = Path(USER_ZONES_DIR) / username
+        zonefile_backup = zonefile.with_suffix('.orig')
+        try:
+            self.reloader.rndc('freeze', origin)
+        except NamedReloadError:
+            tmp_zonefile.unlink(missing_ok=True)
+            raise
+        shutil.copy2(zonefile, zonefile_backup)
+        tmp_zonefile.replace(zonefile)
+        try:
+            self.reloader.rndc('thaw', origin)
         except NamedReloadError:
-            contents = zonefile.read_text()
-            logger.error(f'Passed named-checkzone but reload error for user {username}:\n{contents}')
-            shutil.copy2(zonefile_backup, zonefile)
+            logger.error(f'Passed checks but thaw error for user {username}, restoring {zonefile_backup}')
+            metrics.ZONE_UPDATES.labels(metrics.UPDATE_ROLLBACK).inc()
+            zonefile_backup.replace(zonefile)
             try:
-                NamedManager.reload()
+                self.reloader.rndc('thaw', origin)
             except NamedReloadError:
-                logger.error(f'VERY BAD SITUATION: failed reverting a reload error for user {username}. ******')
-                raise
+                logger.error(f'VERY BAD SITUATION: failed reverting a thaw error for zone {origin}. ******')
             raise
+        zonefile_backup.unlink(missing_ok=True)
+
+    @contextmanager
+    def frozen_user_zone(self, username: str):
+        '''
+        With the update backend, keeps a user zone frozen in Bind while its file
+        is written outside of replace_dynamic_zone (e.g. a reset). Does nothing
+        if the zone is not loaded in Bind.
+        '''
+        origin = self.user_zone_origin(username)
+        frozen = False
+        if self.zone_backend == ZONE_BACKEND_UPDATE and self.named.alive():
+            try:
+                self.reloader.rndc('freeze', origin)
+                frozen = True
+            except NamedReloadError as e:
+                logger.debug(f'Zone {origin} not frozen: {e}')
+        try:
+            yield
+        finally:
+            if frozen:
+                self.reloader.rndc('thaw', origin)
 
-    def reset_user_zonefile(self, username: str) -> None:
+    def reset_user_zonefile(self, username: str, action: str = ACTION_RESET) -> None:
         origin = username + '.' + self.origin
         zonefile = Path(USER_ZONES_DIR) / username
-        self.reset_zonefile(origin, USER_ZONE_TEMPLATE, zonefile)
+        self.zones.invalidate(username)
+        self._snapshot_previous(username)
+        with self.frozen_user_zone(username):
+            zone = self.reset_zonefile(origin, USER_ZONE_TEMPLATE, zonefile)
+        self._cache_user_zone(username, zone)
+        self._snapshot(username, zone)
+        self.journal.record(username, action, metrics.UPDATE_CHANGED)
+
+    def _snapshot_previous(self, username: str) -> None:
+        '''Saves the zone as it is before its first change with no history (e.g. after an upgrade).'''
+        zonefile = Path(USER_ZONES_DIR) / username
+        try:
+            if self.snapshots.last(username) or not zonefile.exists():
+                return
+            when = datetime.fromtimestamp(zonefile.stat().st_mtime, timezone.utc).isoformat(timespec='microseconds')
+            self.snapshots.record(username, zonefile.read_text(), when)
+        except OSError as e:
+            logger.error(f'Could not back up the zone of {username}: {e}')
+
+    def _snapshot(self, username: str, zone_data: str) -> None:
+        # A failed backup does not undo a change Bind already serves
+        try:
+            self.snapshots.record(username, zone_data)
+        except OSError as e:
+            logger.error(f'Could not back up the zone of {username}: {e}')
+
+    def user_zone_history(self, username: str) -> list[tuple[str, str]]:
+        '''Backed up versions of a user zone as (time, version), oldest first.'''
+        return self.snapshots.history(username)
+
+    def user_zone_version(self, username: str, version: str) -> tuple[str, str, str]:
+        '''
+        A backed up version of a user zone, by version id (or a unique prefix)
+        or by ISO time. Returns (time, version, zone). Raises SnapshotNotFound.
+        '''
+        when, digest = self.snapshots.find(username, version)
+        return when, digest, self.snapshots.get(digest)
+
+    def restore_user_zone(self, username: str, version: str) -> tuple[str, str]:
+        '''Sets a user zone back to a backed up version. Returns its (time, version).'''
+        with self.user_lock(username):
+            when, digest, zone_data = self.user_zone_version(username, version)
+            self._set_user_zonefile(username, zone_data, action=ACTION_RESTORE)
+        logger.info(f'Zone of {username} restored to version {digest[:12]} of {when}')
+        return when, digest
 
     def custom_records(self):
         try:
@@ -211,82 +728,263 @@ class ZoneManager(object):
         except:
             return ''
 
-    def reset_zonefile(self, origin: str, zone_template: str, zonefile: str|Path, user_list: list[str] = []) -> str:
+    def reset_zonefile(self, origin: str, zone_template: str, zonefile: str|Path, user_list: list[str] = [],
+                       includes: list[str] = []) -> str:
         logger.info(f'Resetting zone {zonefile}')
         if not self.public_ip:
             raise ZoneCreationError('No public IP')
         try:
             template = self.jinja_env.get_template(zone_template)
+            try:
+                serial = zone_text_serial(Path(zonefile).read_text())
+            except FileNotFoundError:
+                serial = None
             # TODO: get custom records only for main zone, not for all
             data = {
                     'origin': origin,
+                    'serial': next_serial(serial),
                     'ns_ip': self.public_ip,
                     'user_list': user_list,
+                    'includes': includes,
                     'custom_records': self.custom_records(),
                     }
             zone = template.render(data)
-            Path(zonefile).write_text(zone)
+            with metrics.ZONE_FILE_SECONDS.labels('write').time():
+                atomic_write_text(zonefile, zone)
             return zone
         except:
             raise ZoneCreationError()
 
 
     def reset_bind_conf(self) -> None:
-        '''Reads all user names from `users_dir` and resets bind config config for their zones.'''
-        user_list = self.find_user_list()
-        # self.reset_bind_conf_users(NAMED_CONF_LOCAL_TEMPLATE, NAMED_CONF_LOCAL_FILE, user_list)
+        '''Resets the bind config for the zones of the users in the index (only the shards that changed).'''
+        Path(USER_CONF_DIR).mkdir(exist_ok=True)
+        for shard in USER_SHARDS:
+            self.write_conf_shard(shard)
         self.write_template(NAMED_CONF_LOCAL_TEMPLATE, 
                             BIND_DIR, 
                             { 
                                 'origin': self.origin, 
-                                'user_list': user_list,
+                                'shards': USER_SHARDS,
+                                **self.transfer_settings(),
                             })
 
+    def transfer_settings(self) -> dict:
+        '''Template variables of the zone transfers to the secondaries (see zone-transfer.j2).'''
+        return {
+            'secondaries': self.secondaries,
+            'transfer_addresses': [secondary.split()[0] for secondary in self.secondaries],
+        }
+
+    def secondary_conf(self, primary: str, zones_dir: str) -> str:
+        '''Bind config of a secondary server of every zone, with its zone files in `zones_dir`.'''
+        return self.jinja_env.get_template(NAMED_CONF_SECONDARY_TEMPLATE).render({
+            'origin': self.origin,
+            'primary': primary,
+            'zones_dir': zones_dir.rstrip('/'),
+            'user_list': self.find_user_list(),
+        })
+
+    def reset_all_user_zonefiles(self, progress: RebuildProgress | None = None) -> RebuildProgress:
+        '''
+        Replaces the zone of every user in the index by a fresh one (e.g. after
+        a change of the root domain), then rewrites the Bind config and the
+        main zone and reloads Bind once.
+
+        Zones are rendered and checked on a process pool into a staging
+        directory; each checked zone then replaces the user's file atomically.
+        A user whose zone fails the checks keeps the old one and is reported
+        in `progress.failed`.
+        '''
+        progress = progress or RebuildProgress()
+        user_list = self.find_user_list()
+        progress.start(len(user_list))
+        if not self.public_ip:
+            progress.finish('No public IP')
+            raise ZoneCreationError('No public IP')
+        logger.info(f'Rebuilding {len(user_list)} user zones with {self.rebuild_workers} processes')
+        job = {
+            'template': Path(TEMPLATES_DIR, USER_ZONE_TEMPLATE).read_text(),
+            'ns_ip': self.public_ip,
+            'custom_records': self.custom_records(),
+        }
+
+        def rebuild(job: dict) -> None:
+            chunks = ((user_list[i:i + REBUILD_CHUNK],) for i in range(0, len(user_list), REBUILD_CHUNK))
+            self._replace_user_zones(render_user_zones, job, chunks, progress, ACTION_REBUILD)
+
+        return self._bulk_replace(ACTION_REBUILD, job, rebuild, progress)
+
+    def import_user_zones(self, entries: Iterable[dict], progress: RebuildProgress | None = None) -> RebuildProgress:
+        '''
+        Imports the user zones and tokens of an export (see zone_archive),
+        adding the users that are new; Bind is then reconfigured and reloaded
+        once. Entries are read lazily and checked on the process pool in
+        chunks, as in reset_all_user_zonefiles. A user whose zone fails the
+        checks, or whose token is another user's, is left as it was and
+        reported in `progress.failed`. If the input is cut short, what was
+        read is still applied and `progress.error` tells so.
+        '''
+        progress = progress or RebuildProgress()
+        if not progress.started:
+            progress.start(0)
+        if not self.public_ip:
+            progress.finish('No public IP')
+            raise ZoneCreationError('No public IP')
+        tokens = {}  # username: (token, active), until its zone is written
+        read_error = None
+
+        def chunks():
+            nonlocal read_error
+            usernames, zones = [], []
+            try:
+                for entry in entries:
+                    if entry['token'] is not None:
+                        tokens[entry['username']] = (entry['token'], entry['token_active'])
+                    if entry['zone'] is None:
+                        continue
+                    usernames.append(entry['username'])
+                    zones.append(entry['zone'])
+                    if len(usernames) == REBUILD_CHUNK:
+                        yield usernames, zones
+                        usernames, zones = [], []
+            except ArchiveError as e:
+                logger.error(f'Import cut short: {e}')
+                read_error = str(e)
+            if usernames:
+                yield usernames, zones
+
+        def import_zones(job: dict) -> str | None:
+            len(self.tokens)  # Reads the token index: conflicts are checked against it as it is now
+            imported = self._replace_user_zones(check_user_zones, job, chunks(), progress, ACTION_IMPORT, tokens)
+            for username, (token, active) in tokens.items():  # Tokens with no zone in the input
+                if username in self.users or username in imported:
+                    with self.user_lock(username):
+                        try:
+                            self.set_user_token(username, token, active)
+                        except ValueError as e:
+                            progress.fail(username, str(e))
+            self.users.add_many(imported)
+            return read_error
 
-    # def reset_bind_conf_users(self, template_file: str, conf_file: str, user_list: list[str]) -> None:
-    #     logger.info(f'Resetting bind config {conf_file}')
-    #     template = self.jinja_env.get_template(template_file)
-    #     data = { 
-    #             'origin': self.origin, 
-    #             'user_list': user_list,
-    #             }
-    #     print(data)
-    #     data = template.render(data)
-    #     Path(conf_file).write_text(data)
-
-    def reset_all_user_zonefiles(self) -> None:
-        '''Remove all user zone files and create new ones for user_list'''
-        users_dir = USER_ZONES_DIR
-        logger.info(f'Resetting user zones dir {users_dir}')
+        logger.info(f'Importing user zones with {self.rebuild_workers} processes')
+        return self._bulk_replace(ACTION_IMPORT, {}, import_zones, progress)
+
+    def _bulk_replace(self, name: str, job: dict, replace, progress: RebuildProgress) -> RebuildProgress:
+        '''
+        Common part of a bulk rebuild or import: runs `replace(job)`, which
+        stages the zones in job['staging_dir'] and puts them in place (frozen
+        with the update backend), then rewrites the Bind config and the main
+        zone and reloads Bind once. `replace` may return an error to report.
+        '''
+        staging_dir = Path(USER_ZONES_DIR.rstrip('/') + '.' + name)
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        staging_dir.mkdir()
+        job.update({
+            'origin': self.origin,
+            'zones_dir': USER_ZONES_DIR,
+            'staging_dir': str(staging_dir),
+            'validator': self.zone_validator,
+        })
+        dynamic = self.zone_backend == ZONE_BACKEND_UPDATE
         try:
-            shutil.rmtree(users_dir)
-            os.mkdir(users_dir)
-        except Exception as e:
-            logger.error(f'Error resetting user zone dir {users_dir}: {e}')
-        for user in self.find_user_list():
-            self.reset_user_zonefile(user)
-
-    def get_public_ip(self) -> str | None:
-        urls = [
-            "https://ifconfig.me",
-            "https://api.ipify.org",
-            "https://ipinfo.io/ip",
-            "https://icanhazip.com",
-        ]
-        for url in urls:
+            if dynamic:
+                # Bind must not write the journals over the new files
+                self.reloader.rndc('freeze')
             try:
-                response = requests.get(url)
-                if response.status_code == 200:
-                    logger.info(f'Found public IP {response.text} from {url}')
-                    ip = response.text.strip()
-                    ipaddress.IPv4Address(ip) # Throws if ip is invalid
-                    return ip
-            except:
-                logger.warning(f'Failed asking public IP to {url}')
-                continue
-        raise PublicIpNotFound()
+                error = replace(job)
+            finally:
+                if dynamic:
+                    self.reloader.rndc('thaw')
+            with self.config_lock:
+                self.reset_bind_conf()
+                self.reset_main_zone()
+            self.reloader.rndc('reload')
+        except NamedReloadError as e:
+            logger.error(f'Could not reload Bind after the bulk {name} of the user zones: {e}')
+            progress.finish(f'Bind reload failed: {e}')
+            return progress
+        except Exception as e:
+            progress.finish(str(e))
+            raise
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+        progress.finish(error)
+        logger.info(f'Bulk {name} wrote {progress.written} user zones, {len(progress.failed)} failed')
+        return progress
+
+    def _bulk_results(self, worker, job: dict, chunks: Iterable[tuple]) -> Iterator[tuple[tuple, list]]:
+        '''
+        Runs `worker(job, *chunk)` on a pool of `rebuild_workers` processes for
+        each of `chunks`, read lazily: only a couple of chunks per process are
+        in flight. Yields (chunk, results) as they complete. If a worker dies,
+        each user of its chunk (chunk[0]) gets the error.
+        '''
+        chunks = iter(chunks)
+        pending = {}
+        # spawn: forking a process with running threads (reloads, web app) is unsafe
+        with ProcessPoolExecutor(max_workers=self.rebuild_workers,
+                                 mp_context=multiprocessing.get_context('spawn')) as pool:
+            while True:
+                for chunk in chunks:
+                    pending[pool.submit(worker, job, *chunk)] = chunk
+                    if len(pending) >= 2 * self.rebuild_workers:
+                        break
+                if not pending:
+                    return
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    chunk = pending.pop(future)
+                    try:
+                        results = future.result()
+                    except Exception as e:  # The worker died
+                        results = [(username, None, f'Bulk worker failed: {e}') for username in chunk[0]]
+                    yield chunk, results
 
+    def _replace_user_zones(self, worker, job: dict, chunks: Iterable[tuple], progress: RebuildProgress,
+                            action: str, tokens: dict[str, tuple[str, bool]] | None = None) -> set[str]:
+        '''
+        Stages the zones of `chunks` with `worker` (see _bulk_results) and puts
+        each checked one in place, with its token from `tokens` if there is one.
+        Returns the users written.
+        '''
+        staging_dir = Path(job['staging_dir'])
+        written = set()
+        with ThreadPoolExecutor(max_workers=STARTUP_WORKERS, thread_name_prefix='zone-bulk') as writers:
+            writes = []
+            for chunk, results in self._bulk_results(worker, job, chunks):
+                for username, zone, error in results:
+                    token = tokens.pop(username, None) if tokens is not None else None
+                    if error:
+                        logger.error(f'Zone of user {username} failed checks: {error}')
+                        progress.fail(username, error)
+                        self.journal.record(username, action, metrics.UPDATE_BAD_ZONE, error=error)
+                    else:
+                        writes.append((username, writers.submit(self._replace_staged_zone, username, zone,
+                                                                staging_dir, progress, action, token)))
+                progress.add_checked(len(results))
+                logger.info(f'Checked {progress.checked} user zones')
+            for username, future in writes:
+                if future.result():
+                    written.add(username)
+        return written
 
+    def _replace_staged_zone(self, username: str, zone_data: str, staging_dir: Path, progress: RebuildProgress,
+                             action: str, token: tuple[str, bool] | None = None) -> bool:
+        with self.user_lock(username):
+            if token is not None:
+                try:
+                    self.set_user_token(username, *token)
+                except ValueError as e:
+                    progress.fail(username, str(e))
+                    return False
+            self._snapshot_previous(username)
+            os.replace(staging_dir / username, Path(USER_ZONES_DIR) / username)
+            self.zones.invalidate(username)
+            self._snapshot(username, zone_data)
+        progress.add_written()
+        self.journal.record(username, action, metrics.UPDATE_CHANGED)
+        return True
 
     def write_template(self, template, dir, data):
         name, extension = os.path.splitext(template)
@@ -304,94 +1002,328 @@ class ZoneManager(object):
         data = {'rndc_secret': rndc_secret}
         self.write_template(RNDC_CONF_TEMPLATE, BIND_DIR, data)
         self.write_template(NAMED_CONF_RNDC_TEMPLATE, BIND_DIR, data)
+        update_secret = base64.b64encode(secrets.token_bytes(32)).decode()
+        self.write_template(NAMED_CONF_UPDATE_TEMPLATE, BIND_DIR,
+                            {'update_key_name': UPDATE_KEY_NAME, 'update_secret': update_secret})
         self.write_template(NAMED_CONF_TEMPLATE, BIND_DIR, {})
 
-    def backup(self):
-        timestamp = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
-        bkp_dir = Path(BACKUPS_DIR) / timestamp
+    def backup(self) -> str | None:
+        '''
+        Full backup of the main zone, the Bind config and every user zone in the
+        snapshot store. Files unchanged since another backup take no extra space.
+        '''
+        files = {
+            'main-zone': Path(MAIN_ZONE_FILE),
+            'custom-records': Path(CUSTOM_RRS_FILE),
+            'named.conf.local': Path(BIND_DIR) / 'named.conf.local',
+        }
+        for username in self.find_user_list():
+            files[f'user-zones/{username}'] = Path(USER_ZONES_DIR) / username
         try:
-            bkp_dir.mkdir(parents=True, exist_ok=True)
-            shutil.copy2(MAIN_ZONE_FILE, bkp_dir)
-            shutil.copy2(CUSTOM_RRS_FILE, bkp_dir)
-            shutil.copytree(USER_ZONES_DIR, bkp_dir)
-            shutil.copy2('/etc/bind/named.conf.local', bkp_dir)
-        except Exception:
-            logger.error(f'Failed backup {bkp_dir}.')
+            name = self.snapshots.snapshot(files)
+        except OSError as e:
+            logger.error(f'Failed backup: {e}')
+            return None
+        logger.info(f'Backup {name} of {len(files)} files.')
+        return name
 
-    def zone_data_updating_record_a(self, username: str, hostname: str, ip: str, ttl=None) -> str:
-        # logger.info(f'Updating record for user {username}: {hostname} {ip} {ttl}')
+    def export_users(self) -> Iterator[dict]:
+        '''
+        Zone, token and zone modification time of every user, read one user
+        at a time for an export (see zone_archive). Users whose zone is gone
+        meanwhile are left out.
+        '''
+        if self.zone_backend == ZONE_BACKEND_UPDATE:
+            self.reloader.rndc('sync')  # Zone files up to date with the journals
+        for username in self.find_user_list():
+            zonefile = Path(USER_ZONES_DIR) / username
+            try:
+                modified = zonefile.stat().st_mtime
+                zone = zonefile.read_text()
+            except FileNotFoundError:
+                continue
+            token, active = self.read_user_token(username)
+            yield {
+                'username': username,
+                'zone': zone,
+                'token': token,
+                'token_active': active,
+                'modified': datetime.fromtimestamp(modified, timezone.utc).isoformat(timespec='seconds'),
+            }
+
+    def cached_user_zone(self, username: str) -> UserZoneView:
+        '''Like `user_zone_view` but fails instead of creating a missing zone.'''
+        view = self.zones.get(username)
+        if view:
+            return view
         zonefile = Path(USER_ZONES_DIR) / username
         if not zonefile.exists():
             logger.error(f'Failed updating record: zone file does not exist for user {username}')
             raise RecordUpdateError('Zone file does not exist')
-        zone_lines = zonefile.read_text().splitlines()
-        pattern = re.compile(rf'^{hostname}\s+(\d+\s+)?IN\s+A\s+\d+\.\d+\.\d+\.\d+')
-        record_found = False
-        updated_zone_data = []
-        ttl = f'{ttl}\t' if ttl else ''
-        for line in zone_lines:
-            if pattern.match(line):
-                updated_zone_data.append(f'{hostname}\t{ttl}IN\tA\t{ip}\n')
-                record_found = True
-            else:
-                updated_zone_data.append(line)
-        if not record_found:
-            updated_zone_data.append(f'{hostname}\t{ttl}IN\tA\t{ip}\n')
-            updated_zone_data.append('') # Ending newline mandatory for zone records
-        return '\n'.join(updated_zone_data)
+        return self._cache_user_zone(username, self.read_user_zonefile(zonefile))
+
+    def a_record_unchanged(self, username: str, hostname: str, ip: str, ttl=None) -> bool:
+        '''True if the cached zone already has the record. Never blocks: no file I/O on a cache miss.'''
+        view = self.zones.get(username)
+        return view is not None and view.has_a_record(hostname, ip, ttl)
+
+    def user_records(self, username: str, hostname: str, rdtype: str) -> tuple[int | None, list[str]]:
+        '''TTL and values of the records of type `rdtype` at `hostname`, from the cached zone.'''
+        view = self.cached_user_zone(username)
+        if view.zone is None:
+            raise RecordUpdateError('Zone can not be parsed')
+        try:
+            return view.zone.records(hostname, rdtype)
+        except ZoneValidationError as e:
+            raise RecordUpdateError(str(e))
+
+    def update_a_record(self, username: str, hostname: str, ip: str, ttl=None) -> bool:
+        '''
+        Sets the A record of `hostname` to `ip`.
+        Returns False, without touching any file or Bind, if the zone already has it.
+        '''
+        if self.cached_user_zone(username).has_a_record(hostname, ip, ttl):
+            metrics.ZONE_UPDATES.labels(metrics.UPDATE_UNCHANGED).inc()
+            return False
+        return self.replace_records(username, hostname, 'A', [ip], ttl)
+
+    def records_unchanged(self, username: str, entries: list[tuple]) -> bool:
+        '''Like `a_record_unchanged` for the (hostname, type, value, ttl) entries of `update_records`.'''
+        view = self.zones.get(username)
+        if view is None or view.zone is None:
+            return False
+        keys = [(hostname, rdtype.upper()) for hostname, rdtype, _, _ in entries]
+        if len(set(keys)) != len(keys):
+            return False
+        return all(view.zone.has_records(hostname, rdtype, [value], ttl) for hostname, rdtype, value, ttl in entries)
+
+    def update_records(self, username: str, entries: list[tuple]) -> list[bool]:
+        '''
+        Applies a batch of (hostname, type, value, ttl) entries as a single
+        zone change: one validation, one write and one reload. The entries
+        with the same hostname and type set the records together (like
+        several A records of one host). Returns for each entry whether its
+        records changed. Raises RecordBatchError, changing nothing, if any entry is wrong.
+        '''
+        changed = [False] * len(entries)
+
+        def apply(zone: UserZone) -> bool:
+            errors = {}
+            groups = {}
+            for i, (hostname, rdtype, value, ttl) in enumerate(entries):
+                try:
+                    groups.setdefault((zone.name(hostname), rdtype.upper()), []).append(i)
+                except ZoneValidationError as e:
+                    errors[i] = str(e)
+            for (name, rdtype), indexes in groups.items():
+                hostname = entries[indexes[0]][0]
+                try:
+                    group_changed = zone.replace(hostname, rdtype, [entries[i][2] for i in indexes],
+                                                 entries[indexes[-1]][3])
+                    zone.check([name])
+                except ZoneValidationError as e:
+                    errors.update((i, str(e)) for i in indexes)
+                    continue
+                for i in indexes:
+                    changed[i] = group_changed
+            if errors:
+                raise RecordBatchError(errors)
+            return any(changed)
+
+        self.edit_user_zone(username, apply)
+        return changed
+
+    def add_record(self, username: str, hostname: str, rdtype: str, value: str, ttl=None) -> bool:
+        return self.edit_user_zone(username, lambda zone: zone.add(hostname, rdtype, value, ttl))
+
+    def replace_records(self, username: str, hostname: str, rdtype: str, values: list[str], ttl=None) -> bool:
+        return self.edit_user_zone(username, lambda zone: zone.replace(hostname, rdtype, values, ttl))
+
+    def delete_records(self, username: str, hostname: str, rdtype: str | None = None, value: str | None = None) -> bool:
+        return self.edit_user_zone(username, lambda zone: zone.delete(hostname, rdtype, value))
+
+    def edit_user_zone(self, username: str, edit, if_match: set[str] | None = None) -> bool:
+        '''
+        Applies `edit(zone)` to a draft of the user's zone, bumps the SOA serial
+        and writes the zone. `edit` returns False if it changed nothing, and
+        then nothing is written. Returns whether the zone changed.
+        With `if_match` (ETags, or '*'), raises ZoneVersionMismatch unless
+        the zone is one of those versions.
+        '''
+        with self.user_lock(username):
+            for attempt in range(2):
+                view = self.cached_user_zone(username)
+                if if_match is not None and not if_match & {'*', view.etag}:
+                    raise ZoneVersionMismatch(f'The zone of {username} changed')
+                zone = view.zone
+                if zone is None:
+                    raise RecordUpdateError('The zone can not be edited by record, set the whole zone file')
+                draft = zone.draft()
+                try:
+                    if not edit(draft):
+                        metrics.ZONE_UPDATES.labels(metrics.UPDATE_UNCHANGED).inc()
+                        return False
+                    draft.bump_serial()
+                    draft.check()
+                except RecordBatchError as e:
+                    metrics.ZONE_UPDATES.labels(metrics.UPDATE_BAD_ZONE).inc()
+                    self.journal.record(username, ACTION_EDIT, metrics.UPDATE_BAD_ZONE, error=str(e))
+                    raise
+                except ZoneValidationError as e:
+                    metrics.ZONE_UPDATES.labels(metrics.UPDATE_BAD_ZONE).inc()
+                    self.journal.record(username, ACTION_EDIT, metrics.UPDATE_BAD_ZONE, error=str(e))
+                    raise BadZoneFile(e)
+                if self.zone_backend != ZONE_BACKEND_UPDATE:
+                    self._set_user_zonefile(username, draft.to_text(), draft, ACTION_EDIT)
+                    return True
+                try:
+                    self._update_user_zone(username, zone, draft)
+                    return True
+                except ZoneOutOfDate as e:
+                    if attempt:
+                        raise BadZoneFile(e)
+                    # Changed by another worker: get Bind's version in the file and edit that
+                    logger.info(f'{e}, editing it again')
+                    self.reloader.rndc('sync', self.user_zone_origin(username))
+                    self.zones.invalidate(username)
+
+    def add_user_record(self, username: str, hostname: str, rdtype: str, value: str, ttl=None,
+                        if_match: set[str] | None = None) -> tuple[dict, str]:
+        '''Adds one record. Returns it, as in UserZone.record_list(), and the ETag of the new zone.'''
+        with self.user_lock(username):
+            rid = None
+
+            def edit(zone: UserZone) -> bool:
+                nonlocal rid
+                rid = zone.record_id(hostname, rdtype, value)
+                return zone.add(hostname, rdtype, value, ttl)
+
+            self.edit_user_zone(username, edit, if_match)
+            view = self.cached_user_zone(username)
+            return view.zone.find_record(rid), view.etag
+
+    def patch_user_record(self, username: str, rid: str, hostname: str | None = None, value: str | None = None,
+                          ttl=None, if_match: set[str] | None = None) -> tuple[dict, str]:
+        '''Changes the record with id `rid` (see UserZone.patch_record). Returns it and the ETag of the new zone.'''
+        with self.user_lock(username):
+            new_rid = rid
+
+            def edit(zone: UserZone) -> bool:
+                nonlocal new_rid
+                record = zone.find_record(rid)
+                if record is None:
+                    raise RecordNotFound(f'No record {rid}')
+                new_rid = zone.record_id(record['name'] if hostname is None else hostname, record['type'],
+                                         record['value'] if value is None else value)
+                return zone.patch_record(rid, hostname, value, ttl)
 
-    def update_a_record(self, username: str, hostname: str, ip: str, ttl=None) -> None:
-        zone_data = self.zone_data_updating_record_a(username, hostname, ip, ttl)
-        self.set_user_zonefile(username, zone_data)
+            self.edit_user_zone(username, edit, if_match)
+            view = self.cached_user_zone(username)
+            return view.zone.find_record(new_rid), view.etag
+
+    def delete_user_record(self, username: str, rid: str, if_match: set[str] | None = None) -> str:
+        '''Deletes the record with id `rid`. Returns the ETag of the new zone.'''
+        with self.user_lock(username):
+
+            def edit(zone: UserZone) -> bool:
+                record = zone.find_record(rid)
+                if record is None:
+                    raise RecordNotFound(f'No record {rid}')
+                return zone.delete(record['name'], record['type'], record['value'])
+
+            self.edit_user_zone(username, edit, if_match)
+            return self.cached_user_zone(username).etag
+
+    def _update_user_zone(self, username: str, zone: UserZone, draft: UserZone) -> None:
+        '''Sends the checked edits of `draft` to Bind as a DNS UPDATE. The zone file is written by `sync_zones`.'''
+        start = time.perf_counter()
+        self._snapshot_previous(username)
+        try:
+            self.updater.send(zone, draft)
+        except ZoneOutOfDate:
+            raise
+        except DynamicUpdateError as e:
+            self.zones.invalidate(username)
+            metrics.ZONE_UPDATES.labels(metrics.UPDATE_RELOAD_FAILURE).inc()
+            logger.error(f'Update of the zone of {username} failed: {e}')
+            self.journal.record(username, ACTION_EDIT, metrics.UPDATE_RELOAD_FAILURE, time.perf_counter() - start,
+                                error=str(e))
+            raise BadZoneFile('Zone seems OK but there was an error updating Bind.')
+        zone_data = draft.to_text()
+        self._cache_user_zone(username, zone_data, draft)
+        self._snapshot(username, zone_data)
+        metrics.ZONE_UPDATES.labels(metrics.UPDATE_CHANGED).inc()
+        self.journal.record(username, ACTION_EDIT, metrics.UPDATE_CHANGED, time.perf_counter() - start,
+                            self._zone_changes(zone, draft))
 
     def generate_token(self) -> str:
         raw_token = secrets.token_hex(USER_TOKEN_LENGTH // 2)
         return '-'.join(raw_token[i:i+4] for i in range(0, len(raw_token), 4))
 
-    # TODO: Are we loading user tokens too many times?
     def generate_unique_token(self) -> str:
-        user_tokens = self.load_user_tokens()
         user_token = None
         while not user_token:
             token = self.generate_token()
-            if token not in user_tokens.values():
+            if not self.tokens.contains(token):
                 user_token = token
         return user_token
 
-    def load_user_tokens(self) -> Dict[str, str]:
-        tokens = {}
-        for f_name in Path(USER_TOKENS_DIR).iterdir():
-            try:
-                if f_name.is_file():
-                    username = f_name.stem
-                    status = f_name.suffix.lstrip('.')
-                    if status != 'inactive':
-                        tokens[username]= f_name.read_text()
-            except:
-                continue
-        return tokens
-
     def reset_user_token(self, username: str) -> str:
         token = self.generate_unique_token()
         token_file = Path(USER_TOKENS_DIR) / username
-        token_file.write_text(token)
+        # Written with a rename so the token dir mtime changes for other readers of the index
+        with self.tokens.writing():
+            atomic_write_text(token_file, token)
+            self.tokens.set(username, token, token_file)
         return token
 
+    def set_user_token(self, username: str, token: str, active: bool = True) -> None:
+        '''
+        Sets the token of a user, e.g. an imported one; disabled (a .inactive
+        file) if not `active`. Raises ValueError if another user has it.
+        '''
+        owner = self.tokens.owner(token)
+        if owner not in (None, username):
+            raise ValueError(f'The token of {username} is the one of {owner}')
+        token_file = Path(USER_TOKENS_DIR) / username
+        inactive_file = token_file.with_name(username + '.inactive')
+        with self.tokens.writing():
+            if active:
+                atomic_write_text(token_file, token)
+                inactive_file.unlink(missing_ok=True)
+                self.tokens.set(username, token, token_file)
+            else:
+                atomic_write_text(inactive_file, token)
+                token_file.unlink(missing_ok=True)
+                self.tokens.remove(username)
+
+    def read_user_token(self, username: str) -> tuple[str | None, bool]:
+        '''Token of a user as (token, active), (None, True) if it has none. Unlike get_user_token, creates none.'''
+        token_file = Path(USER_TOKENS_DIR) / username
+        for path, active in ((token_file, True), (token_file.with_name(username + '.inactive'), False)):
+            try:
+                return path.read_text().strip(), active
+            except FileNotFoundError:
+                continue
+        return None, True
+
     # TODO: implement token expiration
     def get_user_token(self, username: str) -> str:
-        user_tokens = self.load_user_tokens()
-        if username in user_tokens:
-            return user_tokens[username]
-        else:
-            return self.reset_user_token(username)
+        token_file = Path(USER_TOKENS_DIR) / username
+        try:
+            token = token_file.read_text().strip()
+            if token:
+                return token
+        except FileNotFoundError:
+            pass
+        return self.reset_user_token(username)
 
     def delete_user_token(self, username) -> None:
         token_file = Path(USER_TOKENS_DIR) / username
-        token_file.unlink(missing_ok=True)
+        with self.tokens.writing():
+            token_file.unlink(missing_ok=True)
+            self.tokens.remove(username)
 
     def find_user_for_token(self, token: str) -> str|None:
-        user_tokens = self.load_user_tokens()
-        for user_name, user_token in user_tokens.items():
-            if user_token == token:
-                return user_name
-        return None
+        with metrics.TOKEN_LOOKUP_SECONDS.time():
+            return self.tokens.lookup(token)
@@ -0,0 +1,362 @@
+import asyncio
+import logging
+import os
+import struct
+import threading
+import time
+
+import dns.exception
+import dns.flags
+import dns.message
+import dns.name
+import dns.opcode
+import dns.rcode
+import dns.rdataclass
+import dns.rdatatype
+import dns.rrset
+import dns.zone
+
+from pathlib import Path
+
+
+logger = logging.getLogger(__name__)
+
+MAX_CNAME_CHAIN = 8
+MAX_CACHED_ANSWERS = 1000  # Encoded answers kept per zone
+UDP_PAYLOAD = 1232  # EDNS payload we announce (DNS flag day 2020)
+MIN_UDP_PAYLOAD = 512
+USERS_REFRESH = 1  # Seconds the user index is trusted by the responder before it is read again
+
+
+class ZoneNotLoaded(Exception):
+    '''The zone of a query must be read from disk first (see Responder.load).'''
+
+    def __init__(self, zone_key: str) -> None:
+        super().__init__(f'Zone {zone_key or "main"} not loaded')
+        self.zone_key = zone_key
+
+
+class ZoneAnswers(object):
+    '''Encoded answers of one version of a zone. A new version of the zone gets a new, empty ZoneAnswers.'''
+
+    def __init__(self, version, zone: dns.zone.Zone | None) -> None:
+        self.version = version
+        self.zone = zone
+        self.wires: dict[tuple, bytes] = {}
+        self._names = None
+
+    @property
+    def names(self) -> set[dns.name.Name]:
+        '''Names in the zone, including the empty non-terminals (names with data only below them).'''
+        if self._names is None:
+            names = set()
+            for name in self.zone.nodes:
+                while name not in names and name != self.zone.origin:
+                    names.add(name)
+                    name = name.parent()
+            names.add(self.zone.origin)
+            self._names = names
+        return self._names
+
+
+class Responder(object):
+    '''
+    Authoritative answers for the main zone and the user zones, from the
+    zones ZoneManager keeps in memory. A query for <user>.<origin> or below
+    is answered from the zone of that user, so the delegations of the main
+    zone are never needed.
+
+    Answers are encoded once per zone version and question, and reused with
+    the ID of each new query. Every change of a zone gives a new zone object,
+    which drops the answers of the old one.
+    '''
+
+    def __init__(self, zonemgr, main_zone_file: str | Path) -> None:
+        self.zonemgr = zonemgr
+        self.origin = dns.name.from_text(zonemgr.origin)
+        self.main_zone_file = Path(main_zone_file)
+        self._main_zone = None
+        self._main_mtime = None
+        self._main_lock = threading.Lock()
+        self._answers: dict[str, ZoneAnswers] = {}
+        self._users_read = None  # Monotonic time the user index was last refreshed, out of the event loop
+
+    def _main_zone_mtime(self):
+        try:
+            st = os.stat(self.main_zone_file)
+            return st.st_ino, st.st_mtime_ns, st.st_size
+        except OSError:
+            return None
+
+    def load(self, zone_key: str) -> None:
+        '''
+        Reads a zone from disk, refreshing the user index first. Blocking: run
+        it out of the event loop. A key that is no user loads the main zone.
+        '''
+        if zone_key:
+            is_user = zone_key in self.zonemgr.users
+            self._users_read = time.monotonic()
+            if is_user:
+                self.zonemgr.cached_user_zone(zone_key)
+                return
+        with self._main_lock:
+            mtime = self._main_zone_mtime()
+            if mtime == self._main_mtime:
+                return
+            # The $INCLUDEd delegations are left out: the user zones are answered directly
+            text = ''.join(line for line in self.main_zone_file.read_text().splitlines(keepends=True)
+                           if not line.startswith('$INCLUDE'))
+            try:
+                zone = dns.zone.from_text(text, origin=self.origin, relativize=False, check_origin=False)
+            except (dns.exception.DNSException, ValueError) as e:
+                logger.error(f'Can not serve the main zone: {e}')
+                zone = None
+            self._main_zone, self._main_mtime = zone, mtime
+
+    def _zone(self, qname: dns.name.Name) -> tuple[str, object, dns.zone.Zone | None]:
+        '''(zone key, version, zone) of the zone answering `qname`. Raises ZoneNotLoaded.'''
+        labels = qname.relativize(self.origin).labels
+        if labels:
+            username = labels[-1].decode().lower()
+            view = self.zonemgr.zones.get(username)
+            if view is not None:  # Only the users have a cached zone
+                return username, view.zone, view.zone.zone if view.zone else None
+            # The user index is read from disk in load(), not here in the event loop
+            if self._users_read is None or time.monotonic() - self._users_read >= USERS_REFRESH \
+                    or self.zonemgr.users.known(username):
+                raise ZoneNotLoaded(username)
+        if self._main_mtime is None or self._main_zone_mtime() != self._main_mtime:
+            raise ZoneNotLoaded('')
+        return '', self._main_zone, self._main_zone
+
+    def handle(self, wire: bytes, udp: bool = False) -> bytes | None:
+        '''
+        Response to the query in `wire`. Over UDP it is truncated (TC) if it
+        does not fit the payload of the client. None if `wire` is not even a
+        DNS query header. Raises ZoneNotLoaded.
+        '''
+        try:
+            query = dns.message.from_wire(wire)
+        except dns.exception.DNSException:
+            return _error_header(wire, dns.rcode.FORMERR)
+        if query.opcode() != dns.opcode.QUERY:
+            return _error_header(wire, dns.rcode.NOTIMP)
+        if len(query.question) != 1:
+            return _error_header(wire, dns.rcode.FORMERR)
+        question = query.question[0]
+        max_size = None
+        if udp:
+            max_size = max(MIN_UDP_PAYLOAD, min(query.payload, UDP_PAYLOAD)) if query.edns >= 0 else MIN_UDP_PAYLOAD
+        if question.rdclass != dns.rdataclass.IN or not question.name.is_subdomain(self.origin) \
+                or question.rdtype in (dns.rdatatype.AXFR, dns.rdatatype.IXFR):
+            return self._encode(self._response(query, dns.rcode.REFUSED), max_size)
+
+        zone_key, version, zone = self._zone(question.name)
+        answers = self._answers.get(zone_key)
+        if answers is None or answers.version is not version:
+            answers = self._answers[zone_key] = ZoneAnswers(version, zone)
+        key = (question.name.labels, question.rdtype, query.flags & dns.flags.RD, query.edns >= 0)
+        cached = answers.wires.get(key)
+        if cached is None:
+            response = self._response(query)
+            if zone is None:
+                response.set_rcode(dns.rcode.SERVFAIL)
+            else:
+                self._resolve(answers, question.name, question.rdtype, response)
+            cached = response.to_wire(max_size=65535)
+            if len(answers.wires) >= MAX_CACHED_ANSWERS:
+                answers.wires.clear()
+            answers.wires[key] = cached
+        if max_size is not None and len(cached) > max_size:
+            response = self._response(query)
+            response.flags |= dns.flags.TC
+            return self._encode(response, max_size)
+        return wire[:2] + cached[2:]
+
+    def _response(self, query: dns.message.Message, rcode: int = dns.rcode.NOERROR) -> dns.message.Message:
+        response = dns.message.make_response(query, our_payload=UDP_PAYLOAD)
+        response.set_rcode(rcode)
+        return response
+
+    def _encode(self, response: dns.message.Message, max_size: int | None) -> bytes:
+        return response.to_wire(max_size=max_size or 65535)
+
+    def _resolve(self, answers: ZoneAnswers, qname: dns.name.Name, rdtype: int,
+                 response: dns.message.Message) -> None:
+        '''Fills `response` with the authoritative answer of `answers.zone` (RFC 1034, 4.3.2).'''
+        zone = answers.zone
+        response.flags |= dns.flags.AA
+        name = qname
+        for _ in range(MAX_CNAME_CHAIN):
+            cut = self._zone_cut(zone, name)
+            if cut is not None:
+                if not response.answer:
+                    response.flags &= ~dns.flags.AA
+                self._add(response.authority, cut, zone.get_rdataset(cut, dns.rdatatype.NS))
+                self._add_glue(zone, response, zone.get_rdataset(cut, dns.rdatatype.NS))
+                return
+            node = zone.get_node(name)
+            if node is None:
+                node = self._wildcard(answers, name)
+            if node is None:
+                if name not in answers.names:
+                    response.set_rcode(dns.rcode.NXDOMAIN)
+                self._add_soa(zone, response)
+                return
+            if rdtype == dns.rdatatype.ANY:
+                for rdataset in node:
+                    self._add(response.answer, name, rdataset)
+                return
+            rdataset = node.get_rdataset(dns.rdataclass.IN, rdtype)
+            if rdataset is not None:
+                self._add(response.answer, name, rdataset)
+                if rdtype == dns.rdatatype.NS:
+                    self._add_glue(zone, response, rdataset)
+                return
+            cname = node.get_rdataset(dns.rdataclass.IN, dns.rdatatype.CNAME)
+            if cname is None:
+                self._add_soa(zone, response)
+                return
+            self._add(response.answer, name, cname)
+            name = cname[0].target
+            if not name.is_subdomain(zone.origin):
+                return
+
+    def _zone_cut(self, zone: dns.zone.Zone, name: dns.name.Name) -> dns.name.Name | None:
+        '''Highest name between the apex (excluded) and `name` delegated with NS records, if any.'''
+        labels = name.relativize(zone.origin).labels
+        for i in range(len(labels) - 1, -1, -1):
+            candidate = dns.name.Name(labels[i:] + zone.origin.labels)
+            if zone.get_rdataset(candidate, dns.rdatatype.NS) is not None:
+                return candidate
+        return None
+
+    def _wildcard(self, answers: ZoneAnswers, name: dns.name.Name):
+        '''Node of the wildcard matching `name` (RFC 4592), if any.'''
+        encloser = name.parent()
+        while encloser not in answers.names:  # The apex is always there
+            encloser = encloser.parent()
+        return answers.zone.get_node(dns.name.Name((b'*',) + encloser.labels))
+
+    def _add(self, section: list, name: dns.name.Name, rdataset) -> None:
+        rrset = dns.rrset.RRset(name, rdataset.rdclass, rdataset.rdtype, rdataset.covers)
+        rrset.update(rdataset)
+        section.append(rrset)
+
+    def _add_soa(self, zone: dns.zone.Zone, response: dns.message.Message) -> None:
+        soa = zone.get_rdataset(zone.origin, dns.rdatatype.SOA)
+        if soa is None:
+            return
+        rrset = dns.rrset.RRset(zone.origin, soa.rdclass, soa.rdtype)
+        rrset.update(soa)
+        rrset.ttl = min(soa.ttl, soa[0].minimum)  # Negative caching TTL (RFC 2308)
+        response.authority.append(rrset)
+
+    def _add_glue(self, zone: dns.zone.Zone, response: dns.message.Message, ns) -> None:
+        for rdata in ns:
+            if not rdata.target.is_subdomain(zone.origin):
+                continue
+            for rdtype in (dns.rdatatype.A, dns.rdatatype.AAAA):
+                rdataset = zone.get_rdataset(rdata.target, rdtype)
+                if rdataset is not None:
+                    self._add(response.additional, rdata.target, rdataset)
+
+
+def _error_header(wire: bytes, rcode: int) -> bytes | None:
+    '''Bare response header with `rcode` to a query that can not be (fully) parsed.'''
+    if len(wire) < 12:
+        return None
+    query_id, flags = struct.unpack('!HH', wire[:4])
+    if flags & dns.flags.QR:
+        return None  # Never answer a response
+    flags = dns.flags.QR | (flags & (0x7800 | dns.flags.RD)) | rcode  # Same opcode and RD
+    return struct.pack('!HHHHHH', query_id, flags, 0, 0, 0, 0)
+
+
+class _UdpProtocol(asyncio.DatagramProtocol):
+
+    def __init__(self, server: 'DnsServer') -> None:
+        self.server = server
+        self.transport = None
+
+    def connection_made(self, transport) -> None:
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        try:
+            # Fast path: zone in memory, answered without leaving this callback
+            response = self.server.responder.handle(data, udp=True)
+        except ZoneNotLoaded:
+            asyncio.ensure_future(self._answer_later(data, addr))
+            return
+        except Exception as e:
+            logger.error(f'Failed answering a DNS query from {addr[0]}: {e}')
+            response = _error_header(data, dns.rcode.SERVFAIL)
+        if response:
+            self.transport.sendto(response, addr)
+
+    async def _answer_later(self, data: bytes, addr) -> None:
+        response = await self.server.answer(data, udp=True)
+        if response and not self.transport.is_closing():
+            self.transport.sendto(response, addr)
+
+
+class DnsServer(object):
+    '''
+    Built-in authoritative DNS server over UDP and TCP, an alternative to
+    Bind for tests and small deployments. Runs in the event loop of the web
+    app, so a zone change is served as soon as ZoneManager caches it.
+    Several worker processes can share the port (SO_REUSEPORT).
+    '''
+
+    def __init__(self, responder: Responder, address: str = '0.0.0.0', port: int = 53) -> None:
+        self.responder = responder
+        self.address = address
+        self.port = port
+        self._udp = None
+        self._tcp = None
+
+    async def start(self) -> None:
+        loop = asyncio.get_running_loop()
+        self._udp, _ = await loop.create_datagram_endpoint(lambda: _UdpProtocol(self),
+                                                           local_addr=(self.address, self.port), reuse_port=True)
+        self._tcp = await asyncio.start_server(self._handle_tcp, self.address, self.port, reuse_port=True)
+        logger.info(f'DNS server listening on {self.address} port {self.port} (UDP and TCP)')
+
+    async def stop(self) -> None:
+        if self._udp:
+            self._udp.close()
+        if self._tcp:
+            self._tcp.close()
+            await self._tcp.wait_closed()
+
+    async def answer(self, wire: bytes, udp: bool = False) -> bytes | None:
+        '''Like Responder.handle, reading the zone from disk first if needed.'''
+        loop = asyncio.get_running_loop()
+        for _ in range(2):
+            try:
+                return self.responder.handle(wire, udp)
+            except ZoneNotLoaded as e:
+                try:
+                    await loop.run_in_executor(None, self.responder.load, e.zone_key)
+                except Exception as e:
+                    logger.error(f'Failed loading a zone to answer a DNS query: {e}')
+                    break
+            except Exception as e:
+                logger.error(f'Failed answering a DNS query: {e}')
+                break
+        return _error_header(wire, dns.rcode.SERVFAIL)
+
+    async def _handle_tcp(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                length = struct.unpack('!H', await reader.readexactly(2))[0]
+                response = await self.answer(await reader.readexactly(length))
+                if response is None:
+                    break
+                writer.write(struct.pack('!H', len(response)) + response)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
@@ -0,0 +1,101 @@
+import logging
+import os
+import re
+
+import dns.exception
+import dns.name
+import dns.query
+import dns.rcode
+import dns.tsig
+import dns.tsigkeyring
+import dns.update
+
+from pathlib import Path
+
+from . import metrics
+from .zone_model import UserZone
+
+
+logger = logging.getLogger(__name__)
+
+UPDATE_KEY_NAME = 'platform-update'
+UPDATE_KEY_ALGORITHM = dns.tsig.HMAC_SHA256
+UPDATE_TIMEOUT = 5  # Seconds to wait for Bind to answer an update
+SECRET_RE = re.compile(r'secret\s+"([^"]+)"')
+
+
+class DynamicUpdateError(Exception):
+    pass
+
+class ZoneOutOfDate(DynamicUpdateError):
+    '''The zone in Bind is not the version the update was made from.'''
+    pass
+
+
+class DynamicUpdater(object):
+    '''
+    Sends the record edits of a UserZone draft to Bind as a TSIG-signed DNS
+    UPDATE (RFC 2136). Bind applies it in memory and writes it to the zone
+    journal, with no zone file to write, check or reload.
+
+    The key is read from the Bind config file `key_file` (named.conf.update),
+    again whenever the file changes.
+    '''
+
+    def __init__(self, key_file: str | Path, server: str = '127.0.0.1', port: int = 53) -> None:
+        self.key_file = Path(key_file)
+        self.server = server
+        self.port = port
+        self._keyring = None
+        self._key_mtime = None
+
+    def keyring(self) -> dict:
+        mtime = os.stat(self.key_file).st_mtime_ns
+        if mtime != self._key_mtime:
+            match = SECRET_RE.search(self.key_file.read_text())
+            if not match:
+                raise DynamicUpdateError(f'No update key in {self.key_file}')
+            self._keyring = dns.tsigkeyring.from_text({UPDATE_KEY_NAME: (UPDATE_KEY_ALGORITHM, match.group(1))})
+            self._key_mtime = mtime
+        return self._keyring
+
+    def make_update(self, old: UserZone, new: UserZone) -> dns.update.UpdateMessage:
+        '''
+        Update turning `old` into `new`, a draft of it: the rdatasets of the
+        names touched by the draft. The SOA of `old` is a prerequisite, so the
+        update is refused if the zone changed in Bind meanwhile.
+        '''
+        update = dns.update.UpdateMessage(old.origin, keyring=self.keyring(),
+                                          keyname=UPDATE_KEY_NAME, keyalgorithm=UPDATE_KEY_ALGORITHM)
+        update.present(old.origin, old.soa)
+        for name in sorted(new.touched):
+            old_node = old.zone.nodes.get(name)
+            new_node = new.zone.nodes.get(name)
+            if new_node is None:
+                if old_node is not None:
+                    update.delete(name)
+                continue
+            # Deletions first: a CNAME may replace other data
+            for rdataset in old_node or ():
+                if new_node.get_rdataset(rdataset.rdclass, rdataset.rdtype, rdataset.covers) is None:
+                    update.delete(name, rdataset.rdtype)
+            for rdataset in new_node:
+                previous = old_node.get_rdataset(rdataset.rdclass, rdataset.rdtype, rdataset.covers) \
+                    if old_node is not None else None
+                if previous is None or previous.ttl != rdataset.ttl or set(previous) != set(rdataset):
+                    update.replace(name, rdataset)
+        return update
+
+    def send(self, old: UserZone, new: UserZone) -> None:
+        '''Applies `new`, a draft of `old`, in Bind. Raises ZoneOutOfDate or DynamicUpdateError.'''
+        try:
+            update = self.make_update(old, new)
+            with metrics.NAMED_UPDATE_SECONDS.time():
+                response = dns.query.tcp(update, self.server, port=self.port, timeout=UPDATE_TIMEOUT)
+        except (OSError, dns.exception.DNSException) as e:
+            raise DynamicUpdateError(f'Update of zone {old.origin} failed: {e}')
+        rcode = response.rcode()
+        if rcode == dns.rcode.NXRRSET:
+            raise ZoneOutOfDate(f'Zone {old.origin} changed in Bind')
+        if rcode != dns.rcode.NOERROR:
+            raise DynamicUpdateError(f'Update of zone {old.origin} refused: {dns.rcode.to_text(rcode)}')
@@ -0,0 +1,26 @@
+import os
+
+from pathlib import Path
+
+
+def atomic_write_text(path: str | Path, data: str) -> None:
+    '''Writes `data` to a temporary file next to `path` and renames it over `path`.'''
+    path = Path(path)
+    tmp = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+    try:
+        tmp.write_text(data)
+        os.replace(tmp, path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+
+def atomic_write_text_if_changed(path: str | Path, data: str) -> bool:
+    '''Like atomic_write_text, but leaves `path` untouched if it already has `data`. Returns True if written.'''
+    try:
+        if Path(path).read_text() == data:
+            return False
+    except OSError:
+        pass
+    atomic_write_text(path, data)
+    return True
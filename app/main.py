@@ -1,10 +1,17 @@
+import ipaddress
 import logging
+import math
+import tempfile
+import threading
 
-from fastapi import FastAPI, Request, HTTPException, status, Security
-from fastapi.responses import HTMLResponse, PlainTextResponse, JSONResponse
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from fastapi import FastAPI, Request, HTTPException, status, Security, Depends
+from fastapi.responses import HTMLResponse, PlainTextResponse, JSONResponse, Response, StreamingResponse
 from fastapi.security import APIKeyHeader, APIKeyQuery
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
+from starlette.concurrency import run_in_threadpool
 
 from pydantic_settings import BaseSettings
 
@@ -12,7 +19,22 @@ from fastapi import FastAPI, Query, Body, HTTPException
 from pydantic import BaseModel, Field
 from typing import Optional
 
-from .dns_manager import ZoneManager, BadZoneFile, RecordUpdateError
+from . import metrics
+from .dns_manager import ZoneManager, BadZoneFile, RecordUpdateError, RecordBatchError, RecordNotFound, \
+    ZoneVersionMismatch, MAIN_ZONE_FILE, DNS_SERVER_BUILTIN
+from .dns_server import DnsServer, Responder
+from .bulk_rebuild import RebuildProgress
+from .snapshots import SnapshotNotFound
+from .named_manager import NAMED_PID_FILE
+from .public_ip import PUBLIC_IP_PROVIDERS
+from .rate_limit import TokenBucketLimiter
+from .zone_archive import ArchiveError, archive_header, read_archive, write_ndjson, write_tar, FORMATS, FORMAT_TAR
+from .zone_queue import ZoneWorkQueue, ZoneQueueFull
+
+
+BATCH_MAX_ENTRIES = 100
+IMPORT_SPOOL_MEMORY = 16 * 1024 * 1024  # Bytes of an uploaded import kept in memory, the rest goes to a temp file
+DYNDNS_TYPES = ('A', 'AAAA')
 
 
 class Settings(BaseSettings):
@@ -20,22 +42,114 @@ class Settings(BaseSettings):
     website_url: str = "http://localhost"
     testing_mode: bool = False
     testing_user: str = 'user'
+    reload_window: float = 0  # Seconds to wait for more zone changes before loading a batch (0: load what is queued)
+    reload_workers: int = 4  # Zones of a batch reloaded in parallel
+    zone_validator: str = 'dnspython'  # dnspython, named-checkzone or both
+    zone_workers: int = 16  # Threads running zone operations (different users in parallel)
+    zone_queue_depth: int = 1000  # Zone operations waiting or running before answering 503
+    web_concurrency: int = 1  # Worker processes, read by uvicorn too. Above 1 enables multi-worker mode
+    public_ip_providers: list[str] = PUBLIC_IP_PROVIDERS  # URLs answering with the caller's IPv4 as plain text
+    public_ip_timeout: float = 3.0  # Seconds to wait for the public IP providers
+    admin_users: list[str] = []  # Users allowed in the admin routes
+    admin_group: str = 'dns_admin'  # Members of this group (remote-groups header) are admins too
+    backup_retention_days: float = 30  # Days the zone versions and full backups are kept
+    backup_keep_last: int = 20  # Versions of each zone (and full backups) kept regardless of age
+    secondaries: list[str] = []  # Secondary servers notified of the changes: "address" or "address port N"
+    primary_address: str = ''  # Address the secondaries transfer the zones from. Default: the public IP
+    zone_backend: str = 'file'  # Record edits as zone file rewrite and reload (file) or DNS UPDATE to Bind (update)
+    update_sync_interval: float = 60  # Seconds between writes of the zone journals to the files (update backend)
+    dns_server: str = 'named'  # What answers DNS queries: named (Bind) or builtin (app/dns_server.py, no Bind needed)
+    dns_server_address: str = '0.0.0.0'  # Address and port of the built-in DNS server
+    dns_server_port: int = 53
+    named_pid_file: str = NAMED_PID_FILE  # pid-file of the options of named.conf
+    update_rate: float = 0.1  # Dyndns updates per second allowed per API token (0: no limit)
+    update_burst: int = 10  # Dyndns updates per API token allowed at once, above update_rate
+    rebuild_workers: int = 0  # Processes rendering and checking zones in a bulk rebuild (0: one per CPU)
+    log_level: str = 'INFO'
+    journal_max_bytes: int = 10 * 1024 * 1024  # Size of the change journal file before it is rotated
+    journal_backups: int = 5  # Rotated change journal files kept
 
 
+settings = Settings()
+
 logger = logging.getLogger(__name__)
-logging.basicConfig(level=logging.DEBUG)
+logging.basicConfig(level=settings.log_level.upper())
 
-settings = Settings()
-app = FastAPI()
+zonemgr = ZoneManager(settings.root_domain,
+                      reload_window=settings.reload_window,
+                      reload_workers=settings.reload_workers,
+                      zone_validator=settings.zone_validator,
+                      multi_worker=settings.web_concurrency > 1,
+                      public_ip_providers=settings.public_ip_providers,
+                      public_ip_timeout=settings.public_ip_timeout,
+                      backup_retention_days=settings.backup_retention_days,
+                      backup_keep_last=settings.backup_keep_last,
+                      secondaries=settings.secondaries,
+                      zone_backend=settings.zone_backend,
+                      update_sync_interval=settings.update_sync_interval,
+                      dns_server=settings.dns_server,
+                      rebuild_workers=settings.rebuild_workers,
+                      journal_max_bytes=settings.journal_max_bytes,
+                      journal_backups=settings.journal_backups,
+                      named_pid_file=settings.named_pid_file)
+zone_queue = ZoneWorkQueue(settings.zone_workers, settings.zone_queue_depth)
+update_limiter = TokenBucketLimiter(settings.update_rate, settings.update_burst)
+rebuild_progress = RebuildProgress()  # Of the last bulk rebuild or import run by this worker
+metrics.USER_ZONES.set_function(lambda: len(zonemgr.users))
+metrics.ZONE_QUEUE_PENDING.set_function(lambda: zone_queue.pending)
+if zonemgr.named:
+    metrics.NAMED_UP.set_function(lambda: int(zonemgr.named.alive()))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Bind is checked and started in the background, see /readyz
+    zonemgr.start()
+    dns_server = None
+    if settings.dns_server == DNS_SERVER_BUILTIN:
+        dns_server = DnsServer(Responder(zonemgr, MAIN_ZONE_FILE), settings.dns_server_address,
+                               settings.dns_server_port)
+        await dns_server.start()
+    yield
+    if dns_server:
+        await dns_server.stop()
+    zone_queue.shutdown()
+    zonemgr.journal.stop()
+
+
+app = FastAPI(lifespan=lifespan)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 templates = Jinja2Templates(directory="templates/")
-zonemgr = ZoneManager(settings.root_domain)
 
 # For user tokens
 api_key_query = APIKeyQuery(name="api_key", auto_error=False)
 api_key_header = APIKeyHeader(name="x-api-key", auto_error=False)
 
+def queue_full_error(e: ZoneQueueFull) -> HTTPException:
+    logger.warning(f'Zone queue full: {e}')
+    return HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                         detail='Server busy. Try again later.',
+                         headers={'Retry-After': '1'})
+
+
+def check_update_rate(username: str) -> None:
+    '''Refuses the update with 429 if the token of `username` is over its rate.'''
+    wait = update_limiter.acquire(username)
+    if wait:
+        metrics.ZONE_UPDATES.labels(metrics.UPDATE_RATE_LIMITED).inc()
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                            detail='Too many updates. Try again later.',
+                            headers={'Retry-After': str(math.ceil(wait))})
+
+
+def zones_ready() -> None:
+    if not zonemgr.ready.is_set():
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            detail='Starting up. Try again later.',
+                            headers={'Retry-After': '5'})
+
+
 def check_user(request):
     username = request.headers.get('remote-user')
     if not username and settings.testing_mode:
@@ -45,6 +159,16 @@ def check_user(request):
     return username
 
 
+def check_admin(request):
+    username = check_user(request)
+    if settings.testing_mode or username in settings.admin_users:
+        return username
+    groups = [g.strip() for g in request.headers.get('remote-groups', '').split(',')]
+    if settings.admin_group in groups:
+        return username
+    raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admins only.")
+
+
 @app.get('/', response_class=HTMLResponse)
 async def read_root(request: Request):
     username = request.headers.get('remote-user')
@@ -55,44 +179,188 @@ async def read_root(request: Request):
                 "username": username,
               }
         return templates.TemplateResponse(request=request, name="html/index.html", context=ctx)
+    zones_ready()
+    try:
+        user_token = await zone_queue.run(username, zonemgr.get_user_token, username)
+    except ZoneQueueFull as e:
+        raise queue_full_error(e)
+    # The zone itself is fetched by the page from /zone
     ctx = {
             "username": username,
             "user_origin": zonemgr.user_zone_origin(username),
-            "user_zone": zonemgr.get_user_zonefile(username),
             "testing_mode": settings.testing_mode,
-            "user_token": zonemgr.get_user_token(username),
+            "user_token": user_token,
             "website_url": settings.website_url,
           }
     return templates.TemplateResponse(request=request, name="html/user.html", context=ctx)
 
 
+@app.get('/readyz')
+async def readiness():
+    if zonemgr.ready.is_set():
+        return {'status': 'ready'}
+    if zonemgr.startup_error:
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            content={'status': 'failed', 'error': str(zonemgr.startup_error)})
+    return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content={'status': 'starting'})
+
+
+@app.get('/healthz')
+async def health():
+    '''
+    For load balancers and monitoring: 200 while the zones are served, 503
+    before startup ends or while Bind is down. Cheap to poll, Bind's status
+    is cached for a few seconds.
+    '''
+    if not zonemgr.ready.is_set():
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                            content={'status': 'failed' if zonemgr.startup_error else 'starting'})
+    health = await run_in_threadpool(zonemgr.health)
+    code = status.HTTP_200_OK if health['status'] == 'ok' else status.HTTP_503_SERVICE_UNAVAILABLE
+    return JSONResponse(status_code=code, content=health)
+
+
 @app.get('/headers')
 async def read_headers(request: Request):
-    check_user(request)
-    # TODO: check user belongs to group dns_admin
+    check_admin(request)
     headers = dict(request.headers)
     return JSONResponse(content=headers)
 
 
 
-@app.get('/zonefile', response_class=PlainTextResponse)
-def read_user_zone(request: Request):
+def parse_etags(header: str | None) -> set[str] | None:
+    '''ETags of an If-Match or If-None-Match header, None without the header.'''
+    if header is None:
+        return None
+    return {tag.strip().removeprefix('W/').strip('"') for tag in header.split(',') if tag.strip()}
+
+
+def etag_headers(etag: str) -> dict[str, str]:
+    # no-cache: the browser keeps the response but asks with If-None-Match every time
+    return {'ETag': f'"{etag}"', 'Cache-Control': 'no-cache'}
+
+
+def not_modified(request: Request, etag: str) -> bool:
+    tags = parse_etags(request.headers.get('if-none-match'))
+    return tags is not None and bool(tags & {'*', etag})
+
+
+async def user_zone_view(username: str):
+    '''Zone view of the user, from the cache if possible (no file read, no queue).'''
+    view = zonemgr.zones.get(username)
+    if view is not None:
+        return view
     try:
-        username = check_user(request)
-        zone = zonemgr.get_user_zonefile(username)
-        return zone
+        return await zone_queue.run(username, zonemgr.user_zone_view, username)
+    except ZoneQueueFull as e:
+        raise queue_full_error(e)
+
+
+@app.get('/zonefile', response_class=PlainTextResponse, dependencies=[Depends(zones_ready)])
+async def read_user_zone(request: Request):
+    username = check_user(request)
+    try:
+        view = await user_zone_view(username)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    if not_modified(request, view.etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=etag_headers(view.etag))
+    return PlainTextResponse(view.text, headers=etag_headers(view.etag))
+
 
+@app.get('/zone', dependencies=[Depends(zones_ready)])
+async def read_user_zone_records(request: Request):
+    '''The zone as JSON records. `editable` is false if it can only be changed as a whole zone file.'''
+    username = check_user(request)
+    try:
+        view = await user_zone_view(username)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if not_modified(request, view.etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=etag_headers(view.etag))
+    content = {'origin': zonemgr.user_zone_origin(username), 'editable': view.zone is not None}
+    if view.zone is not None:
+        soa = view.zone.soa
+        content.update({'ttl': view.zone.default_ttl,
+                        'soa': {'mname': soa[0].mname.relativize(view.zone.origin).to_text(),
+                                'rname': soa[0].rname.relativize(view.zone.origin).to_text(),
+                                'serial': soa[0].serial},
+                        'records': view.records()})
+    return JSONResponse(content=content, headers=etag_headers(view.etag))
 
-@app.put('/zonefile')
+
+class RecordCreate(BaseModel):
+    name: str = Field(..., description="Hostname, relative to the zone unless it ends with a dot. @ for the zone itself.")
+    type: str
+    value: str = Field(..., description="Record data as in a zone file, like 10 mail for MX.")
+    ttl: Optional[int] = Field(None, ge=0, description="Default: the TTL of the records of the same name and type, or of the zone.")
+
+
+class RecordPatch(BaseModel):
+    name: Optional[str] = None
+    value: Optional[str] = None
+    ttl: Optional[int] = Field(None, ge=0)
+
+
+async def edit_user_record(request: Request, username: str, fn, *args):
+    '''Runs a record edit of ZoneManager with the If-Match of the request, mapping its errors to HTTP.'''
+    if_match = parse_etags(request.headers.get('if-match'))
+    try:
+        return await zone_queue.run(username, fn, username, *args, if_match=if_match)
+    except ZoneQueueFull as e:
+        raise queue_full_error(e)
+    except ZoneVersionMismatch as e:
+        raise HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED,
+                            detail={'error': 'Zone changed', 'message': f'{e}. Reload it and try again.'})
+    except RecordNotFound as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail={'error': 'No such record', 'message': str(e)})
+    except (BadZoneFile, RecordUpdateError) as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail={'error': 'Bad record', 'message': str(e)})
+    except Exception as e:
+        logger.error(f'Exception editing a record of {username}:\n{str(e)}')
+        raise HTTPException(status_code=500, detail={'error': 'Internal error', 'message': str(e)})
+
+
+@app.post('/zone/records', status_code=status.HTTP_201_CREATED, dependencies=[Depends(zones_ready)])
+async def create_user_record(record: RecordCreate, request: Request):
+    username = check_user(request)
+    created, etag = await edit_user_record(request, username, zonemgr.add_user_record,
+                                           record.name, record.type.upper(), record.value, record.ttl)
+    return JSONResponse(status_code=status.HTTP_201_CREATED, content=created, headers=etag_headers(etag))
+
+
+@app.patch('/zone/records/{record_id}', dependencies=[Depends(zones_ready)])
+async def patch_user_record(record_id: str, patch: RecordPatch, request: Request):
+    username = check_user(request)
+    patched, etag = await edit_user_record(request, username, zonemgr.patch_user_record,
+                                           record_id, patch.name, patch.value, patch.ttl)
+    return JSONResponse(content=patched, headers=etag_headers(etag))
+
+
+@app.delete('/zone/records/{record_id}', status_code=status.HTTP_204_NO_CONTENT, dependencies=[Depends(zones_ready)])
+async def delete_user_record(record_id: str, request: Request):
+    username = check_user(request)
+    etag = await edit_user_record(request, username, zonemgr.delete_user_record, record_id)
+    return Response(status_code=status.HTTP_204_NO_CONTENT, headers=etag_headers(etag))
+
+
+@app.put('/zonefile', dependencies=[Depends(zones_ready)])
 async def set_user_zone(request: Request):
     username = check_user(request)
     try:
         data = await request.body()
         data_str = data.decode("utf-8")
-        logger.info(f'Set zone for {username}:\n{data_str}')
-        zonemgr.set_user_zonefile(username, data_str)
+        etag = await zone_queue.run(username, zonemgr.set_user_zonefile, username, data_str,
+                                    parse_etags(request.headers.get('if-match')))
+    except ZoneQueueFull as e:
+        raise queue_full_error(e)
+    except ZoneVersionMismatch as e:
+        raise HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED,
+                            detail={'error': 'Zone changed', 'message': f'{e}. Reload it and try again.'})
     except BadZoneFile as e:
         logger.error(f'Bad zone for {username}:\n{str(e)}')
         # logger.error(traceback.print_exc())
@@ -101,64 +369,332 @@ async def set_user_zone(request: Request):
         logger.error(f'Exception setting zone file for {username}:\n{str(e)}')
         # logger.error(traceback.print_exc())
         raise HTTPException(status_code=402, detail={'error': 'Internal error', 'message': str(e)})
+    return Response(headers=etag_headers(etag))
 
 
-@app.post('/reset_zonefile', response_class=PlainTextResponse)
-def reset_zone(request: Request):
+@app.post('/reset_zonefile', response_class=PlainTextResponse, dependencies=[Depends(zones_ready)])
+async def reset_zone(request: Request):
     username = check_user(request)
     try:
-        zonemgr.reset_user_zonefile(username)
+        await zone_queue.run(username, zonemgr.reset_user_zonefile, username)
+    except ZoneQueueFull as e:
+        raise queue_full_error(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-def get_api_key(
+@app.get('/zonefile/history', dependencies=[Depends(zones_ready)])
+async def read_user_zone_history(request: Request):
+    username = check_user(request)
+    # Reads the history file: off the event loop
+    history = await run_in_threadpool(zonemgr.user_zone_history, username)
+    return {'versions': [{'time': when, 'version': digest} for when, digest in reversed(history)]}
+
+
+@app.get('/zonefile/history/{version}', response_class=PlainTextResponse, dependencies=[Depends(zones_ready)])
+async def read_user_zone_version(version: str, request: Request):
+    '''A backed up version of the zone, by version id (or a unique prefix) or by ISO time.'''
+    username = check_user(request)
+    try:
+        _, _, zone = await run_in_threadpool(zonemgr.user_zone_version, username, version)
+    except SnapshotNotFound as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+    return zone
+
+
+@app.post('/zonefile/restore', dependencies=[Depends(zones_ready)])
+async def restore_user_zone(
+        request: Request,
+        version: str = Query(..., description="Version id (or a unique prefix) or ISO time of the zone to restore."),
+        ):
+    username = check_user(request)
+    try:
+        when, digest = await zone_queue.run(username, zonemgr.restore_user_zone, username, version)
+    except ZoneQueueFull as e:
+        raise queue_full_error(e)
+    except SnapshotNotFound as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+    except BadZoneFile as e:
+        raise HTTPException(status_code=400, detail={'error': 'Bad zone file', 'message': str(e)})
+    except Exception as e:
+        logger.error(f'Exception restoring zone file for {username}:\n{str(e)}')
+        raise HTTPException(status_code=500, detail={'error': 'Internal error', 'message': str(e)})
+    return {'status': 'restored', 'time': when, 'version': digest}
+
+
+def get_api_user(
     api_key_query: str = Security(api_key_query),
     api_key_header: str = Security(api_key_header),
 ) -> str:
     # From https://joshdimella.com/blog/adding-api-key-auth-to-fast-api
-    tokens = zonemgr.load_user_tokens().values()
-    if api_key_query in tokens:
-        return api_key_query
-    if api_key_header in tokens:
-        return api_key_header
+    # Returns the user owning the API key, looked up in the in-memory token index.
+    username = zonemgr.find_user_for_token(api_key_query) or zonemgr.find_user_for_token(api_key_header)
+    if username:
+        return username
     raise HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Invalid or missing API Key",
     )
 
-@app.post("/update/{hostname}")
+def client_ip(request: Request) -> str:
+    if 'x-real-ip' in request.headers:
+        # If we are behind a reverse proxy
+        return request.headers['x-real-ip']
+    return request.client.host
+
+
+@app.get('/myip', response_class=PlainTextResponse)
+async def read_my_ip(request: Request):
+    '''IP this request comes from, as /update sees it.'''
+    return client_ip(request)
+
+
+@app.get('/record/{hostname}', dependencies=[Depends(zones_ready)])
+async def read_record(
+        hostname: str,
+        request: Request,
+        username: str = Security(get_api_user),
+        type: str = Query('A', description="Record type."),
+        ):
+    '''Current records of a hostname, plus the IP of the caller: a client can tell if it needs an update.'''
+    try:
+        if zonemgr.zones.get(username) is not None:
+            ttl, values = zonemgr.user_records(username, hostname, type)
+        else:
+            ttl, values = await zone_queue.run(username, zonemgr.user_records, username, hostname, type)
+    except ZoneQueueFull as e:
+        raise queue_full_error(e)
+    except RecordUpdateError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return {'hostname': hostname,
+            'type': type.upper(),
+            'ttl': ttl,
+            'values': values,
+            'ip': client_ip(request)}
+
+
+@app.post("/update/{hostname}", dependencies=[Depends(zones_ready)])
 async def update_dns(
         hostname: str, 
         request: Request,
-        api_key: str = Security(get_api_key),
+        username: str = Security(get_api_user),
         ip: Optional[str] = Query(None, description="The new IP address for the hostname. If not provided, the IP that originates the request is used."),
         ):
-    username = zonemgr.find_user_for_token(api_key)
-    if not username:
-        return HTTPException(status_code=200, detail='Bad token')
     if not ip:
-        if 'x-real-ip' in request.headers:
-            # If we are behind a reverse proxy
-            ip = request.headers['x-real-ip']
-        else:
-            ip = request.client.host
+        ip = client_ip(request)
+    # The same update already running is joined, not counted nor queued again
+    key = ('update', username, hostname.lower(), ip)
+    if not zone_queue.is_pending(key):
+        check_update_rate(username)
+    if zonemgr.a_record_unchanged(username, hostname, ip):
+        metrics.ZONE_UPDATES.labels(metrics.UPDATE_UNCHANGED).inc()
+        return {'status': 'unchanged',
+                'changed': False,
+                'hostname': hostname,
+                'ip': ip}
     try:
-        zonemgr.update_a_record(username, hostname, ip)
-    except BadZoneFile as e:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Bad domain name.')
-    except RecordUpdateError as e:
+        changed, coalesced = await zone_queue.run_coalesced(key, username, zonemgr.update_a_record,
+                                                            username, hostname, ip)
+        if coalesced:
+            metrics.ZONE_UPDATES.labels(metrics.UPDATE_COALESCED).inc()
+    except ZoneQueueFull as e:
+        raise queue_full_error(e)
+    except (BadZoneFile, RecordUpdateError) as e:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     except Exception as e:
         logger.error(f'Error in dyndns:\n{e}')
         raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail='Something bad happened. Try again later or try resetting your DNS zone.')
-    return {'status': 'updated',
+    return {'status': 'updated' if changed else 'unchanged',
+            'changed': changed,
             'hostname': hostname,
             'ip': ip}
 
 
+class RecordUpdate(BaseModel):
+    hostname: str
+    type: str = Field('A', description="A or AAAA.")
+    value: Optional[str] = Field(None, description="The new address. If not provided, the IP that originates the request is used, if it is of the same family.")
+    ttl: Optional[int] = Field(None, ge=0)
+
+
+class BatchUpdate(BaseModel):
+    updates: list[RecordUpdate] = Field(..., min_length=1, max_length=BATCH_MAX_ENTRIES)
+
+
+def batch_entry_error(update: RecordUpdate, request_ip: str) -> str | None:
+    if update.type.upper() not in DYNDNS_TYPES:
+        return f'Record type must be one of {", ".join(DYNDNS_TYPES)}'
+    if update.value is None:
+        version = 4 if update.type.upper() == 'A' else 6
+        try:
+            if ipaddress.ip_address(request_ip).version == version:
+                update.value = request_ip
+        except ValueError:
+            pass
+        if update.value is None:
+            return f'No value given and the request does not come from an IPv{version} address'
+    return None
+
+
+@app.post("/update", dependencies=[Depends(zones_ready)])
+async def update_dns_batch(
+        batch: BatchUpdate,
+        request: Request,
+        username: str = Security(get_api_user),
+        ):
+    '''Updates several records as a single zone change: either all of them are applied or none.'''
+    request_ip = client_ip(request)
+    errors = {}
+    for i, update in enumerate(batch.updates):
+        error = batch_entry_error(update, request_ip)
+        if error:
+            errors[i] = error
+    results = [{'hostname': u.hostname, 'type': u.type.upper(), 'value': u.value} for u in batch.updates]
+    if not errors:
+        entries = [(u.hostname, u.type.upper(), u.value, u.ttl) for u in batch.updates]
+        key = ('batch', username, tuple((h.lower(), t, v, ttl) for h, t, v, ttl in entries))
+        if not zone_queue.is_pending(key):
+            check_update_rate(username)
+        try:
+            if zonemgr.records_unchanged(username, entries):
+                metrics.ZONE_UPDATES.labels(metrics.UPDATE_UNCHANGED).inc()
+                changed = [False] * len(entries)
+            else:
+                changed, coalesced = await zone_queue.run_coalesced(key, username, zonemgr.update_records,
+                                                                    username, entries)
+                if coalesced:
+                    metrics.ZONE_UPDATES.labels(metrics.UPDATE_COALESCED).inc()
+        except ZoneQueueFull as e:
+            raise queue_full_error(e)
+        except RecordBatchError as e:
+            errors = e.errors
+        except (BadZoneFile, RecordUpdateError) as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+        except Exception as e:
+            logger.error(f'Error in batch dyndns:\n{e}')
+            raise HTTPException(
+                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    detail='Something bad happened. Try again later or try resetting your DNS zone.')
+    if errors:
+        for i, result in enumerate(results):
+            result['status'] = 'error' if i in errors else 'skipped'
+            if i in errors:
+                result['error'] = errors[i]
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail={'error': 'Bad entries, nothing was updated', 'results': results})
+    for result, entry_changed in zip(results, changed):
+        result['status'] = 'updated' if entry_changed else 'unchanged'
+    return {'status': 'updated' if any(changed) else 'unchanged',
+            'changed': any(changed),
+            'results': results}
+
+
+
+
+@app.get('/metrics')
+async def read_metrics(request: Request):
+    check_admin(request)
+    # The gauge functions touch the disk (user index, named pid file): off the event loop
+    return Response(content=await run_in_threadpool(metrics.render), media_type=metrics.CONTENT_TYPE)
+
+
+@app.post('/admin/rebuild', status_code=status.HTTP_202_ACCEPTED, dependencies=[Depends(zones_ready)])
+async def rebuild_user_zones(request: Request):
+    '''Replaces every user zone by a fresh one in the background. Follow it with GET /admin/rebuild.'''
+    global rebuild_progress
+    check_admin(request)
+    if rebuild_progress.running:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail='A rebuild or import is already running.')
+    rebuild_progress = RebuildProgress()
+    rebuild_progress.start(0)
+
+    def rebuild(progress: RebuildProgress) -> None:
+        try:
+            zonemgr.reset_all_user_zonefiles(progress)
+        except Exception as e:
+            logger.error(f'Rebuild of the user zones failed: {e}')
+
+    threading.Thread(target=rebuild, args=(rebuild_progress,), name='zone-rebuild', daemon=True).start()
+    return rebuild_progress.to_dict()
+
+
+@app.get('/admin/rebuild')
+async def read_rebuild_progress(request: Request):
+    check_admin(request)
+    return rebuild_progress.to_dict()
+
+
+@app.get('/admin/journal')
+async def read_change_journal(
+        request: Request,
+        user: Optional[str] = Query(None, description='Only the changes of this user'),
+        limit: int = Query(100, ge=1, le=1000)):
+    '''Last changes of the user zones, newest first.'''
+    check_admin(request)
+    return await run_in_threadpool(zonemgr.journal.entries, user, limit)
+
+
+@app.get('/admin/export', dependencies=[Depends(zones_ready)])
+async def export_user_zones(request: Request, fmt: str = Query(FORMAT_TAR, alias='format')):
+    '''Every user zone and token as a tar.gz (format=tar) or NDJSON (format=ndjson), streamed as it is read.'''
+    check_admin(request)
+    if fmt not in FORMATS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f'Unknown format {fmt}, use one of {FORMATS}')
+    header = archive_header(zonemgr.origin, len(zonemgr.users))
+    name = f'dns-platform-{datetime.now(timezone.utc):%Y%m%d%H%M%S}'
+    if fmt == FORMAT_TAR:
+        content, media_type, name = write_tar(header, zonemgr.export_users()), 'application/gzip', name + '.tar.gz'
+    else:
+        content, media_type, name = write_ndjson(header, zonemgr.export_users()), 'application/x-ndjson', name + '.ndjson'
+    return StreamingResponse(content, media_type=media_type,
+                             headers={'Content-Disposition': f'attachment; filename="{name}"'})
+
+
+@app.post('/admin/import', dependencies=[Depends(zones_ready)])
+async def import_user_zones(request: Request):
+    '''
+    Adds or replaces the user zones and tokens of an export of /admin/export
+    (the body, tar.gz or NDJSON). Returns the report, with the users that failed.
+    '''
+    global rebuild_progress
+    check_admin(request)
+    if rebuild_progress.running:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail='A rebuild or import is already running.')
+    progress = rebuild_progress = RebuildProgress()
+    progress.start(0)
+    try:
+        with tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_MEMORY) as body:
+            async for chunk in request.stream():
+                body.write(chunk)
+            body.seek(0)
+            try:
+                header, entries = read_archive(body)
+            except ArchiveError as e:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+            if header.get('origin') != zonemgr.origin:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                    detail=f'Export of {header.get("origin")}, not of {zonemgr.origin}')
+            progress.start(header['users'] if isinstance(header.get('users'), int) else 0)
+            await run_in_threadpool(zonemgr.import_user_zones, entries, progress)
+    finally:
+        if progress.running:
+            progress.finish('Import failed')
+    return progress.to_dict()
+
+
+@app.get('/secondary/named.conf', response_class=PlainTextResponse, dependencies=[Depends(zones_ready)])
+async def secondary_conf(
+        request: Request,
+        zones_dir: str = Query('/var/cache/bind', description="Directory of the zone files in the secondary."),
+        ):
+    '''Bind config of a secondary server of every zone, to include in its named.conf.'''
+    check_admin(request)
+    primary = settings.primary_address or zonemgr.public_ip
+    if not primary:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail='Unknown primary address.')
+    return zonemgr.secondary_conf(primary, zones_dir)
 
 
 @app.get('/dyndns_install.sh', response_class=PlainTextResponse)
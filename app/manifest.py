@@ -0,0 +1,72 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from pathlib import Path
+
+from .fsutil import atomic_write_text
+
+
+logger = logging.getLogger(__name__)
+
+
+def file_sha256(path: str | Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class VerificationManifest(object):
+    '''
+    Content hashes of the files that passed verification, saved as JSON in `path`.
+
+    A file is verified if its size and mtime match the recorded ones or, when
+    they do not, if its content still has the recorded hash. Only files that
+    fail this test need checking again.
+    '''
+
+    def __init__(self, path: str | Path) -> None:
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        try:
+            self.entries = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def is_verified(self, file: str | Path) -> bool:
+        entry = self.entries.get(str(file))
+        if not entry:
+            return False
+        try:
+            st = os.stat(file)
+        except OSError:
+            return False
+        if entry['size'] == st.st_size and entry['mtime_ns'] == st.st_mtime_ns:
+            return True
+        if entry['size'] != st.st_size or entry['sha256'] != file_sha256(file):
+            return False
+        with self._lock:
+            entry['mtime_ns'] = st.st_mtime_ns
+        return True
+
+    def record(self, file: str | Path) -> None:
+        st = os.stat(file)
+        entry = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha256': file_sha256(file)}
+        with self._lock:
+            self.entries[str(file)] = entry
+
+    def forget(self, file: str | Path) -> None:
+        with self._lock:
+            self.entries.pop(str(file), None)
+
+    def save(self) -> None:
+        with self._lock:
+            data = json.dumps(self.entries, indent=1, sort_keys=True)
+        try:
+            atomic_write_text(self.path, data)
+        except OSError as e:
+            logger.error(f'Could not save verification manifest {self.path}: {e}')
@@ -0,0 +1,50 @@
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, \
+    disable_created_metrics, generate_latest
+
+
+# Seconds, from a cached token lookup to a slow Bind reload
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+REGISTRY = CollectorRegistry()  # Only the metrics of the app, not those of the Python process
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+disable_created_metrics()  # No *_created series next to every counter and histogram
+
+
+def render() -> bytes:
+    '''All metrics in the Prometheus text format. Reads the gauge functions, some of which touch the disk.'''
+    return generate_latest(REGISTRY)
+
+
+NAMED_CHECKZONE_SECONDS = Histogram('dns_named_checkzone_seconds', 'Time running named-checkzone.',
+                                    buckets=DEFAULT_BUCKETS, registry=REGISTRY)
+NAMED_CHECKCONF_SECONDS = Histogram('dns_named_checkconf_seconds', 'Time running named-checkconf.',
+                                    buckets=DEFAULT_BUCKETS, registry=REGISTRY)
+NAMED_RELOAD_SECONDS = Histogram('dns_named_reload_seconds', 'Time running rndc reload, of one zone or all.',
+                                 ('scope',), buckets=DEFAULT_BUCKETS, registry=REGISTRY)
+NAMED_UPDATE_SECONDS = Histogram('dns_named_update_seconds', 'Time sending a DNS UPDATE to Bind and getting its answer.',
+                                 buckets=DEFAULT_BUCKETS, registry=REGISTRY)
+TOKEN_LOOKUP_SECONDS = Histogram('dns_token_lookup_seconds', 'Time finding the user of an API token.',
+                                 buckets=DEFAULT_BUCKETS, registry=REGISTRY)
+ZONE_FILE_SECONDS = Histogram('dns_zone_file_seconds', 'Time reading or writing a user zone file.',
+                              ('operation',), buckets=DEFAULT_BUCKETS, registry=REGISTRY)
+PUBLIC_IP_DISCOVERY_SECONDS = Histogram('dns_public_ip_discovery_seconds', 'Time asking the public IP providers.',
+                                        buckets=DEFAULT_BUCKETS, registry=REGISTRY)
+NAMED_RESTARTS = Counter('dns_named_restarts_total', 'Times named was found dead and started again.',
+                         registry=REGISTRY)
+NAMED_UP = Gauge('dns_named_up', 'Whether named runs (1) or not (0), as last checked.', registry=REGISTRY)
+ZONE_UPDATES = Counter('dns_zone_updates_total', 'User zone changes by outcome.', ('outcome',), registry=REGISTRY)
+USER_ZONES = Gauge('dns_user_zones', 'User zones.', registry=REGISTRY)
+ZONE_QUEUE_PENDING = Gauge('dns_zone_queue_pending', 'Zone operations waiting or running in the work queue.',
+                           registry=REGISTRY)
+
+# Outcomes of ZONE_UPDATES
+UPDATE_CHANGED = 'changed'
+UPDATE_UNCHANGED = 'unchanged'
+UPDATE_BAD_ZONE = 'bad_zone'
+UPDATE_RELOAD_FAILURE = 'reload_failure'
+UPDATE_ROLLBACK = 'rollback'
+UPDATE_RATE_LIMITED = 'rate_limited'
+UPDATE_COALESCED = 'coalesced'
+for outcome in (UPDATE_CHANGED, UPDATE_UNCHANGED, UPDATE_BAD_ZONE, UPDATE_RELOAD_FAILURE, UPDATE_ROLLBACK,
+                UPDATE_RATE_LIMITED, UPDATE_COALESCED):
+    ZONE_UPDATES.labels(outcome)
@@ -1,6 +1,14 @@
 import subprocess
+import time
 import psutil
 
+from pathlib import Path
+
+from . import metrics
+
+
+NAMED_PID_FILE = '/run/named/named.pid'  # pid-file of the Debian named.conf.options
+
 
 class NamedCheckConfError(Exception):
     pass
@@ -13,6 +21,7 @@ class NamedReloadError(Exception):
 
 
 class NamedManager(object):
+    last_reload = None  # Time of the last successful rndc reload of this process
 
     @classmethod
     def check_and_run(cls, origin, zone_file) -> None:
@@ -23,11 +32,22 @@ class NamedManager(object):
     @classmethod
     def run(cls) -> None:
         if not NamedManager.named_pid():
-            subprocess.run(['named'], timeout=5)
+            NamedManager.start()
 
     @classmethod
-    def reload(cls) -> str:
-        proc = subprocess.run(['rndc', 'reload'],
+    def start(cls) -> None:
+        '''Starts named, which detaches and writes its pid file.'''
+        proc = subprocess.run(['named'],
+                              timeout=5,
+                              stdout=subprocess.PIPE,
+                              stderr=subprocess.STDOUT,
+                              text=True)
+        if proc.returncode != 0:
+            raise NamedReloadError(proc.stdout)
+
+    @classmethod
+    def rndc(cls, *args) -> str:
+        proc = subprocess.run(['rndc', *args],
                               timeout=5,
                               stdout=subprocess.PIPE, 
                               stderr=subprocess.STDOUT,
@@ -38,13 +58,45 @@ class NamedManager(object):
             raise NamedReloadError(proc.stdout)
 
     @classmethod
-    def named_pid(cls):
-        for process in psutil.process_iter(['name', 'pid']):
-            try:
-                if process.info['name'] == 'named':
-                    return process.info['pid']
-            except (psutil.NoSuchProcess, psutil.AccessDenied):
-                continue
+    def reload(cls, zone: str | None = None) -> str:
+        '''Reloads a single zone, or every zone and the config if `zone` is None.'''
+        with metrics.NAMED_RELOAD_SECONDS.labels('zone' if zone else 'all').time():
+            output = NamedManager.rndc('reload', zone) if zone else NamedManager.rndc('reload')
+        NamedManager.last_reload = time.time()
+        return output
+
+    @classmethod
+    def status(cls) -> dict:
+        '''
+        Parses `rndc status`: version, boot_time, last_configured and zones
+        (the number of zones loaded, automatic empty zones included).
+        '''
+        fields = {}
+        for line in NamedManager.rndc('status').splitlines():
+            key, sep, value = line.partition(':')
+            if sep:
+                fields[key.strip()] = value.strip()
+        zones = fields.get('number of zones', '').split(' ', 1)[0]
+        return {
+            'version': fields.get('version'),
+            'boot_time': fields.get('boot time'),
+            'last_configured': fields.get('last configured'),
+            'zones': int(zones) if zones.isdigit() else None,
+        }
+
+    @classmethod
+    def named_pid(cls, pid_file: str | Path = NAMED_PID_FILE) -> int | None:
+        '''
+        Pid of the running named, from its pid file. A pid left by a named that
+        died, maybe reused by another process, is not taken.
+        '''
+        try:
+            pid = int(Path(pid_file).read_text().strip())
+            process = psutil.Process(pid)
+            if process.name() == 'named' and process.status() != psutil.STATUS_ZOMBIE:
+                return pid
+        except (OSError, ValueError, psutil.Error):
+            pass
         return None
 
     @classmethod
@@ -55,11 +107,12 @@ class NamedManager(object):
         - success = {True|False}
         - msg: message in case of error
         '''
-        proc = subprocess.run(['named-checkconf'], 
-                              timeout=5,
-                              stdout=subprocess.PIPE, 
-                              stderr=subprocess.STDOUT,
-                              text=True)
+        with metrics.NAMED_CHECKCONF_SECONDS.time():
+            proc = subprocess.run(['named-checkconf'], 
+                                  timeout=5,
+                                  stdout=subprocess.PIPE, 
+                                  stderr=subprocess.STDOUT,
+                                  text=True)
         if proc.returncode == 0:
             return proc.stdout
         else:
@@ -68,11 +121,12 @@ class NamedManager(object):
     @classmethod
     def named_checkzone(cls, origin, zone_file) -> str:
         # named-checkzone -k fail ensures zone names are strictly checked
-        proc = subprocess.run(['named-checkzone', '-k', 'fail', origin, zone_file], 
-                              timeout=5,
-                              stdout=subprocess.PIPE, 
-                              stderr=subprocess.STDOUT,
-                              text=True)
+        with metrics.NAMED_CHECKZONE_SECONDS.time():
+            proc = subprocess.run(['named-checkzone', '-k', 'fail', origin, zone_file], 
+                                  timeout=5,
+                                  stdout=subprocess.PIPE, 
+                                  stderr=subprocess.STDOUT,
+                                  text=True)
         if proc.returncode == 0:
             return proc.stdout
         else:
@@ -0,0 +1,116 @@
+import logging
+import subprocess
+import threading
+import time
+
+from datetime import datetime, timezone
+from pathlib import Path
+
+from . import metrics
+from .named_manager import NamedManager, NamedReloadError, NAMED_PID_FILE
+
+
+logger = logging.getLogger(__name__)
+
+LIVENESS_TTL = 2  # Seconds a liveness check is trusted
+STATUS_TTL = 5  # Seconds an rndc status is trusted
+MIN_BACKOFF = 1  # Seconds before starting again a named that died, doubled on each try
+MAX_BACKOFF = 60
+START_TIMEOUT = 5  # Seconds to wait for a started named to write its pid file
+
+
+class NamedSupervisor(object):
+    '''
+    Keeps track of the named process through its pid file, with no scan of
+    the process table. Liveness and `rndc status` are cached for a few
+    seconds, so health checks and the hot paths asking whether Bind runs
+    cost a dict lookup most of the time.
+
+    `ensure_running()` starts named if it is not running. A named that keeps
+    dying is started again after a growing backoff, reset once it stays up.
+    '''
+
+    def __init__(self, pid_file: str | Path = NAMED_PID_FILE, ttl: float = LIVENESS_TTL,
+                 min_backoff: float = MIN_BACKOFF, max_backoff: float = MAX_BACKOFF) -> None:
+        self.pid_file = Path(pid_file)
+        self.ttl = ttl
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.backoff = min_backoff
+        self.restarts = 0
+        self._lock = threading.Lock()
+        self._alive = None
+        self._checked = 0.0
+        self._status = None
+        self._status_checked = 0.0
+        self._started = None  # Monotonic time named was last started by us
+        self._next_start = 0.0
+
+    def pid(self) -> int | None:
+        return NamedManager.named_pid(self.pid_file)
+
+    def alive(self) -> bool:
+        now = time.monotonic()
+        if self._alive is None or now - self._checked >= self.ttl:
+            self._alive = self.pid() is not None
+            self._checked = now
+        return self._alive
+
+    def invalidate(self) -> None:
+        '''Forgets the cached liveness and status, e.g. after starting or stopping named.'''
+        self._alive = None
+        self._status = None
+
+    def ensure_running(self) -> bool:
+        '''Starts named if it is not running and its backoff is over. Returns whether it runs.'''
+        with self._lock:
+            now = time.monotonic()
+            if self.alive():
+                if self._started is not None and now - self._started >= self.max_backoff:
+                    self.backoff = self.min_backoff  # Stayed up: the next crash is retried soon
+                return True
+            if now < self._next_start:
+                return False
+            if self._started is not None:
+                self.restarts += 1
+                metrics.NAMED_RESTARTS.inc()
+                logger.warning(f'named is not running, starting it again (restart {self.restarts}, '
+                               f'next try in {self.backoff}s)')
+            self._started = now
+            self._next_start = now + self.backoff
+            self.backoff = min(self.backoff * 2, self.max_backoff)
+            try:
+                NamedManager.start()
+            except Exception as e:
+                logger.error(f'Could not start named: {e}')
+                self.invalidate()
+                return False
+            deadline = now + START_TIMEOUT
+            while True:
+                self.invalidate()
+                if self.alive() or time.monotonic() >= deadline:
+                    return self._alive
+                time.sleep(0.1)
+
+    def status(self) -> dict:
+        '''
+        Whether named runs, its pid and, from `rndc status`, its version, zone
+        count, boot and last configuration time. Cached for STATUS_TTL seconds.
+        '''
+        now = time.monotonic()
+        status = self._status
+        if status is not None and now - self._status_checked < STATUS_TTL:
+            return status
+        pid = self.pid()
+        self._alive, self._checked = pid is not None, now
+        status = {'running': pid is not None, 'pid': pid, 'restarts': self.restarts}
+        if pid is not None:
+            try:
+                status.update(NamedManager.status())
+            except (NamedReloadError, OSError, subprocess.SubprocessError) as e:
+                status['error'] = str(e).strip()
+        if NamedManager.last_reload is not None:
+            status['last_reload'] = datetime.fromtimestamp(NamedManager.last_reload, timezone.utc) \
+                .isoformat(timespec='seconds')
+        self._status, self._status_checked = status, now
+        return status
@@ -0,0 +1,151 @@
+import ipaddress
+import logging
+import requests
+import threading
+import time
+
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
+from pathlib import Path
+
+from . import metrics
+from .fsutil import atomic_write_text
+
+
+logger = logging.getLogger(__name__)
+
+PUBLIC_IP_PROVIDERS = [
+    "https://ifconfig.me",
+    "https://api.ipify.org",
+    "https://ipinfo.io/ip",
+    "https://icanhazip.com",
+]
+PUBLIC_IP_RETRY = 60 # Seconds to wait after all providers failed
+
+
+class PublicIpNotFound(Exception):
+    pass
+
+
+def ask_provider(url: str, timeout: float) -> str:
+    response = requests.get(url, timeout=timeout)
+    response.raise_for_status()
+    ip = response.text.strip()
+    ipaddress.IPv4Address(ip) # Throws if ip is invalid
+    return ip
+
+
+class PublicIpResolver(object):
+    '''
+    Finds the public IPv4 of this server by asking all `providers` at once.
+
+    The answer given by most providers wins as soon as it has a majority,
+    otherwise the most common valid answer once every provider answered or
+    `timeout` expired. The last known IP is kept in `cache_file`, so a
+    restart has an IP before asking the network. `start()` refreshes it in
+    a background thread every `refresh` seconds.
+    '''
+
+    def __init__(self, cache_file: str | Path, providers: list[str] = PUBLIC_IP_PROVIDERS,
+                 timeout: float = 3.0, refresh: float = 3600) -> None:
+        self.cache_file = Path(cache_file)
+        self.providers = list(providers)
+        self.timeout = timeout
+        self.refresh_interval = refresh
+        self._ip = None
+        self._cache_mtime = None
+        self._lock = threading.Lock()
+        self._thread = None
+        self._load()
+
+    def _load(self) -> None:
+        try:
+            mtime = self.cache_file.stat().st_mtime_ns
+            if mtime == self._cache_mtime:
+                return
+            ip = self.cache_file.read_text().strip()
+            ipaddress.IPv4Address(ip)
+            self._ip = ip
+            self._cache_mtime = mtime
+        except (OSError, ValueError):
+            pass
+
+    @property
+    def ip(self) -> str | None:
+        '''Last known IP. Never touches the network (other workers may have refreshed the cache file).'''
+        self._load()
+        return self._ip
+
+    def get(self) -> str | None:
+        '''Last known IP, or a blocking discovery (bounded by `timeout`) if there is none yet.'''
+        if self.ip:
+            return self._ip
+        return self.refresh()
+
+    def discover(self) -> str:
+        with metrics.PUBLIC_IP_DISCOVERY_SECONDS.time():
+            return self._discover()
+
+    def _discover(self) -> str:
+        if not self.providers:
+            raise PublicIpNotFound('No public IP providers configured')
+        answers = Counter()
+        majority = len(self.providers) // 2 + 1
+        executor = ThreadPoolExecutor(max_workers=len(self.providers), thread_name_prefix='public-ip')
+        futures = {executor.submit(ask_provider, url, self.timeout): url for url in self.providers}
+        try:
+            for future in as_completed(futures, timeout=self.timeout):
+                url = futures[future]
+                try:
+                    ip = future.result()
+                except Exception as e:
+                    logger.warning(f'Failed asking public IP to {url}: {e}')
+                    continue
+                logger.info(f'Found public IP {ip} from {url}')
+                answers[ip] += 1
+                if answers[ip] >= majority:
+                    break
+        except FuturesTimeoutError:
+            logger.warning(f'Public IP providers did not all answer in {self.timeout}s')
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+        if not answers:
+            raise PublicIpNotFound()
+        return answers.most_common(1)[0][0]
+
+    def refresh(self) -> str | None:
+        '''Asks the providers and saves the answer. Returns None if no provider answered.'''
+        with self._lock:
+            try:
+                ip = self.discover()
+            except PublicIpNotFound as e:
+                logger.error(f'Could not find public IP: {e}')
+                return None
+            if ip != self._ip:
+                logger.info(f'Public IP is now {ip}')
+            self._ip = ip
+            try:
+                atomic_write_text(self.cache_file, ip)
+                self._cache_mtime = self.cache_file.stat().st_mtime_ns
+            except OSError as e:
+                logger.error(f'Could not save public IP to {self.cache_file}: {e}')
+            return ip
+
+    def start(self) -> None:
+        if self._thread:
+            return
+        self._thread = threading.Thread(target=self._run, name='public-ip', daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            try:
+                age = time.time() - self.cache_file.stat().st_mtime
+            except OSError:
+                age = None
+            if age is None or age >= self.refresh_interval:
+                if not self.refresh():
+                    time.sleep(PUBLIC_IP_RETRY)
+                    continue
+                age = 0
+            time.sleep(max(self.refresh_interval - age, 1))
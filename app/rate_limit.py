@@ -0,0 +1,39 @@
+import time
+
+
+MAX_BUCKETS = 10000  # Buckets kept before the full (idle) ones are dropped
+
+
+class TokenBucketLimiter(object):
+    '''
+    In-memory token bucket per key: up to `burst` calls at once, refilled
+    at `rate` calls per second. A rate of 0 disables the limit.
+
+    Not thread-safe: used from the event loop only. Each worker process has
+    its own buckets.
+    '''
+
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._buckets: dict[str, tuple[float, float]] = {}  # key: (tokens, time of last refill)
+
+    def acquire(self, key: str) -> float:
+        '''Takes a token of `key`. Returns 0 if there was one, else the seconds until there is.'''
+        if self.rate <= 0:
+            return 0
+        now = time.monotonic()
+        tokens, last = self._buckets.get(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        if tokens < 1:
+            self._buckets[key] = (tokens, now)
+            return (1 - tokens) / self.rate
+        if len(self._buckets) >= MAX_BUCKETS and key not in self._buckets:
+            self._prune(now)
+        self._buckets[key] = (tokens - 1, now)
+        return 0
+
+    def _prune(self, now: float) -> None:
+        '''Drops the buckets refilled by now: they are the same as a new one.'''
+        full = self.burst / self.rate
+        self._buckets = {k: v for k, v in self._buckets.items() if now - v[1] < full}
@@ -0,0 +1,162 @@
+import logging
+import queue
+import threading
+import time
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+
+from . import metrics
+from .named_manager import NamedManager, NamedReloadError
+
+
+logger = logging.getLogger(__name__)
+
+
+class ZoneChange(object):
+    '''A zone file already swapped in place, waiting for Bind to load it.'''
+
+    def __init__(self, name: str, zonefile: Path, backup: Path) -> None:
+        self.name = name
+        self.zonefile = Path(zonefile)
+        self.backup = Path(backup)
+        self.future = Future()
+
+
+class ReloadScheduler(object):
+    '''
+    Loads the submitted zone changes in batches: a batch takes what was
+    queued while the previous one was loading, plus what comes within
+    `window` seconds (0: no wait, so a lone change is loaded at once).
+    Changes of the same zone in a batch are merged into one reload of that
+    zone, and the zones of a batch are reloaded in parallel by `workers`
+    threads. Each zone is reloaded on its own (rndc reload <zone>), so a
+    change costs the same whatever the number of zones Bind serves; a full
+    reload is left to the bulk rebuild.
+
+    Each change carries the previous version of its zone file (`backup`).
+    Only the zones that fail to load are rolled back: to the backup of their
+    last change, so the earlier changes of a merged zone are kept if that
+    version loads.
+    '''
+
+    def __init__(self, window: float = 0, max_batch: int = 1000, workers: int = 4) -> None:
+        self.window = window
+        self.max_batch = max_batch
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='zone-reload')
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def submit(self, name: str, zonefile: Path, backup: Path) -> Future:
+        self._ensure_started()
+        change = ZoneChange(name, zonefile, backup)
+        self._queue.put(change)
+        return change.future
+
+    def reload(self, name: str, zonefile: Path, backup: Path) -> str:
+        '''Submits a change and waits for its result. Raises NamedReloadError if it was rolled back.'''
+        return self.submit(name, zonefile, backup).result()
+
+    def rndc(self, *args) -> str:
+        '''Runs an rndc command that is not a zone change (e.g. reconfig).'''
+        return NamedManager.rndc(*args)
+
+    def _ensure_started(self) -> None:
+        if self._thread:
+            return
+        with self._start_lock:
+            if not self._thread:
+                self._thread = threading.Thread(target=self._run, name='reload-scheduler', daemon=True)
+                self._thread.start()
+
+    def _next_batch(self) -> list[ZoneChange]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._queue.get_nowait())  # Queued while the previous batch was loading
+                continue
+            except queue.Empty:
+                pass
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._next_batch()
+            try:
+                self._apply(batch)
+            except Exception as e:
+                logger.error(f'Reload scheduler failed applying {len(batch)} zone changes: {e}')
+                for change in batch:
+                    if not change.future.done():
+                        change.future.set_exception(e)
+
+    def _apply(self, batch: list[ZoneChange]) -> None:
+        zones: dict[str, list[ZoneChange]] = {}
+        for change in batch:
+            zones.setdefault(change.name, []).append(change)
+        if len(zones) == 1:
+            self._apply_zone(batch)
+        else:
+            list(self._pool.map(self._apply_zone, zones.values()))
+        logger.debug(f'Reloaded {len(zones)} zones for {len(batch)} zone changes')
+
+    def _apply_zone(self, changes: list[ZoneChange]) -> None:
+        '''Loads the changes of one zone with a single reload. Never raises: errors go to the futures.'''
+        name = changes[0].name
+        try:
+            output = NamedManager.reload(name)
+        except NamedReloadError as e:
+            try:
+                output = self._rollback(changes[-1], e)
+            except Exception as e:
+                self._fail(changes, e)
+                return
+            changes = changes[:-1]  # The earlier ones are in the version restored
+        except Exception as e:
+            logger.error(f'Reload scheduler failed reloading zone {name}: {e}')
+            self._fail(changes, e)
+            return
+        for change in changes:
+            change.backup.unlink(missing_ok=True)
+            change.future.set_result(output)
+
+    def _fail(self, changes: list[ZoneChange], error: Exception) -> None:
+        for change in changes:
+            if not change.future.done():
+                change.future.set_exception(error)
+
+    def _rollback(self, change: ZoneChange, error: NamedReloadError) -> str:
+        '''Restores the backup of `change`, fails it and reloads the zone. Returns the output of that reload.'''
+        logger.error(f'Reload error for zone {change.name}, restoring {change.backup}')
+        metrics.ZONE_UPDATES.labels(metrics.UPDATE_ROLLBACK).inc()
+        change.backup.replace(change.zonefile)
+        change.future.set_exception(error)
+        try:
+            return NamedManager.reload(change.name)
+        except NamedReloadError:
+            logger.error(f'VERY BAD SITUATION: failed reverting a reload error for zone {change.name}. ******')
+            raise
+
+
+class ImmediateReloader(object):
+    '''
+    Stands in for ReloadScheduler when no Bind serves the zones (the
+    built-in DNS server): a change is live as soon as its file is replaced
+    and cached, so there is nothing to reload.
+    '''
+
+    def reload(self, name: str, zonefile: Path, backup: Path) -> str:
+        Path(backup).unlink(missing_ok=True)
+        return ''
+
+    def rndc(self, *args) -> str:
+        return ''
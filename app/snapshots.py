@@ -0,0 +1,197 @@
+import hashlib
+import json
+import logging
+import os
+import time
+import zlib
+
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from .fsutil import atomic_write_text
+
+
+logger = logging.getLogger(__name__)
+
+BLOB_GRACE = 3600  # Seconds an unreferenced blob is kept (it may belong to a snapshot being written)
+HISTORY_TAIL = 1024  # Bytes read from the end of a history for its last version, several lines
+
+
+class SnapshotNotFound(Exception):
+    pass
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec='microseconds')
+
+
+def _parse_time(text: str) -> datetime:
+    '''ISO time, also with a trailing Z, which fromisoformat only takes from Python 3.11.'''
+    if text[-1:] in ('Z', 'z'):
+        text = text[:-1] + '+00:00'
+    return datetime.fromisoformat(text)
+
+
+class SnapshotStore(object):
+    '''
+    Content-addressed store of zone and config files in `root`:
+
+    - blobs/<xx>/<sha256>: zlib-compressed file contents, each stored once.
+    - history/<username>: one line per committed version of a user zone,
+      "<UTC ISO time> <sha256>", appended on every change.
+    - snapshots/<time>.json: full backups, {file name: sha256}.
+
+    `prune()` applies the retention policy and drops the blobs no longer
+    referenced. Callers serialize the changes of one user (ZoneManager.user_lock).
+    '''
+
+    def __init__(self, root: str | Path, retention_days: float = 30, keep_last: int = 20) -> None:
+        self.root = Path(root)
+        self.retention_days = retention_days
+        self.keep_last = keep_last
+        self.blobs_dir = self.root / 'blobs'
+        self.history_dir = self.root / 'history'
+        self.snapshots_dir = self.root / 'snapshots'
+        for d in (self.blobs_dir, self.history_dir, self.snapshots_dir):
+            d.mkdir(parents=True, exist_ok=True)
+
+    def _blob_path(self, digest: str) -> Path:
+        return self.blobs_dir / digest[:2] / digest
+
+    def put(self, data: str) -> str:
+        '''Stores `data` if it is not stored yet. Returns its sha256.'''
+        raw = data.encode()
+        digest = hashlib.sha256(raw).hexdigest()
+        path = self._blob_path(digest)
+        if path.exists():
+            os.utime(path)  # Fresh again for the grace period of prune()
+            return digest
+        path.parent.mkdir(exist_ok=True)
+        tmp = path.with_name(f'.{digest}.{os.getpid()}.tmp')
+        try:
+            tmp.write_bytes(zlib.compress(raw))
+            os.replace(tmp, path)
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+        return digest
+
+    def get(self, digest: str) -> str:
+        try:
+            return zlib.decompress(self._blob_path(digest).read_bytes()).decode()
+        except (OSError, ValueError, zlib.error):
+            raise SnapshotNotFound(f'No snapshot {digest}')
+
+    def history(self, username: str) -> list[tuple[str, str]]:
+        '''Versions of a user zone as (time, sha256), oldest first.'''
+        try:
+            lines = (self.history_dir / username).read_text().splitlines()
+        except FileNotFoundError:
+            return []
+        return [tuple(line.split(' ', 1)) for line in lines if line]
+
+    def last(self, username: str) -> tuple[str, str] | None:
+        '''Last version of a user zone as (time, sha256), None if it has no history. Reads only the end of it.'''
+        try:
+            with open(self.history_dir / username, 'rb') as f:
+                size = f.seek(0, os.SEEK_END)
+                f.seek(max(0, size - HISTORY_TAIL))
+                lines = f.read().decode().splitlines()
+        except FileNotFoundError:
+            return None
+        lines = [line for line in lines if line]
+        if size > HISTORY_TAIL and len(lines) < 2:
+            history = self.history(username)  # A line longer than the tail, the first one read is cut
+            return history[-1] if history else None
+        return tuple(lines[-1].split(' ', 1)) if lines else None
+
+    def record(self, username: str, data: str, when: str | None = None) -> str:
+        '''Adds a version of a user zone to its history, unless it is the same as the last one.'''
+        digest = self.put(data)
+        last = self.last(username)
+        if last and last[1] == digest:
+            return digest
+        with open(self.history_dir / username, 'a') as f:
+            f.write(f'{when or _now()} {digest}\n')
+        return digest
+
+    def find(self, username: str, version: str) -> tuple[str, str]:
+        '''
+        Version of a user zone by sha256 (or a unique prefix), or the latest
+        version at a given ISO time. Returns (time, sha256).
+        '''
+        history = self.history(username)
+        matches = [entry for entry in history if entry[1].startswith(version)]
+        if len(matches) == 1 or (matches and len(version) == 64):
+            return matches[-1]
+        try:
+            at = _parse_time(version)
+        except ValueError:
+            raise SnapshotNotFound(f'No version {version} of the zone of {username}')
+        if at.tzinfo is None:
+            at = at.replace(tzinfo=timezone.utc)
+        before = [entry for entry in history if _parse_time(entry[0]) <= at]
+        if not before:
+            raise SnapshotNotFound(f'No version of the zone of {username} at {version}')
+        return before[-1]
+
+    def snapshot(self, files: dict[str, Path]) -> str:
+        '''Full backup of `files` ({name: path}). Unchanged files cost no space. Returns the snapshot name.'''
+        manifest = {}
+        for name, path in files.items():
+            try:
+                manifest[name] = self.put(Path(path).read_text())
+            except OSError as e:
+                logger.warning(f'Not in snapshot, can not read {path}: {e}')
+        name = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H-%M-%S.%fZ')
+        atomic_write_text(self.snapshots_dir / f'{name}.json', json.dumps(manifest, indent=1, sort_keys=True))
+        return name
+
+    def snapshots(self) -> list[str]:
+        return sorted(f.stem for f in self.snapshots_dir.glob('*.json'))
+
+    def read_snapshot(self, name: str) -> dict[str, str]:
+        try:
+            return json.loads((self.snapshots_dir / f'{name}.json').read_text())
+        except (OSError, ValueError):
+            raise SnapshotNotFound(f'No snapshot {name}')
+
+    def prune_history(self, username: str) -> None:
+        '''Drops the versions older than `retention_days`, always keeping the last `keep_last`.'''
+        history = self.history(username)
+        cutoff = datetime.now(timezone.utc) - timedelta(days=self.retention_days)
+        kept = [entry for i, entry in enumerate(history)
+                if i >= len(history) - self.keep_last or _parse_time(entry[0]) >= cutoff]
+        if len(kept) < len(history):
+            atomic_write_text(self.history_dir / username, ''.join(f'{t} {d}\n' for t, d in kept))
+
+    def prune(self, user_lock) -> None:
+        '''
+        Applies the retention policy to every history and to the full
+        snapshots, then deletes the blobs nobody references.
+        `user_lock(username)` is the lock serializing the changes of a user.
+        '''
+        for path in self.history_dir.iterdir():
+            with user_lock(path.name):
+                self.prune_history(path.name)
+        snapshots = self.snapshots()
+        cutoff = (datetime.now(timezone.utc) - timedelta(days=self.retention_days)).strftime('%Y-%m-%dT%H-%M-%S')
+        for name in snapshots[:-self.keep_last] if self.keep_last else snapshots:
+            if name < cutoff:
+                (self.snapshots_dir / f'{name}.json').unlink(missing_ok=True)
+
+        referenced = set()
+        for path in self.history_dir.iterdir():
+            referenced.update(digest for _, digest in self.history(path.name))
+        for name in self.snapshots():
+            try:
+                referenced.update(self.read_snapshot(name).values())
+            except SnapshotNotFound:
+                continue
+        removed = 0
+        now = time.time()
+        for blob in self.blobs_dir.glob('*/*'):
+            if blob.name not in referenced and not blob.name.startswith('.') and now - blob.stat().st_mtime > BLOB_GRACE:
+                blob.unlink(missing_ok=True)
+                removed += 1
+        logger.info(f'Pruned snapshot store, {removed} blobs removed')
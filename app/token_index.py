@@ -0,0 +1,168 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+
+from contextlib import contextmanager
+from pathlib import Path
+
+
+logger = logging.getLogger(__name__)
+
+RESCAN_INTERVAL = 5  # Seconds between the scans of the token files prompted by unknown tokens
+
+
+def hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class TokenIndex(object):
+    '''
+    In-memory index of user API tokens: sha256(token) -> username.
+
+    The index follows the token directory: when its mtime changes (files
+    added, removed or renamed, also by tools outside the app), the file
+    mtimes are compared and only the new or changed token files are read.
+    The writes of this process go through `writing()`, so they cost no scan.
+    On each hit, the user's token file mtime is checked so an in-place edit
+    of that file is noticed too; an unknown token prompts a scan of the file
+    mtimes at most every RESCAN_INTERVAL seconds, which finds the new token
+    of such an edit. Plain tokens are never kept in memory, only their hashes.
+    '''
+
+    def __init__(self, tokens_dir: str) -> None:
+        self.tokens_dir = Path(tokens_dir)
+        self._lock = threading.RLock()
+        self._by_hash: dict[str, str] = {}
+        self._by_user: dict[str, tuple[str, int, Path]] = {}  # username -> (hash, mtime, file)
+        self._dir_mtime = None
+        self._scanned = None  # Monotonic time of the last scan
+
+    def _dir_stat(self) -> int | None:
+        try:
+            return os.stat(self.tokens_dir).st_mtime_ns
+        except OSError:
+            return None
+
+    def _scan(self, dir_mtime: int | None) -> None:
+        '''Brings the index up to date with the token files, reading only those new or changed since the last scan.'''
+        by_user = dict(self._by_user)
+        seen = set()
+        read = 0
+        if dir_mtime is not None:
+            with os.scandir(self.tokens_dir) as entries:
+                for entry in entries:
+                    # Skips disabled tokens and the temporary files of atomic_write_text (.<user>.<pid>.tmp),
+                    # the only dotfiles there: a username never starts with a dot
+                    if entry.name.startswith('.') or entry.name.endswith('.inactive'):
+                        continue
+                    try:
+                        if not entry.is_file():
+                            continue
+                        mtime = entry.stat().st_mtime_ns
+                        seen.add(entry.name)
+                        old = by_user.get(entry.name)
+                        if old and old[1] == mtime:
+                            continue
+                        token_file = Path(entry.path)
+                        by_user[entry.name] = (hash_token(token_file.read_text().strip()), mtime, token_file)
+                        read += 1
+                    except OSError:
+                        seen.discard(entry.name)
+                        continue
+        for username in by_user.keys() - seen:
+            del by_user[username]
+        self._by_user = by_user
+        self._by_hash = {token_hash: username for username, (token_hash, _, _) in by_user.items()}
+        self._dir_mtime = dir_mtime
+        self._scanned = time.monotonic()
+        logger.debug(f'Token index scanned: {len(by_user)} tokens, {read} read')
+
+    def _refresh(self) -> None:
+        dir_mtime = self._dir_stat()
+        if dir_mtime != self._dir_mtime:
+            with self._lock:
+                if dir_mtime != self._dir_mtime:
+                    self._scan(dir_mtime)
+
+    def _rescan_for_unknown(self) -> None:
+        if self._scanned is not None and time.monotonic() - self._scanned < RESCAN_INTERVAL:
+            return
+        with self._lock:
+            if self._scanned is None or time.monotonic() - self._scanned >= RESCAN_INTERVAL:
+                self._scan(self._dir_stat())
+
+    @contextmanager
+    def writing(self):
+        '''
+        Wraps a write of this process to the tokens dir, followed by set() or
+        remove(). If the index was current before the write, the new dir mtime
+        is taken as seen, so the write does not make every lookup scan again.
+        '''
+        with self._lock:
+            current = self._dir_mtime is not None and self._dir_stat() == self._dir_mtime
+            yield
+            if current:
+                self._dir_mtime = self._dir_stat()
+
+    def _refresh_user(self, username: str) -> None:
+        entry = self._by_user.get(username)
+        token_file = entry[2] if entry else self.tokens_dir / username
+        try:
+            mtime = token_file.stat().st_mtime_ns
+            if entry and entry[1] == mtime:
+                return
+            self.set(username, token_file.read_text().strip(), token_file, mtime)
+        except OSError:
+            self.remove(username)
+
+    def lookup(self, token: str | None) -> str | None:
+        '''Returns the username owning `token`, or None.'''
+        if not token:
+            return None
+        self._refresh()
+        token_hash = hash_token(token)
+        username = self._by_hash.get(token_hash)
+        if username is None:
+            self._rescan_for_unknown()
+            username = self._by_hash.get(token_hash)
+            if username is None:
+                return None
+        self._refresh_user(username)
+        if self._by_user.get(username, (None,))[0] != token_hash:
+            return None
+        return username
+
+    def owner(self, token: str) -> str | None:
+        '''Username with `token` in the index as last read, with no check of the token files: for bulk changes.'''
+        return self._by_hash.get(hash_token(token))
+
+    def contains(self, token: str) -> bool:
+        self._refresh()
+        return hash_token(token) in self._by_hash
+
+    def set(self, username: str, token: str, token_file: Path | None = None, mtime: int | None = None) -> None:
+        token_hash = hash_token(token)
+        token_file = token_file or self.tokens_dir / username
+        if mtime is None:
+            try:
+                mtime = token_file.stat().st_mtime_ns
+            except OSError:
+                mtime = 0
+        with self._lock:
+            old = self._by_user.get(username)
+            if old and self._by_hash.get(old[0]) == username:
+                del self._by_hash[old[0]]
+            self._by_hash[token_hash] = username
+            self._by_user[username] = (token_hash, mtime, token_file)
+
+    def remove(self, username: str) -> None:
+        with self._lock:
+            old = self._by_user.pop(username, None)
+            if old and self._by_hash.get(old[0]) == username:
+                del self._by_hash[old[0]]
+
+    def __len__(self) -> int:
+        self._refresh()
+        return len(self._by_user)
@@ -0,0 +1,134 @@
+import hashlib
+import logging
+import os
+import threading
+
+from pathlib import Path
+
+from .fsutil import atomic_write_text
+
+
+logger = logging.getLogger(__name__)
+
+USER_SHARDS = [f'{i:02x}' for i in range(256)]
+
+
+def user_shard(username: str) -> str:
+    '''Shard of a user: a stable bucket given by the hash of the name.'''
+    return hashlib.sha256(username.encode()).hexdigest()[:2]
+
+
+class UserIndex(object):
+    '''
+    List of users kept in one file per shard in `index_dir`, each with the
+    sorted user names of that shard. Adding or removing a user rewrites only
+    its shard file, with a rename.
+
+    Other processes may change the index too: shard files are read again
+    whenever the index dir mtime changes.
+    '''
+
+    def __init__(self, index_dir: str | Path) -> None:
+        self.index_dir = Path(index_dir)
+        self._lock = threading.RLock()
+        self._shards: dict[str, set[str]] = {}
+        self._shard_mtimes: dict[str, int] = {}
+        self._dir_mtime = None
+
+    def exists(self) -> bool:
+        return self.index_dir.is_dir()
+
+    def _refresh(self) -> None:
+        try:
+            dir_mtime = os.stat(self.index_dir).st_mtime_ns
+        except OSError:
+            dir_mtime = None
+        if dir_mtime == self._dir_mtime:
+            return
+        with self._lock:
+            for shard in USER_SHARDS:
+                path = self.index_dir / shard
+                try:
+                    mtime = path.stat().st_mtime_ns
+                except OSError:
+                    self._shards.pop(shard, None)
+                    self._shard_mtimes.pop(shard, None)
+                    continue
+                if self._shard_mtimes.get(shard) != mtime:
+                    self._shards[shard] = set(path.read_text().split())
+                    self._shard_mtimes[shard] = mtime
+            self._dir_mtime = dir_mtime
+
+    def users(self) -> list[str]:
+        self._refresh()
+        return sorted(user for members in list(self._shards.values()) for user in members)
+
+    def shard_users(self, shard: str) -> list[str]:
+        self._refresh()
+        return sorted(self._shards.get(shard, ()))
+
+    def __contains__(self, username: str) -> bool:
+        self._refresh()
+        return username in self._shards.get(user_shard(username), ())
+
+    def known(self, username: str) -> bool:
+        '''Whether the user is in the index as last read, with no check of the shard files: for hot paths.'''
+        return username in self._shards.get(user_shard(username), ())
+
+    def __len__(self) -> int:
+        self._refresh()
+        return sum(len(members) for members in list(self._shards.values()))
+
+    def add(self, username: str) -> str | None:
+        '''Adds a user. Returns the shard if it changed, None if the user was already there.'''
+        with self._lock:
+            self._refresh()
+            shard = user_shard(username)
+            members = self._shards.get(shard, set())
+            if username in members:
+                return None
+            self._write(shard, members | {username})
+            return shard
+
+    def add_many(self, usernames) -> list[str]:
+        '''Adds several users, rewriting each shard once. Returns the shards that changed.'''
+        new: dict[str, set[str]] = {}
+        for username in usernames:
+            new.setdefault(user_shard(username), set()).add(username)
+        changed = []
+        with self._lock:
+            self._refresh()
+            for shard, added in sorted(new.items()):
+                members = self._shards.get(shard, set())
+                if not added <= members:
+                    self._write(shard, members | added)
+                    changed.append(shard)
+        return changed
+
+    def remove(self, username: str) -> str | None:
+        '''Removes a user. Returns the shard if it changed, None if the user was not there.'''
+        with self._lock:
+            self._refresh()
+            shard = user_shard(username)
+            members = self._shards.get(shard, set())
+            if username not in members:
+                return None
+            self._write(shard, members - {username})
+            return shard
+
+    def rebuild(self, usernames) -> None:
+        '''Replaces the whole index, e.g. from a scan of the zones dir.'''
+        shards = {shard: set() for shard in USER_SHARDS}
+        for username in usernames:
+            shards[user_shard(username)].add(username)
+        with self._lock:
+            self.index_dir.mkdir(parents=True, exist_ok=True)
+            for shard, members in shards.items():
+                self._write(shard, members)
+        logger.info(f'Rebuilt user index with {sum(len(m) for m in shards.values())} users')
+
+    def _write(self, shard: str, members: set[str]) -> None:
+        path = self.index_dir / shard
+        atomic_write_text(path, ''.join(f'{user}\n' for user in sorted(members)))
+        self._shards[shard] = set(members)
+        self._shard_mtimes[shard] = path.stat().st_mtime_ns
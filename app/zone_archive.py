@@ -0,0 +1,199 @@
+import gzip
+import io
+import json
+import re
+import tarfile
+import zlib
+
+from datetime import datetime, timezone
+from typing import BinaryIO, Iterable, Iterator
+
+
+ARCHIVE_FORMAT = 'dns-platform'
+ARCHIVE_VERSION = 1
+FORMAT_NDJSON = 'ndjson'
+FORMAT_TAR = 'tar'
+FORMATS = (FORMAT_NDJSON, FORMAT_TAR)
+HEADER_MEMBER = 'export.json'  # First member of a tar archive
+CHUNK_SIZE = 64 * 1024  # Bytes of output gathered before it is sent
+USERNAME_RE = re.compile(r'^[A-Za-z0-9_][A-Za-z0-9_.-]*$')  # Also a file name in the Bind dir
+
+
+class ArchiveError(Exception):
+    pass
+
+
+def archive_header(origin: str, users: int) -> dict:
+    return {
+        'format': ARCHIVE_FORMAT,
+        'version': ARCHIVE_VERSION,
+        'origin': origin,
+        'users': users,
+        'exported': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+    }
+
+
+def write_ndjson(header: dict, entries: Iterable[dict]) -> Iterator[bytes]:
+    '''
+    NDJSON export: the header, then one line per user with its username,
+    zone, token, token_active and modified. Generated as it is sent.
+    '''
+    out = [json.dumps(header) + '\n']
+    size = 0
+    for entry in entries:
+        line = json.dumps(entry) + '\n'
+        out.append(line)
+        size += len(line)
+        if size >= CHUNK_SIZE:
+            yield ''.join(out).encode()
+            out = []
+            size = 0
+    yield ''.join(out).encode()
+
+
+class _Chunks(io.RawIOBase):
+    '''Write-only file gathering what tarfile writes, taken out as it grows.'''
+
+    def __init__(self) -> None:
+        self._parts = []
+        self.size = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def take(self) -> bytes:
+        data = b''.join(self._parts)
+        self._parts = []
+        self.size = 0
+        return data
+
+
+def _add_member(tar: tarfile.TarFile, name: str, data: str, mtime: float) -> None:
+    raw = data.encode()
+    info = tarfile.TarInfo(name)
+    info.size = len(raw)
+    info.mtime = int(mtime)  # A float needs a pax header per member
+    info.mode = 0o644
+    tar.addfile(info, io.BytesIO(raw))
+
+
+def write_tar(header: dict, entries: Iterable[dict]) -> Iterator[bytes]:
+    '''
+    tar.gz export laid out as the Bind dir: export.json (the header), then
+    for each user tokens/<user> (tokens/<user>.inactive if disabled) and
+    zones/<user>, with the zone modification time. Generated as it is sent.
+    '''
+    out = _Chunks()
+    with tarfile.open(fileobj=out, mode='w|gz', bufsize=CHUNK_SIZE) as tar:
+        _add_member(tar, HEADER_MEMBER, json.dumps(header), datetime.now().timestamp())
+        for entry in entries:
+            mtime = datetime.fromisoformat(entry['modified']).timestamp()
+            if entry['token'] is not None:
+                suffix = '' if entry['token_active'] else '.inactive'
+                _add_member(tar, f'tokens/{entry["username"]}{suffix}', entry['token'], mtime)
+            _add_member(tar, f'zones/{entry["username"]}', entry['zone'], mtime)
+            if out.size >= CHUNK_SIZE:
+                yield out.take()
+    yield out.take()
+
+
+def read_archive(fileobj: BinaryIO) -> tuple[dict, Iterator[dict]]:
+    '''
+    Reads an export made by write_ndjson or write_tar (told apart by the gzip
+    magic). Returns the checked header and an iterator of the user entries,
+    read lazily. An entry with a None zone only carries a token. Raises
+    ArchiveError, also while iterating.
+    '''
+    magic = fileobj.read(2)
+    fileobj.seek(0)
+    if magic == b'\x1f\x8b':
+        header, entries = _read_tar(fileobj)
+    else:
+        header, entries = _read_ndjson(fileobj)
+    if not isinstance(header, dict) or header.get('format') != ARCHIVE_FORMAT:
+        raise ArchiveError('Not an export of the DNS platform')
+    if header.get('version') != ARCHIVE_VERSION:
+        raise ArchiveError(f'Unsupported export version {header.get("version")}')
+    return header, entries
+
+
+def _check_entry(entry, where: str) -> dict:
+    if not isinstance(entry, dict):
+        raise ArchiveError(f'{where}: not an object')
+    username = entry.get('username')
+    if not isinstance(username, str) or not USERNAME_RE.match(username):
+        raise ArchiveError(f'{where}: bad username {username!r}')
+    for key in ('zone', 'token'):
+        if entry.get(key) is not None and not isinstance(entry[key], str):
+            raise ArchiveError(f'{where}: {key} is not a string')
+    return {
+        'username': username,
+        'zone': entry.get('zone'),
+        'token': entry.get('token'),
+        'token_active': entry.get('token_active', True) is not False,
+    }
+
+
+def _read_ndjson(fileobj: BinaryIO) -> tuple[dict, Iterator[dict]]:
+    lines = io.TextIOWrapper(fileobj, encoding='utf-8')
+    try:
+        header = json.loads(lines.readline())
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ArchiveError(f'Line 1: {e}')
+
+    def entries() -> Iterator[dict]:
+        for number, line in enumerate(lines, start=2):
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError as e:
+                raise ArchiveError(f'Line {number}: {e}')
+            yield _check_entry(entry, f'Line {number}')
+
+    return header, _reraise(entries())
+
+
+def _read_tar(fileobj: BinaryIO) -> tuple[dict, Iterator[dict]]:
+    try:
+        # GzipFile reads much faster than the 'r|gz' stream of tarfile
+        tar = tarfile.open(fileobj=gzip.GzipFile(fileobj=fileobj, mode='rb'), mode='r|')
+        member = tar.next()
+        if member is None or member.name != HEADER_MEMBER:
+            raise ArchiveError(f'The archive does not start with {HEADER_MEMBER}')
+        header = json.loads(tar.extractfile(member).read())
+    except (tarfile.TarError, OSError, EOFError, zlib.error, ValueError) as e:
+        raise ArchiveError(f'Bad archive: {e}')
+
+    def entries() -> Iterator[dict]:
+        tokens = {}  # username: (token, active), until its zone comes
+        for member in tar:
+            kind, _, name = member.name.partition('/')
+            if not member.isfile() or kind not in ('tokens', 'zones'):
+                continue
+            data = tar.extractfile(member).read().decode()
+            tar.members = []  # A stream needs no index of what was read, and memory stays flat
+            if kind == 'tokens':
+                username, inactive = (name[:-len('.inactive')], True) if name.endswith('.inactive') else (name, False)
+                tokens[username] = (data.strip(), not inactive)
+                continue
+            token, active = tokens.pop(name, (None, True))
+            yield _check_entry({'username': name, 'zone': data, 'token': token, 'token_active': active},
+                               member.name)
+        for username, (token, active) in tokens.items():  # Tokens of users with no zone in the archive
+            yield _check_entry({'username': username, 'token': token, 'token_active': active}, f'tokens/{username}')
+
+    return header, _reraise(entries())
+
+
+def _reraise(entries: Iterator[dict]) -> Iterator[dict]:
+    '''Entries, with the errors of a truncated or corrupt input raised as ArchiveError.'''
+    try:
+        yield from entries
+    except (tarfile.TarError, OSError, EOFError, zlib.error, UnicodeDecodeError) as e:
+        raise ArchiveError(f'Bad archive: {e}')
@@ -0,0 +1,84 @@
+import hashlib
+import os
+import threading
+
+from pathlib import Path
+
+from .zone_model import UserZone
+
+
+class UserZoneView(object):
+    '''
+    Zone text of one user plus its parsed zone (None if dnspython could not
+    parse it). The ETag and the record list are computed once per view.
+    '''
+
+    def __init__(self, text: str, zone: UserZone | None = None) -> None:
+        self.text = text
+        self.zone = zone
+        self.mtime = None
+        self._etag = None
+        self._records = None
+
+    @property
+    def etag(self) -> str:
+        '''Hash of the zone text, the version of the zone for HTTP caching and If-Match.'''
+        if self._etag is None:
+            self._etag = hashlib.sha256(self.text.encode()).hexdigest()[:32]
+        return self._etag
+
+    def records(self) -> list[dict] | None:
+        '''UserZone.record_list() of the zone, None if it can not be parsed.'''
+        if self._records is None and self.zone is not None:
+            self._records = self.zone.record_list()
+        return self._records
+
+    def has_a_record(self, hostname: str, ip: str, ttl=None) -> bool:
+        '''True if `hostname` already has `ip` as its only A record (with `ttl`, if given).'''
+        return self.zone is not None and self.zone.has_records(hostname, 'A', [ip], ttl)
+
+
+class ZoneCache(object):
+    '''
+    Per-user cache of zone views. Entries are filled on first read and
+    replaced by every write done through ZoneManager, so a cached view is
+    the zone currently on disk.
+
+    When other processes also write the zones (multi-worker mode), pass
+    `zones_dir`: each hit is then checked against the zone file inode, mtime and size.
+    '''
+
+    def __init__(self, zones_dir: str | None = None) -> None:
+        self.zones_dir = Path(zones_dir) if zones_dir else None
+        self._lock = threading.Lock()
+        self._views: dict[str, UserZoneView] = {}
+
+    def _mtime(self, username: str) -> tuple | None:
+        try:
+            st = os.stat(self.zones_dir / username)
+            return st.st_ino, st.st_mtime_ns, st.st_size
+        except OSError:
+            return None
+
+    def get(self, username: str) -> UserZoneView | None:
+        view = self._views.get(username)
+        if view and self.zones_dir and view.mtime != self._mtime(username):
+            self.invalidate(username)
+            return None
+        return view
+
+    def put(self, username: str, text: str, zone: UserZone | None = None) -> UserZoneView:
+        view = UserZoneView(text, zone)
+        if self.zones_dir:
+            view.mtime = self._mtime(username)
+        with self._lock:
+            self._views[username] = view
+        return view
+
+    def invalidate(self, username: str) -> None:
+        with self._lock:
+            self._views.pop(username, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._views.clear()
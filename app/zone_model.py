@@ -0,0 +1,316 @@
+import hashlib
+import re
+import time
+
+import dns.exception
+import dns.name
+import dns.node
+import dns.rdata
+import dns.rdataclass
+import dns.rdataset
+import dns.rdatatype
+import dns.zone
+
+from .zone_validator import ZoneValidationError, check_zone_changes
+
+
+SERIAL_MODULO = 2**32  # SOA serials wrap around (RFC 1982)
+SOA_SERIAL_RE = re.compile(r'^[^;\n]*\bSOA\s+\S+\s+\S+\s+\(?\s*(\d+)', re.IGNORECASE | re.MULTILINE)
+
+
+def serial_gt(a: int, b: int) -> bool:
+    '''True if serial `a` is greater than `b` in serial number arithmetic (RFC 1982).'''
+    return a != b and (a - b) % SERIAL_MODULO < 2**31
+
+
+def next_serial(serial: int | None) -> int:
+    '''
+    Serial of the next version of a zone: the Unix time, or `serial` + 1 if
+    that is not greater (several changes in one second, or an older serial
+    scheme like YYYYMMDDnn). Secondaries only transfer a zone if it grows.
+    '''
+    now = int(time.time()) % SERIAL_MODULO
+    if serial is None or serial_gt(now, serial):
+        return now
+    return (serial + 1) % SERIAL_MODULO
+
+
+def zone_text_serial(zone_data: str) -> int | None:
+    '''SOA serial of a zone file, without parsing the whole zone.'''
+    match = SOA_SERIAL_RE.search(zone_data)
+    return int(match.group(1)) if match else None
+
+
+def set_zone_text_serial(zone_data: str, serial: int) -> str:
+    '''Zone file with its SOA serial set to `serial`, the rest of the text unchanged.'''
+    match = SOA_SERIAL_RE.search(zone_data)
+    if not match:
+        return zone_data
+    return zone_data[:match.start(1)] + str(serial) + zone_data[match.end(1):]
+
+
+def record_id(name: dns.name.Name, rdtype: int, rdata) -> str:
+    '''Stable id of one record: the same record keeps it while the rest of the zone changes.'''
+    key = f'{name.to_text().lower()} {dns.rdatatype.to_text(rdtype)} {rdata.to_text()}'
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+
+class UserZone(object):
+    '''
+    Parsed zone of one user with record-level edits.
+
+    A UserZone is never modified while it is cached. Edits go to a `draft()`,
+    which shares the unchanged nodes with the original and copies only the
+    nodes it touches, so an edit costs in proportion to the records changed.
+    `check()` validates only the touched nodes and `to_text()` gives the
+    canonical (sorted) zone file.
+    '''
+
+    def __init__(self, zone: dns.zone.Zone) -> None:
+        self.zone = zone
+        self.origin = zone.origin
+        self.touched: set[dns.name.Name] = set()
+
+    @classmethod
+    def from_text(cls, origin: str, zone_data: str) -> 'UserZone':
+        try:
+            zone = dns.zone.from_text(zone_data, origin=origin, relativize=False, check_origin=False)
+        except (dns.exception.DNSException, ValueError) as e:
+            raise ZoneValidationError(f'zone {origin}: {e}')
+        return cls(zone)
+
+    def draft(self) -> 'UserZone':
+        zone = dns.zone.Zone(self.origin, relativize=False)
+        zone.nodes = dict(self.zone.nodes)
+        return UserZone(zone)
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.touched)
+
+    @property
+    def soa(self):
+        return self.zone.get_rdataset(self.origin, dns.rdatatype.SOA)
+
+    @property
+    def serial(self) -> int:
+        return self.soa[0].serial
+
+    @property
+    def default_ttl(self) -> int:
+        return self.soa.ttl
+
+    def name(self, hostname: str) -> dns.name.Name:
+        '''Absolute name of `hostname`, relative to the zone unless it ends with a dot.'''
+        try:
+            name = dns.name.from_text(hostname, self.origin)
+        except dns.exception.DNSException as e:
+            raise ZoneValidationError(f'Bad name {hostname}: {e}')
+        if not name.is_subdomain(self.origin):
+            raise ZoneValidationError(f'{hostname} is out of zone {self.origin}')
+        return name
+
+    def records(self, hostname: str, rdtype: str) -> tuple[int | None, list[str]]:
+        '''TTL and values of the records of type `rdtype` at `hostname`.'''
+        rdataset = self.zone.get_rdataset(self.name(hostname), self._rdtype(rdtype))
+        if rdataset is None:
+            return None, []
+        return rdataset.ttl, [rdata.to_text() for rdata in rdataset]
+
+    def has_records(self, hostname: str, rdtype: str, values: list[str], ttl=None) -> bool:
+        '''True if the records of type `rdtype` at `hostname` are exactly `values` (and `ttl`, if given).'''
+        try:
+            rdataset = self.zone.get_rdataset(self.name(hostname), self._rdtype(rdtype))
+            wanted = self._rdataset(rdtype, values, ttl or 0)
+        except ZoneValidationError:
+            return False
+        if rdataset is None or (ttl and rdataset.ttl != int(ttl)):
+            return False
+        return set(rdataset) == set(wanted)
+
+    def record_list(self) -> list[dict]:
+        '''Every record but the SOA, in the order of `to_text()`, with its id and names relative to the zone.'''
+        records = []
+        for name in sorted(self.zone.nodes):
+            records.extend(self._node_records(name))
+        return records
+
+    def diff(self, other: 'UserZone', names=None) -> list[dict]:
+        '''
+        Record changes (but the SOA) from this zone to `other`: the records of
+        `record_list()` with an "op", "delete" or "add". A changed TTL is a
+        delete and an add. Only `names` are compared if given, e.g. the
+        `touched` names of a draft.
+        '''
+        if names is None:
+            names = self.zone.nodes.keys() | other.zone.nodes.keys()
+        changes = []
+        for name in sorted(names):
+            old = {record['id']: record for record in self._node_records(name)}
+            new = {record['id']: record for record in other._node_records(name)}
+            for rid, record in old.items():
+                if rid not in new or new[rid]['ttl'] != record['ttl']:
+                    changes.append({'op': 'delete', **record})
+            for rid, record in new.items():
+                if rid not in old or old[rid]['ttl'] != record['ttl']:
+                    changes.append({'op': 'add', **record})
+        return changes
+
+    def _node_records(self, name: dns.name.Name) -> list[dict]:
+        node = self.zone.nodes.get(name)
+        if node is None:
+            return []
+        records = []
+        hostname = name.relativize(self.origin).to_text()
+        for rdataset in sorted(node, key=lambda r: (r.rdtype, r.covers)):
+            if rdataset.rdtype == dns.rdatatype.SOA:
+                continue
+            rdtype = dns.rdatatype.to_text(rdataset.rdtype)
+            for rdata in sorted(rdataset, key=lambda r: r.to_text()):
+                records.append({'id': record_id(name, rdataset.rdtype, rdata),
+                                'name': hostname,
+                                'type': rdtype,
+                                'ttl': rdataset.ttl,
+                                'value': rdata.to_text(origin=self.origin, relativize=True)})
+        return records
+
+    def record_id(self, hostname: str, rdtype: str, value: str) -> str:
+        '''Id in `record_list()` of the record `hostname` `rdtype` `value`, whether it exists or not.'''
+        return record_id(self.name(hostname), self._rdtype(rdtype), self._rdataset(rdtype, [value], 0)[0])
+
+    def find_record(self, rid: str) -> dict | None:
+        '''Record of `record_list()` with id `rid`, or None.'''
+        for record in self.record_list():
+            if record['id'] == rid:
+                return record
+        return None
+
+    def patch_record(self, rid: str, hostname: str | None = None, value: str | None = None, ttl=None) -> bool:
+        '''
+        Changes the name, value or TTL of the record with id `rid`. The TTL
+        applies to every record of the same name and type. Raises KeyError if there is no such record.
+        '''
+        record = self.find_record(rid)
+        if record is None:
+            raise KeyError(rid)
+        hostname = record['name'] if hostname is None else hostname
+        value = record['value'] if value is None else value
+        if self.name(hostname) == self.name(record['name']) and value == record['value']:
+            return self.replace(hostname, record['type'], self.records(hostname, record['type'])[1],
+                                record['ttl'] if ttl is None else ttl)
+        self.delete(record['name'], record['type'], record['value'])
+        if ttl is None and self.records(hostname, record['type'])[0] is None:
+            ttl = record['ttl']
+        self.add(hostname, record['type'], value, ttl)
+        return True
+
+    def add(self, hostname: str, rdtype: str, value: str, ttl=None) -> bool:
+        '''Adds one record to the records of type `rdtype` at `hostname`.'''
+        name = self.name(hostname)
+        old = self.zone.get_rdataset(name, self._rdtype(rdtype))
+        values = [rdata.to_text() for rdata in old] if old else []
+        if ttl is None and old:
+            ttl = old.ttl
+        return self.replace(hostname, rdtype, values + [value], ttl)
+
+    def replace(self, hostname: str, rdtype: str, values: list[str], ttl=None) -> bool:
+        '''Sets the records of type `rdtype` at `hostname` to `values`. Keeps their TTL if `ttl` is None.'''
+        name = self.name(hostname)
+        old = self.zone.get_rdataset(name, self._rdtype(rdtype))
+        if ttl is None:
+            ttl = old.ttl if old else self.default_ttl
+        rdataset = self._rdataset(rdtype, values, ttl)
+        if old is not None and old.ttl == rdataset.ttl and set(old) == set(rdataset):
+            return False
+        if len(rdataset) > 1 and dns.rdatatype.is_singleton(rdataset.rdtype):
+            raise ZoneValidationError(f'{hostname}: multiple RRs of singleton type {rdtype}')
+        node = self.zone.get_node(name)
+        if node is not None:
+            self._check_cname_conflict(hostname, node, rdataset.rdtype)
+        self._writable_node(name).replace_rdataset(rdataset)
+        return True
+
+    def delete(self, hostname: str, rdtype: str | None = None, value: str | None = None) -> bool:
+        '''Deletes one record, the records of one type, or every record at `hostname`.'''
+        name = self.name(hostname)
+        node = self.zone.get_node(name)
+        if node is None:
+            return False
+        if rdtype is None:
+            if name == self.origin:
+                raise ZoneValidationError('The zone apex records can not be deleted')
+            del self.zone.nodes[name]
+            self.touched.add(name)
+            return True
+        old = node.get_rdataset(dns.rdataclass.IN, self._rdtype(rdtype))
+        if old is None:
+            return False
+        if value is None:
+            self._writable_node(name).delete_rdataset(dns.rdataclass.IN, old.rdtype)
+        else:
+            rdata = self._rdataset(rdtype, [value], old.ttl)[0]
+            if rdata not in old:
+                return False
+            remaining = [r for r in old if r != rdata]
+            if remaining:
+                self._writable_node(name).replace_rdataset(dns.rdataset.from_rdata_list(old.ttl, remaining))
+            else:
+                self._writable_node(name).delete_rdataset(dns.rdataclass.IN, old.rdtype)
+        if not len(self.zone.nodes[name]):
+            del self.zone.nodes[name]
+        return True
+
+    def bump_serial(self) -> None:
+        self.set_serial(next_serial(self.serial))
+
+    def set_serial(self, serial: int) -> None:
+        soa = self.soa
+        rdata = soa[0].replace(serial=serial)
+        self._writable_node(self.origin).replace_rdataset(dns.rdataset.from_rdata(soa.ttl, rdata))
+
+    def check(self, names=None) -> None:
+        '''Checks `names`, by default every node changed in this draft. Raises ZoneValidationError.'''
+        check_zone_changes(self.zone, self.touched if names is None else names)
+
+    def to_text(self) -> str:
+        '''Zone file with names in canonical order, SOA first at the apex and records sorted.'''
+        lines = [f'$ORIGIN {self.origin}']
+        for name in sorted(self.zone.nodes):
+            node = self.zone.nodes[name]
+            for rdataset in sorted(node, key=lambda r: (r.rdtype != dns.rdatatype.SOA, r.rdtype, r.covers)):
+                lines.extend(sorted(rdataset.to_text(name, origin=self.origin, relativize=True).splitlines()))
+        lines.append('')  # Ending newline mandatory for zone records
+        return '\n'.join(lines)
+
+    def _rdtype(self, rdtype: str) -> dns.rdatatype.RdataType:
+        try:
+            return dns.rdatatype.from_text(rdtype)
+        except dns.exception.DNSException as e:
+            raise ZoneValidationError(f'Bad record type {rdtype}: {e}')
+
+    def _rdataset(self, rdtype: str, values: list[str], ttl) -> dns.rdataset.Rdataset:
+        try:
+            rdatas = [dns.rdata.from_text(dns.rdataclass.IN, rdtype, value, origin=self.origin, relativize=False)
+                      for value in values]
+            return dns.rdataset.from_rdata_list(int(ttl), rdatas)
+        except (dns.exception.DNSException, ValueError) as e:
+            raise ZoneValidationError(f'Bad {rdtype} record {values}: {e}')
+
+    def _check_cname_conflict(self, hostname: str, node: dns.node.Node, rdtype: int) -> None:
+        # dnspython silently drops the other data when a CNAME is added, and the other way around
+        types = {rdataset.rdtype for rdataset in node} - {rdtype}
+        if types and (rdtype == dns.rdatatype.CNAME or dns.rdatatype.CNAME in types):
+            raise ZoneValidationError(f'{hostname}: CNAME and other data')
+
+    def _writable_node(self, name: dns.name.Name) -> dns.node.Node:
+        '''Node at `name` that belongs to this draft only (copied on first write).'''
+        if name not in self.touched:
+            node = dns.node.Node()
+            old = self.zone.nodes.get(name)
+            if old is not None:
+                node.rdatasets = list(old.rdatasets)
+            self.zone.nodes[name] = node
+            self.touched.add(name)
+        elif name not in self.zone.nodes:
+            self.zone.nodes[name] = dns.node.Node()  # Deleted earlier in this draft
+        return self.zone.nodes[name]
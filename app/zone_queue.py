@@ -0,0 +1,74 @@
+import asyncio
+import functools
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ZoneQueueFull(Exception):
+    pass
+
+
+class ZoneWorkQueue(object):
+    '''
+    Runs the blocking zone pipeline (write, validate, swap, reload) on a
+    bounded thread pool so it never blocks the event loop.
+
+    Operations of the same user run one at a time, in the order they were
+    submitted; operations of different users run in parallel up to
+    `workers`. At most `max_pending` operations wait or run at a time, more
+    are refused with ZoneQueueFull.
+
+    `run_coalesced` merges identical operations: while one is pending, the
+    same call again waits for it and gets its result instead of queuing.
+    '''
+
+    def __init__(self, workers: int = 16, max_pending: int = 1000) -> None:
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='zone-worker')
+        self._user_locks: dict[str, asyncio.Lock] = {}
+        self._user_pending: dict[str, int] = {}
+        self._inflight: dict[tuple, asyncio.Future] = {}
+
+    async def run(self, username: str, fn, *args, **kwargs):
+        if self.pending >= self.max_pending:
+            raise ZoneQueueFull(f'{self.pending} zone operations pending')
+        self.pending += 1
+        self._user_pending[username] = self._user_pending.get(username, 0) + 1
+        lock = self._user_locks.setdefault(username, asyncio.Lock())
+        try:
+            async with lock:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self._executor, functools.partial(fn, *args, **kwargs))
+        finally:
+            self.pending -= 1
+            self._user_pending[username] -= 1
+            if not self._user_pending[username]:
+                del self._user_pending[username]
+                del self._user_locks[username]
+
+    def is_pending(self, key: tuple) -> bool:
+        '''True if an operation run with run_coalesced(`key`, ...) is pending.'''
+        return key in self._inflight
+
+    async def run_coalesced(self, key: tuple, username: str, fn, *args, **kwargs) -> tuple[object, bool]:
+        '''
+        Like run, unless an operation with the same `key` is pending: then
+        its result (or exception) is returned. Returns (result, coalesced).
+        '''
+        future = self._inflight.get(key)
+        if future is not None:
+            return await asyncio.shield(future), True
+        future = asyncio.ensure_future(self.run(username, fn, *args, **kwargs))
+        self._inflight[key] = future
+        future.add_done_callback(functools.partial(self._coalesced_done, key))
+        return await asyncio.shield(future), False
+
+    def _coalesced_done(self, key: tuple, future: asyncio.Future) -> None:
+        self._inflight.pop(key, None)
+        if not future.cancelled():
+            future.exception()  # Retrieved, even if every caller went away
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True)
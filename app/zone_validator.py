@@ -0,0 +1,144 @@
+import dns.exception
+import dns.name
+import dns.rdataclass
+import dns.rdatatype
+import dns.zone
+import re
+
+
+# Zone validation engines selectable in Settings.zone_validator
+VALIDATOR_DNSPYTHON = 'dnspython'
+VALIDATOR_NAMED = 'named-checkzone'
+VALIDATOR_BOTH = 'both'
+VALIDATORS = (VALIDATOR_DNSPYTHON, VALIDATOR_NAMED, VALIDATOR_BOTH)
+
+HOSTNAME_LABEL = re.compile(rb'^[A-Za-z0-9](?:[A-Za-z0-9-]*[A-Za-z0-9])?$')
+MAILBOX_LABEL = re.compile(rb'^[\x21-\x7e]+$')
+# Record types whose owner must be a hostname
+HOST_OWNER_TYPES = (dns.rdatatype.A, dns.rdatatype.AAAA, dns.rdatatype.MX)
+ADDRESS_TYPES = (dns.rdatatype.A, dns.rdatatype.AAAA)
+
+
+class ZoneValidationError(Exception):
+    pass
+
+
+class RepeatedSingleton(dns.exception.DNSException):
+    pass
+
+
+def _check_singleton(txn, name: dns.name.Name, rdataset) -> None:
+    # dnspython keeps only the last record of a singleton type, Bind rejects the zone
+    if not dns.rdatatype.is_singleton(rdataset.rdtype):
+        return
+    existing = txn.get(name, rdataset.rdtype, rdataset.covers)
+    if existing is not None and existing != rdataset:
+        rdtype = dns.rdatatype.to_text(rdataset.rdtype)
+        raise RepeatedSingleton(f'{name.to_text(omit_final_dot=True)}: multiple RRs of singleton type {rdtype}')
+
+
+class _StrictZone(dns.zone.Zone):
+    '''Zone that refuses a second record of a singleton type while being read.'''
+
+    def writer(self, replacement=False):
+        txn = super().writer(replacement)
+        txn.check_put_rdataset(_check_singleton)
+        return txn
+
+
+def is_hostname(name: dns.name.Name, wildcard: bool = False) -> bool:
+    labels = [label for label in name.labels if label]
+    if wildcard and labels and labels[0] == b'*':
+        labels = labels[1:]
+    return all(HOSTNAME_LABEL.match(label) for label in labels)
+
+
+def is_mailbox(name: dns.name.Name) -> bool:
+    labels = [label for label in name.labels if label]
+    if not labels:
+        return True
+    return MAILBOX_LABEL.match(labels[0]) is not None and all(HOSTNAME_LABEL.match(label) for label in labels[1:])
+
+
+def _host_target(rdata) -> dns.name.Name | None:
+    '''The name in the rdata that must be a hostname, if any.'''
+    if rdata.rdtype in (dns.rdatatype.NS, dns.rdatatype.SRV):
+        return rdata.target
+    if rdata.rdtype == dns.rdatatype.MX:
+        return rdata.exchange
+    if rdata.rdtype == dns.rdatatype.SOA:
+        return rdata.mname
+    return None
+
+
+def check_zone_text(origin: str, zone_data: str, allow_include: bool = False) -> dns.zone.Zone:
+    '''
+    Parses `zone_data` in memory and checks it the way `named-checkzone -k fail` does:
+    - the zone parses (out-of-zone names are ignored, as Bind does),
+    - the apex has exactly one SOA and at least one NS,
+    - no CNAME next to other data and no repeated singleton records,
+    - host names (owners of A, AAAA and MX; targets of NS, MX, SRV and SOA) are valid hostnames,
+    - in-zone NS targets have address records.
+    Returns the parsed zone. Raises ZoneValidationError.
+    '''
+    zone_origin = dns.name.from_text(origin)
+    prefix = f'zone {zone_origin.to_text(omit_final_dot=True)}/IN'
+    try:
+        zone = dns.zone.from_text(zone_data, origin=zone_origin, relativize=False, zone_factory=_StrictZone,
+                                  check_origin=False, allow_include=allow_include)
+    except dns.exception.DNSException as e:
+        raise ZoneValidationError(f'{prefix}: {e}')
+    except (ValueError, OSError) as e:
+        raise ZoneValidationError(f'{prefix}: {e}')
+
+    _check_apex(zone, zone_origin, prefix)
+    for name, node in zone.nodes.items():
+        _check_node(zone, zone_origin, prefix, name, node)
+    return zone
+
+
+def check_zone_changes(zone: dns.zone.Zone, names) -> None:
+    '''
+    Same checks as check_zone_text, limited to the apex and the nodes at
+    `names` of an already parsed zone. Raises ZoneValidationError.
+    '''
+    prefix = f'zone {zone.origin.to_text(omit_final_dot=True)}/IN'
+    _check_apex(zone, zone.origin, prefix)
+    for name in set(names) | {zone.origin}:
+        node = zone.get_node(name)
+        if node is not None:
+            _check_node(zone, zone.origin, prefix, name, node)
+
+
+def _check_apex(zone: dns.zone.Zone, zone_origin: dns.name.Name, prefix: str) -> None:
+    apex = zone.get_node(zone_origin)
+    if apex is None or apex.get_rdataset(dns.rdataclass.IN, dns.rdatatype.SOA) is None:
+        raise ZoneValidationError(f'{prefix}: has 0 SOA records')
+    if apex.get_rdataset(dns.rdataclass.IN, dns.rdatatype.NS) is None:
+        raise ZoneValidationError(f'{prefix}: has no NS records')
+
+
+def _check_node(zone: dns.zone.Zone, zone_origin: dns.name.Name, prefix: str, name: dns.name.Name, node) -> None:
+    owner = name.to_text(omit_final_dot=True)
+    for rdataset in node:
+        rdtype = dns.rdatatype.to_text(rdataset.rdtype)
+        if rdataset.rdtype in HOST_OWNER_TYPES and not is_hostname(name, wildcard=True):
+            raise ZoneValidationError(f'{prefix}: {owner}/{rdtype}: bad owner name (check-names)')
+        for rdata in rdataset:
+            target = _host_target(rdata)
+            if target is not None and not is_hostname(target):
+                raise ZoneValidationError(f'{prefix}: {owner}/{rdtype}: bad name \'{target}\' (check-names)')
+            if rdata.rdtype == dns.rdatatype.SOA and not is_mailbox(rdata.rname):
+                raise ZoneValidationError(f'{prefix}: {owner}/{rdtype}: bad name \'{rdata.rname}\' (check-names)')
+            if rdata.rdtype == dns.rdatatype.NS:
+                _check_ns_address(zone, zone_origin, prefix, rdata.target)
+
+
+def _check_ns_address(zone: dns.zone.Zone, zone_origin: dns.name.Name, prefix: str, target: dns.name.Name) -> None:
+    if not target.is_subdomain(zone_origin):
+        return
+    node = zone.get_node(target)
+    if node is not None and any(node.get_rdataset(dns.rdataclass.IN, t) for t in ADDRESS_TYPES):
+        return
+    name = target.to_text(omit_final_dot=True)
+    raise ZoneValidationError(f'{prefix}: NS \'{name}\' has no address records (A or AAAA)')
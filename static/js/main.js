@@ -5,11 +5,16 @@
 var user_origin;
 
 /**
-* @type {string} Stores the zone data in json format following https://github.com/elgs/dns-zonefile
-  *                Obtained from the html code.
+  * @type {object} Stores the zone as returned by GET /zone:
+  *                {origin, editable, ttl, soa, records: [{id, name, type, ttl, value}]}
   */
 var zone;
 
+/**
+  * @type {string} ETag of `zone`, sent as If-Match with every change.
+  */
+var zone_etag;
+
 
 function ttl_html(ttl, zone_ttl) {
   if (ttl === undefined) {
@@ -72,74 +77,46 @@ function zone_table_row(type, name, value, ttl, zone_ttl, id, deletable = true)
   * Here we add the global zone's $TTL to be shown as default value.
   */
 function fix_ttl_placeholder() {
-  if (!zone || !('$ttl' in zone)) {
+  if (!zone || !('ttl' in zone)) {
     return;
   }
   const inputs = document.querySelectorAll("input[id$='-ttl']");
   inputs.forEach(input => {
-    input.placeholder = `${zone['$ttl']} (default)`;
+    input.placeholder = `${zone['ttl']} (default)`;
   });
 }
 
 
 /**
-  * Returns the current timestamp as integer like 'YYYYMMDD'.
+  * Fetches the zone records into `zone` and rebuilds the zone table.
+  * The browser revalidates with If-None-Match, so an unchanged zone costs a 304.
   */
-function current_date_id() {
-  const currentDate = new Date();
-  const year = currentDate.getFullYear();
-  const month = String(currentDate.getMonth() + 1).padStart(2, '0');
-  const day = String(currentDate.getDate()).padStart(2, '0');
-  return `${year}${month}${day}`;
-}
-
-
-function next_soa_serial() {
-  const currentDate = new Date();
-  return Math.floor(currentDate.getTime() / 1000);
-}
-// function next_soa_serial(serial) {
-//   const num_str = String(serial);
-//   const date_id = current_date_id();
-//   if (num_str.length === 10) {
-//     if (num_str.slice(0, 8) == date_id) {
-//       new_id = Number(num_str.slice(-2)) + 1;
-//       return date_id + String(new_id);
-//     }
-//   }
-//   return date_id + '00';
-// }
-
-function update_zonefile(zone_text) {
-  return new Promise((resolve, reject) => {
-    fetch('/zonefile', {
-      method: 'PUT',
-      headers: {
-        'Content-Type': 'text/plain',
-      },
-      body: zone_text,
+function load_zone() {
+  return fetch('/zone')
+    .then(response => {
+      if (!response.ok) {
+        throw new Error(`Failed loading the zone: ${response.status}`);
+      }
+      zone_etag = response.headers.get('ETag');
+      return response.json();
     })
-      .then(response => {
-        if (response.ok) {
-          resolve({ success: true, msg: 'Success' });
-        } else {
-          return response.json();
-        }
-      })
-      .then(update_msg => {
-        msg = update_msg.detail.message.replace(/\\n/g, '\n'); // Fix newlines
-        reject({ success: false, type: update_msg.detail.error, message: msg });
-      })
-      .catch(error => {
-        msg = error + '\n Reloading page in 5 seconds...';
-        reject({ success: false, type: 'Network error', message: msg });
-        // Suele ser error de fin de sesión. Recargamos por si pide login.
-        // TODO: sólo recargar si el usuario ha perdido sesión. Me falla por problemas CORS que no consigo resolver.
-        setTimeout(() => {
-          window.location.reload();
-        }, 5000);
-      });
-  })
+    .then(data => {
+      zone = data;
+      rebuild_zone_table();
+      fix_ttl_placeholder();
+      load_zone_file();
+    });
+}
+
+/**
+  * Fetches the zone file for the File tab.
+  */
+function load_zone_file() {
+  fetch('/zonefile')
+    .then(response => response.ok ? response.text() : '')
+    .then(text => {
+      document.getElementById("zone-file").textContent = text;
+    });
 }
 
 function remove_rr_update_alerts() {
@@ -147,119 +124,93 @@ function remove_rr_update_alerts() {
     alert.remove();
   })
 }
+
 /**
-  * Takes the current `zone` variable and 
-  * rebuilds the zone table and zone text accordingly.
-  *
-  * This function should be called whenever the `zone` variable is changed.
+  * Sends one record change (POST, PATCH or DELETE to `url`) with the ETag
+  * of the zone we have, then reloads the zone.
+  * Rejects with {type, message} if the server refuses it.
   */
-function rebuild_zone(button, new_zone) {
+function send_record_change(method, url, body) {
   remove_rr_update_alerts();
-  if ('soa' in new_zone) {
-    new_zone['soa']['serial'] = next_soa_serial();
+  const options = {
+    method: method,
+    headers: { 'If-Match': zone_etag },
+  };
+  if (body !== undefined) {
+    options.headers['Content-Type'] = 'application/json';
+    options.body = JSON.stringify(body);
   }
-  new_zone_text = generate(new_zone);
-
   return new Promise((resolve, reject) => {
-    update_zonefile(new_zone_text)
-      .then(result => {
-        zone = new_zone;
-        rebuild_zone_table();
-        const zone_file = document.getElementById("zone-file");
-        zone_file.innerHTML = generate(zone);
-        resolve();
+    fetch(url, options)
+      .then(response => {
+        if (response.ok) {
+          load_zone().then(resolve);
+          return;
+        }
+        if (response.status == 412) {
+          // Changed elsewhere (another tab, dyndns): show the current zone
+          load_zone();
+        }
+        return response.json().then(update_msg => {
+          reject({ success: false, type: update_msg.detail.error, message: update_msg.detail.message });
+        });
       })
       .catch(error => {
-        reject(error);
+        msg = error + '\n Reloading page in 5 seconds...';
+        reject({ success: false, type: 'Network error', message: msg });
+        // Suele ser error de fin de sesión. Recargamos por si pide login.
+        setTimeout(() => {
+          window.location.reload();
+        }, 5000);
       });
   });
 }
 
-function is_rr_deletable(type, rr, soa) {
+function is_rr_deletable(rr, soa) {
   soa_ns = soa.mname.split('.')[0];
-  if (type == 'ns' && rr.name == '@' && rr.host == soa_ns) {
+  if (rr.type == 'NS' && rr.name == '@' && rr.value == soa_ns) {
     return false;
   }
-  if (type == 'a' && rr.name == soa_ns) {
+  if ((rr.type == 'A' || rr.type == 'AAAA') && rr.name == soa_ns) {
     return false;
   }
   return true;
 }
 
+const table_type_order = ['NS', 'A', 'AAAA', 'CNAME', 'MX', 'TXT', 'SRV'];
+
 /**
   * Takes the current `zone` variable and rebuilds the zone table accordingly.
   */
 function rebuild_zone_table() {
-  // https://github.com/elgs/dns-zonefile
-  if (!zone) { return; }
+  if (!zone || !zone.records) { return; }
   var tbody = document.querySelector("#zone-table tbody");
   var rows_html = '';
-  var zone_ttl = zone['$ttl'];
-  var rr_id = 1;
-  if ('ns' in zone) {
-    for (const rr of zone['ns']) {
-      rr.id = rr_id++;
-      if (!('name' in rr)) {
-        rr_name = '<small class="text-body-secondary">@</small>';
-      } else {
-        rr_name = rr['name'];
-      }
-      deletable = is_rr_deletable('ns', rr, zone.soa);
-      rows_html += zone_table_row('NS', rr_name, rr['host'], rr['ttl'], zone_ttl, rr.id, deletable);
-    }
-  }
-  if ('a' in zone) {
-    for (const rr of zone['a']) {
-      rr.id = rr_id++;
-      deletable = is_rr_deletable('a', rr, zone.soa);
-      rows_html += zone_table_row('A', rr['name'], rr['ip'], rr['ttl'], zone_ttl, rr.id, deletable);
-    }
-  }
-  if ('aaaa' in zone) {
-    for (const rr of zone['aaaa']) {
-      rr.id = rr_id++;
-      deletable = is_rr_deletable('aaaa', rr, zone.soa);
-      rows_html += zone_table_row('AAAA', rr['name'], rr['ip'], rr['ttl'], zone_ttl, rr.id, deletable);
-    }
-  }
-  if ('cname' in zone) {
-    for (const rr of zone['cname']) {
-      rr.id = rr_id++;
-      rows_html += zone_table_row('CNAME', rr['name'], rr['alias'], rr['ttl'], zone_ttl, rr.id);
-    }
-  }
-  if ('mx' in zone) {
-    for (const rr of zone['mx']) {
-      rr.id = rr_id++;
-      value = `<span class="badge text-bg-secondary">${rr['preference']}</span> ${rr['host']}`;
-      rows_html += zone_table_row('MX', rr['name'], value, rr['ttl'], zone_ttl, rr.id);
-    }
-  }
-  if ('txt' in zone) {
-    for (const rr of zone['txt']) {
-      rr.id = rr_id++;
-      rows_html += zone_table_row('TXT', rr['name'], rr['txt'], rr['ttl'], zone_ttl, rr.id);
-    }
-  }
-  if ('srv' in zone) {
-    for (const rr of zone['srv']) {
-      rr.id = rr_id++;
-      rows_html += zone_table_row('SRV', rr['name'], rr['txt'], rr['ttl'], zone_ttl, rr.id);
+  const order = type => {
+    const i = table_type_order.indexOf(type);
+    return i == -1 ? table_type_order.length : i;
+  };
+  const records = [...zone.records].sort((a, b) => order(a.type) - order(b.type));
+  for (const rr of records) {
+    value = rr.value;
+    if (rr.type == 'MX') {
+      const [preference, host] = rr.value.split(' ');
+      value = `<span class="badge text-bg-secondary">${preference}</span> ${host}`;
     }
+    deletable = is_rr_deletable(rr, zone.soa);
+    rows_html += zone_table_row(rr.type, rr.name, value, rr.ttl, zone.ttl, rr.id, deletable);
   }
   tbody.innerHTML = rows_html;
 }
 
 
 /**
-  * Reads `user_origin` and `zone` variables from the HTML page
+  * Reads `user_origin` from the HTML page, loads the zone
   * and builds the zone table and other fixes.
   */
 document.addEventListener('DOMContentLoaded', function() {
   user_origin = document.querySelector('meta[name="user-origin"]').content;
-  zone = parse(document.getElementById('zone-file').textContent);
-  rebuild_zone_table();
-  fix_ttl_placeholder();
+  load_zone();
   set_input_validations();
 });
 
@@ -337,82 +288,61 @@ document.querySelectorAll('input[preview$="true"]').forEach(input => {
 // }
 
 function create_record_a(button) {
-  const rr = {
-    'name': toASCII(document.getElementById("a-name").value),
-    'ip': document.getElementById("a-ip").value,
-    'ttl': document.getElementById("a-ttl").value,
-  }
-  create_record_generic(button, 'a', rr);
+  create_record_generic(button, 'A', toASCII(document.getElementById("a-name").value),
+    document.getElementById("a-ip").value, document.getElementById("a-ttl").value);
 }
 
 function create_record_aaaa(button) {
-  const rr = {
-    'name': toASCII(document.getElementById("aaaa-name").value),
-    'ip': document.getElementById("aaaa-ip").value,
-    'ttl': document.getElementById("aaaa-ttl").value,
-  }
-  create_record_generic(button, 'aaaa', rr);
+  create_record_generic(button, 'AAAA', toASCII(document.getElementById("aaaa-name").value),
+    document.getElementById("aaaa-ip").value, document.getElementById("aaaa-ttl").value);
 }
 
 function create_record_cname(button) {
-  const rr = {
-    'name': toASCII(document.getElementById("cname-name").value),
-    'alias': document.getElementById("cname-alias").value,
-    'ttl': document.getElementById("cname-ttl").value,
-  }
-  create_record_generic(button, 'cname', rr);
+  create_record_generic(button, 'CNAME', toASCII(document.getElementById("cname-name").value),
+    document.getElementById("cname-alias").value, document.getElementById("cname-ttl").value);
 }
 
 function create_record_mx(button) {
-  const rr = {
-    'name': toASCII(document.getElementById("mx-name").value),
-    'host': document.getElementById("mx-host").value,
-    'preference': document.getElementById("mx-priority").value,
-    'ttl': document.getElementById("mx-ttl").value,
+  const value = `${document.getElementById("mx-priority").value} ${document.getElementById("mx-host").value}`;
+  create_record_generic(button, 'MX', toASCII(document.getElementById("mx-name").value),
+    value, document.getElementById("mx-ttl").value);
+}
+
+/**
+  * TXT record data: quoted, in strings of at most 255 characters.
+  */
+function txt_value(text) {
+  const chunks = [];
+  for (let i = 0; i < text.length || i == 0; i += 255) {
+    chunks.push('"' + text.slice(i, i + 255).replace(/\\/g, '\\\\').replace(/"/g, '\\"') + '"');
   }
-  create_record_generic(button, 'mx', rr);
+  return chunks.join(' ');
 }
 
 function create_record_txt(button) {
-  const rr = {
-    'name': toASCII(document.getElementById("txt-name").value),
-    'txt': toASCII(document.getElementById("txt-value").value),
-    'ttl': document.getElementById("txt-ttl").value,
-  }
-  create_record_generic(button, 'txt', rr);
+  create_record_generic(button, 'TXT', toASCII(document.getElementById("txt-name").value),
+    txt_value(toASCII(document.getElementById("txt-value").value)), document.getElementById("txt-ttl").value);
 }
 
 function create_record_ns(button) {
-  const rr = {
-    'name': toASCII(document.getElementById("ns-name").value),
-    'host': document.getElementById("ns-nameserver").value,
-    'ttl': document.getElementById("ns-ttl").value,
-  }
-  create_record_generic(button, 'ns', rr);
+  create_record_generic(button, 'NS', toASCII(document.getElementById("ns-name").value),
+    document.getElementById("ns-nameserver").value, document.getElementById("ns-ttl").value);
 }
 
 
-function create_record_generic(button, type, rr_dict) {
+function create_record_generic(button, type, name, value, ttl) {
   if (!zone) { return; }
   if (!check_button(button)) {
     return;
   }
-  rr = {};
-  for (let key in rr_dict) {
-    if (rr_dict[key]) {
-      rr[key] = rr_dict[key];
-    }
-  }
-  if (Object.keys(rr).length == 0) {
+  if (!name || !value) {
     return;
   }
-  new_zone = structuredClone(zone);
-  if (type in new_zone) {
-    new_zone[type].push(rr);
-  } else {
-    new_zone[type] = [rr];
+  const rr = { 'name': name, 'type': type, 'value': value };
+  if (ttl) {
+    rr['ttl'] = parseInt(ttl);
   }
-  rebuild_zone(button, new_zone)
+  send_record_change('POST', '/zone/records', rr)
     .catch(error => {
       html_error = `
         <div class="row mt-1">
@@ -563,17 +493,11 @@ function set_input_validations() {
 }
 
 function delete_rr(button) {
-  const rr_type = button.closest('tr').querySelector('th').innerText.toLowerCase();
-  rrid = parseInt(button.attributes.rr_id.nodeValue);
-  const idx = zone[rr_type].findIndex(item => item.id == rrid);
-  if (idx == -1) {
-    return;
-  }
-  new_zone = structuredClone(zone);
-  new_zone[rr_type].splice(idx, 1);
-  rebuild_zone(button, new_zone).then(_ => {
-    // window.location.reload(true);
-  });
+  const rrid = button.attributes.rr_id.nodeValue;
+  send_record_change('DELETE', `/zone/records/${rrid}`)
+    .catch(error => {
+      alert(`${error.type}\n${error.message}`);
+    });
 }
 
 function domain_sanitizer(domain) {
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+'''
+Load and latency benchmark of the web app, driven in-process through its
+ASGI interface (no network, no uvicorn).
+
+For each population size a fresh Bind directory is generated with that many
+users (zone and token files), the app is started on it and every scenario is
+run against it, then every zone and token is exported and imported back
+through /admin/export and /admin/import (round_trip). Each population runs in its own Python process, so module
+state does not leak between them. Results are printed as JSON (or written to
+--output) to compare commits:
+
+    python tools/bench.py --users 100 1000 10000 --output bench.json
+
+By default the BIND tools are the stubs in tools/bench_stubs/, which succeed
+after --stub-latency seconds; the named stub then stays in the background
+with its pid file, as named does, until the population process exits. With --named real the BIND tools found in PATH
+are used instead; the generated config points to /etc/bind, so this only
+works inside the Docker image and with --bind-dir /etc/bind.
+'''
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+STUBS_DIR = Path(__file__).resolve().parent / 'bench_stubs'
+
+SCENARIOS = ('update_changed', 'update_unchanged', 'get_zonefile', 'put_zonefile', 'root')
+ROOT_DOMAIN = 'example.com.'
+PUBLIC_IP = '192.0.2.1'
+
+
+def percentile(sorted_values: list[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summary(latencies: list[float], errors: int, seconds: float) -> dict:
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'seconds': round(seconds, 4),
+        'throughput': round(len(latencies) / seconds, 2) if seconds else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'max_ms': round(latencies[-1] * 1000, 3) if latencies else 0.0,
+    }
+
+
+def use_bind_dir(dns_manager, bind_dir: Path) -> None:
+    '''Points every /etc/bind path of app.dns_manager to `bind_dir`.'''
+    for name, value in list(vars(dns_manager).items()):
+        if isinstance(value, str) and value.startswith('/etc/bind'):
+            setattr(dns_manager, name, value.replace('/etc/bind', str(bind_dir).rstrip('/'), 1))
+
+
+def generate_population(zonemgr, users: int) -> dict[str, str]:
+    '''Writes zone and token files of `users` users plus the Bind config. Returns {username: token}.'''
+    from app import dns_manager as dm
+
+    tokens = {}
+    template = zonemgr.jinja_env.get_template(dm.USER_ZONE_TEMPLATE)
+    zones_dir = Path(dm.USER_ZONES_DIR)
+    tokens_dir = Path(dm.USER_TOKENS_DIR)
+    for i in range(users):
+        username = f'user{i:05d}'
+        zone = template.render(origin=zonemgr.user_zone_origin(username), ns_ip=PUBLIC_IP, serial=1,
+                               user_list=[], custom_records='')
+        (zones_dir / username).write_text(zone + f'www\tIN\tA\t198.51.100.{i % 250 + 1}\n')
+        token = f'bench-{i:010d}'
+        (tokens_dir / username).write_text(token)
+        tokens[username] = token
+    zonemgr.users.rebuild(tokens)
+    zonemgr.reset_bind_conf()
+    zonemgr.reset_main_zone()
+    zonemgr.reset_rndc()
+    return tokens
+
+
+async def run_scenario(client, scenario: str, tokens: dict[str, str], requests: int,
+                       concurrency: int, rng: random.Random) -> dict:
+    users = list(tokens)
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+    counter = iter(range(requests))
+
+    def request_args(i: int, username: str):
+        if scenario == 'update_changed':
+            ip = f'203.0.113.{i % 250 + 1}'
+            return 'POST', f'/update/www?api_key={tokens[username]}&ip={ip}', {}
+        if scenario == 'update_unchanged':
+            return 'POST', f'/update/fixed?api_key={tokens[username]}&ip=203.0.113.1', {}
+        headers = {'remote-user': username}
+        if scenario == 'get_zonefile':
+            return 'GET', '/zonefile', {'headers': headers}
+        if scenario == 'put_zonefile':
+            origin = f'{username}.{ROOT_DOMAIN}'
+            zone = (f'$ORIGIN {origin}\n$TTL 60\n@ IN SOA ns.{origin} admin.{origin} {i + 2} 60 60 60 60\n'
+                    f'@ IN NS ns\nns IN A {PUBLIC_IP}\nwww IN A 198.51.100.{i % 250 + 1}\n')
+            return 'PUT', '/zonefile', {'headers': headers, 'content': zone}
+        return 'GET', '/', {'headers': headers}
+
+    if scenario == 'update_unchanged':
+        # Warm up: every user gets the record once, the measured requests change nothing
+        await asyncio.gather(*(client.post(f'/update/fixed?api_key={tokens[username]}&ip=203.0.113.1')
+                               for username in users[:requests]))
+    picks = [rng.choice(users) for _ in range(requests)] if scenario != 'update_unchanged' \
+        else [users[i % min(len(users), requests)] for i in range(requests)]
+
+    async def worker() -> None:
+        nonlocal errors
+        for i in counter:
+            method, url, kwargs = request_args(i, picks[i])
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.request(method, url, **kwargs)
+                latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summary(latencies, errors, time.perf_counter() - start)
+
+
+async def run_round_trip(client) -> dict:
+    '''Exports every zone and token in each format and imports the export back, as an admin.'''
+    headers = {'remote-user': 'bench', 'remote-groups': 'dns_admin'}
+    results = {}
+    for fmt in ('tar', 'ndjson'):
+        start = time.perf_counter()
+        exported = await client.get(f'/admin/export?format={fmt}', headers=headers)
+        export_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        imported = await client.post('/admin/import', content=exported.content, headers=headers)
+        import_seconds = time.perf_counter() - start
+        report = imported.json() if imported.status_code == 200 else {}
+        results[fmt] = {
+            'bytes': len(exported.content),
+            'export_seconds': round(export_seconds, 3),
+            'import_seconds': round(import_seconds, 3),
+            'written': report.get('written', 0),
+            'failed': len(report.get('failed', {})),
+            'error': report.get('error') or (None if imported.status_code == 200 else imported.text),
+        }
+    return results
+
+
+def run_population(args) -> dict:
+    '''Runs every scenario on a fresh population. Runs in a child process.'''
+    bind_dir = Path(args.bind_dir or tempfile.mkdtemp(prefix='bench-bind-'))
+    bind_dir.mkdir(parents=True, exist_ok=True)
+    os.environ.update({
+        'ROOT_DOMAIN': ROOT_DOMAIN,
+        'TESTING_MODE': 'false',
+        'PUBLIC_IP_PROVIDERS': '[]',
+        'RELOAD_WINDOW': str(args.reload_window),
+        'ZONE_VALIDATOR': args.validator,
+        'UPDATE_RATE': '0',  # Measure the pipeline, not the rate limit
+        'NAMED_PID_FILE': str(bind_dir / 'named.pid'),  # Written by the named stub
+    })
+    os.chdir(ROOT_DIR)
+    sys.path.insert(0, str(ROOT_DIR))
+    from app import dns_manager
+    use_bind_dir(dns_manager, bind_dir)
+    Path(dns_manager.PUBLIC_IP_FILE).write_text(PUBLIC_IP)
+
+    import httpx
+    import app.main as main
+    logging.disable(logging.INFO)
+
+    result = {'users': args.users}
+    start = time.perf_counter()
+    tokens = generate_population(main.zonemgr, args.users)
+    result['generate_seconds'] = round(time.perf_counter() - start, 3)
+    for boot in ('cold', 'warm'):
+        if boot == 'warm':
+            main.zonemgr.ready.clear()
+            main.zonemgr._startup_thread = None
+        start = time.perf_counter()
+        main.zonemgr.start()
+        while not main.zonemgr.ready.wait(0.1) and not main.zonemgr.startup_error:
+            pass
+        if main.zonemgr.startup_error:
+            raise main.zonemgr.startup_error
+        result[f'startup_{boot}_seconds'] = round(time.perf_counter() - start, 3)
+
+    async def scenarios() -> dict:
+        rng = random.Random(args.seed)
+        results = {}
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+            for scenario in args.scenarios:
+                results[scenario] = await run_scenario(client, scenario, tokens, args.requests,
+                                                       args.concurrency, rng)
+            round_trip = await run_round_trip(client)
+        return results, round_trip
+
+    result['scenarios'], result['round_trip'] = asyncio.run(scenarios())
+    if not args.bind_dir:
+        shutil.rmtree(bind_dir, ignore_errors=True)
+    return result
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, nargs='+', default=[100, 1000, 10000],
+                        help='Population sizes (default: 100 1000 10000)')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=500, help='Requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=16, help='Requests in flight')
+    parser.add_argument('--named', choices=('stub', 'real'), default='stub')
+    parser.add_argument('--stub-latency', type=float, default=0.0, help='Seconds each stubbed BIND tool takes')
+    parser.add_argument('--reload-window', type=float, default=0)
+    parser.add_argument('--validator', default='dnspython')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--bind-dir', help='Bind directory to use (default: a temporary one per population)')
+    parser.add_argument('--output', help='Write the JSON results here instead of stdout')
+    parser.add_argument('--population', type=int, help=argparse.SUPPRESS)  # Child process mode
+    args = parser.parse_args()
+
+    if args.population is not None:
+        args.users = args.population
+        json.dump(run_population(args), sys.stdout)
+        return 0
+
+    env = dict(os.environ)
+    if args.named == 'stub':
+        env['PATH'] = f'{STUBS_DIR}{os.pathsep}{env.get("PATH", "")}'
+        env['BENCH_STUB_LATENCY'] = str(args.stub_latency)
+    elif not shutil.which('named'):
+        parser.error('--named real needs BIND (named, named-checkzone, rndc) in PATH')
+
+    report = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'params': {k: v for k, v in vars(args).items() if k not in ('output', 'population')},
+        'populations': [],
+    }
+    for users in args.users:
+        child_args = [sys.executable, __file__, '--population', str(users),
+                      '--requests', str(args.requests), '--concurrency', str(args.concurrency),
+                      '--reload-window', str(args.reload_window), '--validator', args.validator,
+                      '--seed', str(args.seed), '--scenarios', *args.scenarios]
+        if args.bind_dir:
+            child_args += ['--bind-dir', args.bind_dir]
+        print(f'Benchmarking {users} users...', file=sys.stderr)
+        proc = subprocess.run(child_args, env=env, stdout=subprocess.PIPE, text=True)
+        if proc.returncode != 0:
+            print(f'Population of {users} users failed', file=sys.stderr)
+            return 1
+        report['populations'].append(json.loads(proc.stdout))
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + '\n')
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
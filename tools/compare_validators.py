@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+'''
+Runs the in-process dnspython zone validator and `named-checkzone -k fail`
+over the zone files in tools/validator_corpus/ and checks that both agree on
+accepting the files in accept/ and rejecting the ones in reject/.
+
+Run from the repository root:
+
+    python tools/compare_validators.py [--origin user.example.com.]
+
+named-checkzone is skipped if it is not installed (e.g. outside the Docker image).
+Exits with status 1 on any disagreement.
+'''
+import argparse
+import shutil
+import subprocess
+import sys
+
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.zone_validator import check_zone_text, ZoneValidationError  # noqa: E402
+
+
+CORPUS_DIR = Path(__file__).resolve().parent / 'validator_corpus'
+
+
+def dnspython_accepts(origin: str, zone_file: Path) -> tuple[bool, str]:
+    try:
+        check_zone_text(origin, zone_file.read_text())
+        return True, ''
+    except ZoneValidationError as e:
+        return False, str(e)
+
+
+def named_accepts(origin: str, zone_file: Path) -> tuple[bool, str]:
+    proc = subprocess.run(['named-checkzone', '-k', 'fail', origin, str(zone_file)],
+                          timeout=5,
+                          stdout=subprocess.PIPE,
+                          stderr=subprocess.STDOUT,
+                          text=True)
+    return proc.returncode == 0, proc.stdout.strip().splitlines()[0] if proc.stdout.strip() else ''
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--origin', default='user.example.com.')
+    args = parser.parse_args()
+
+    has_named = shutil.which('named-checkzone') is not None
+    if not has_named:
+        print('named-checkzone not found: only checking dnspython against the expected results.')
+    failures = 0
+    for expected in ('accept', 'reject'):
+        for zone_file in sorted((CORPUS_DIR / expected).glob('*.zone')):
+            want = expected == 'accept'
+            results = {'dnspython': dnspython_accepts(args.origin, zone_file)}
+            if has_named:
+                results['named-checkzone'] = named_accepts(args.origin, zone_file)
+            ok = all(accepted == want for accepted, _ in results.values())
+            failures += not ok
+            verdicts = '  '.join(f'{name}={"accept" if accepted else "reject"}' for name, (accepted, _) in results.items())
+            print(f'{"ok  " if ok else "FAIL"} {expected}/{zone_file.name:<24} {verdicts}')
+            if not ok:
+                for name, (_, msg) in results.items():
+                    print(f'       {name}: {msg}')
+    print(f'{failures} disagreement(s)')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
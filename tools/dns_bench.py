@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+'''
+DNS query benchmark of the built-in responder (app/dns_server.py), and of
+named on the same zones when BIND is in PATH.
+
+A Bind directory with --users users is generated as in tools/bench.py. A
+child process boots the app on it with DNS_SERVER=builtin and serves the
+zones on --port; with --named, named serves the same zone files on
+--named-port. Each server is then driven over UDP with --concurrency
+queries in flight for --seconds, asking "www.<user>.<origin> A" of random
+users. Results are printed as JSON (or written to --output):
+
+    python tools/dns_bench.py --users 1000 --seconds 10 --named --output dns-bench.json
+
+Without --named only the built-in responder is measured.
+'''
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+from pathlib import Path
+
+import dns.message
+
+from bench import ROOT_DIR, ROOT_DOMAIN, PUBLIC_IP, STUBS_DIR, git_commit, generate_population, summary, use_bind_dir
+
+ADDRESS = '127.0.0.1'
+QUERY_TIMEOUT = 1.0  # Seconds before a query counts as an error
+
+
+def named_conf(bind_dir: Path, port: int, zones: list[tuple[str, str]]) -> str:
+    statements = ''.join(f'zone "{origin}" {{\n  type master;\n  file "{path}";\n}};\n' for origin, path in zones)
+    return f'''
+options {{
+  directory "{bind_dir}";
+  pid-file "{bind_dir}/named-bench.pid";
+  listen-on port {port} {{ {ADDRESS}; }};
+  listen-on-v6 {{ none; }};
+  recursion no;
+  dnssec-validation no;
+}};
+{statements}'''
+
+
+def serve(args) -> None:
+    '''Generates the zones and serves them until killed. Runs in a child process.'''
+    bind_dir = Path(tempfile.mkdtemp(prefix='dns-bench-'))
+    os.environ.update({
+        'ROOT_DOMAIN': ROOT_DOMAIN,
+        'TESTING_MODE': 'false',
+        'PUBLIC_IP_PROVIDERS': '[]',
+        'DNS_SERVER': 'builtin',
+    })
+    os.chdir(ROOT_DIR)
+    sys.path.insert(0, str(ROOT_DIR))
+    from app import dns_manager
+    use_bind_dir(dns_manager, bind_dir)
+    Path(dns_manager.PUBLIC_IP_FILE).write_text(PUBLIC_IP)
+
+    import app.main as main
+    from app.dns_server import DnsServer, Responder
+    logging.disable(logging.INFO)
+
+    tokens = generate_population(main.zonemgr, args.users)
+    main.zonemgr.start()
+    while not main.zonemgr.ready.wait(0.1) and not main.zonemgr.startup_error:
+        pass
+    if main.zonemgr.startup_error:
+        raise main.zonemgr.startup_error
+
+    named = None
+    if args.named:
+        zones = [(ROOT_DOMAIN, dns_manager.MAIN_ZONE_FILE)]
+        zones += [(main.zonemgr.user_zone_origin(username), str(Path(dns_manager.USER_ZONES_DIR) / username))
+                  for username in tokens]
+        conf = bind_dir / 'named-bench.conf'
+        conf.write_text(named_conf(bind_dir, args.named_port, zones))
+        named = subprocess.Popen(['named', '-g', '-c', str(conf)], stdout=subprocess.DEVNULL,
+                                 stderr=open(bind_dir / 'named-bench.log', 'w'))
+
+    async def run() -> None:
+        server = DnsServer(Responder(main.zonemgr, dns_manager.MAIN_ZONE_FILE), ADDRESS, args.port)
+        await server.start()
+        print(json.dumps({'users': list(tokens)}), flush=True)
+        await asyncio.get_running_loop().run_in_executor(None, sys.stdin.read)  # Until the parent closes it
+        await server.stop()
+
+    try:
+        asyncio.run(run())
+    finally:
+        if named:
+            named.terminate()
+            named.wait(timeout=10)
+        shutil.rmtree(bind_dir, ignore_errors=True)
+
+
+class _Client(asyncio.DatagramProtocol):
+    def __init__(self) -> None:
+        self.waiting: dict[int, asyncio.Future] = {}
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        future = self.waiting.pop(struct.unpack('!H', data[:2])[0], None) if len(data) >= 12 else None
+        if future and not future.done():
+            future.set_result(data)
+
+
+async def load(port: int, queries: list[bytes], seconds: float, concurrency: int) -> dict:
+    '''Keeps `concurrency` queries in flight to `port` for `seconds`.'''
+    loop = asyncio.get_running_loop()
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + seconds
+
+    async def worker(n: int) -> None:
+        nonlocal errors
+        transport, client = await loop.create_datagram_endpoint(_Client, remote_addr=(ADDRESS, port))
+        rng = random.Random(n)
+        query_id = 0
+        try:
+            while time.perf_counter() < deadline:
+                query_id = (query_id + 1) & 0xffff
+                future = client.waiting[query_id] = loop.create_future()
+                start = time.perf_counter()
+                transport.sendto(struct.pack('!H', query_id) + rng.choice(queries)[2:])
+                try:
+                    response = await asyncio.wait_for(future, QUERY_TIMEOUT)
+                except asyncio.TimeoutError:
+                    client.waiting.pop(query_id, None)
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - start)
+                if response[3] & 0xf:  # RCODE
+                    errors += 1
+        finally:
+            transport.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(n) for n in range(concurrency)))
+    return summary(latencies, errors, time.perf_counter() - start)
+
+
+async def wait_for_server(port: int, query: bytes, timeout: float = 30) -> bool:
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        result = await load(port, [query], 0.01, 1)
+        if result['requests'] and not result['errors']:
+            return True
+        await asyncio.sleep(0.2)
+    return False
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--seconds', type=float, default=5, help='Seconds of load per server')
+    parser.add_argument('--concurrency', type=int, default=32, help='Queries in flight')
+    parser.add_argument('--port', type=int, default=5353, help='Port of the built-in responder')
+    parser.add_argument('--named', action='store_true', help='Also measure named (needs BIND in PATH)')
+    parser.add_argument('--named-port', type=int, default=5354)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='Write the JSON results here instead of stdout')
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)  # Child process mode
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return 0
+    if args.named and not shutil.which('named'):
+        parser.error('--named needs BIND (named) in PATH')
+
+    env = dict(os.environ)
+    env['PATH'] = f'{STUBS_DIR}{os.pathsep}{env.get("PATH", "")}'  # Zone checks only, named is not run by the app
+    env['BENCH_STUB_LATENCY'] = '0'
+    child_args = [sys.executable, __file__, '--serve', '--users', str(args.users), '--port', str(args.port),
+                  '--named-port', str(args.named_port)] + (['--named'] if args.named else [])
+    print(f'Generating {args.users} users...', file=sys.stderr)
+    child = subprocess.Popen(child_args, env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    report = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'params': {k: v for k, v in vars(args).items() if k not in ('output', 'serve')},
+        'servers': {},
+    }
+    try:
+        line = child.stdout.readline()
+        if not line:
+            print('The DNS server failed to start', file=sys.stderr)
+            return 1
+        users = json.loads(line)['users']
+        rng = random.Random(args.seed)
+        queries = [dns.message.make_query(f'www.{username}.{ROOT_DOMAIN}', 'A').to_wire()
+                   for username in rng.sample(users, min(len(users), 1000))]
+        servers = {'builtin': args.port}
+        if args.named:
+            servers['named'] = args.named_port
+
+        async def run() -> None:
+            for name, port in servers.items():
+                if not await wait_for_server(port, queries[0]):
+                    raise RuntimeError(f'{name} does not answer on port {port}')
+                print(f'Benchmarking {name}...', file=sys.stderr)
+                report['servers'][name] = await load(port, queries, args.seconds, args.concurrency)
+
+        asyncio.run(run())
+    except RuntimeError as e:
+        print(e, file=sys.stderr)
+        return 1
+    finally:
+        child.stdin.close()
+        try:
+            child.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            child.kill()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + '\n')
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
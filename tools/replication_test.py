@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+'''
+Checks primary/secondary replication with two local named instances on
+different ports, using the zone and config templates of the platform:
+
+1. The primary serves the main zone and a user zone, with the transfer
+   settings of zone-transfer.j2 (NOTIFY to the secondary, IXFR journal).
+2. The secondary is configured from named.conf.secondary.j2 and must
+   serve the same serials.
+3. A record of the user zone is changed as the platform does (new serial,
+   file replaced, rndc reload of the zone). The secondary must serve it
+   after the NOTIFY, and the primary must answer an IXFR from the old
+   serial with the difference only.
+
+Needs BIND (named, rndc) in PATH, e.g. inside the Docker image:
+
+    python tools/replication_test.py [--primary-port 5300 --secondary-port 5301]
+
+Prints the results as JSON. Exits with status 1 if replication fails.
+'''
+import argparse
+import base64
+import json
+import secrets
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from pathlib import Path
+
+import dns.exception
+import dns.message
+import dns.query
+import dns.rdatatype
+from jinja2 import Environment, FileSystemLoader
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_DIR))
+
+from app.zone_model import UserZone, next_serial, zone_text_serial  # noqa: E402
+
+
+TEMPLATES_DIR = ROOT_DIR / 'templates' / 'bind'
+ORIGIN = 'example.com.'
+USER = 'user'
+ADDRESS = '127.0.0.1'
+
+
+def named_conf(server_dir: Path, port: int, control_port: int, secret: str, zones: str) -> str:
+    return f'''
+options {{
+  directory "{server_dir}";
+  pid-file "{server_dir}/named.pid";
+  listen-on port {port} {{ {ADDRESS}; }};
+  listen-on-v6 {{ none; }};
+  notify-source {ADDRESS};
+  transfer-source {ADDRESS};
+  recursion no;
+  dnssec-validation no;
+}};
+
+key "rndc-key" {{
+  algorithm hmac-sha256;
+  secret "{secret}";
+}};
+
+controls {{
+  inet {ADDRESS} port {control_port} allow {{ {ADDRESS}; }} keys {{ "rndc-key"; }};
+}};
+{zones}
+'''
+
+
+def rndc_conf(secret: str) -> str:
+    return f'''
+key "rndc-key" {{
+  algorithm hmac-sha256;
+  secret "{secret}";
+}};
+
+options {{
+  default-key "rndc-key";
+  default-server {ADDRESS};
+}};
+'''
+
+
+def soa_serial(port: int, zone: str) -> int | None:
+    try:
+        response = dns.query.udp(dns.message.make_query(zone, 'SOA'), ADDRESS, port=port, timeout=1)
+    except (dns.exception.DNSException, OSError):
+        return None
+    for rrset in response.answer:
+        if rrset.rdtype == dns.rdatatype.SOA:
+            return rrset[0].serial
+    return None
+
+
+def addresses(port: int, name: str) -> set[str]:
+    try:
+        response = dns.query.udp(dns.message.make_query(name, 'A'), ADDRESS, port=port, timeout=1)
+    except (dns.exception.DNSException, OSError):
+        return set()
+    return {rdata.to_text() for rrset in response.answer if rrset.rdtype == dns.rdatatype.A for rdata in rrset}
+
+
+def wait_for(condition, timeout: float) -> float | None:
+    '''Seconds until `condition()` holds, None if it did not before `timeout`.'''
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        if condition():
+            return time.perf_counter() - start
+        time.sleep(0.05)
+    return None
+
+
+def ixfr_is_incremental(port: int, zone: str, serial: int) -> bool:
+    '''True if an IXFR from `serial` is answered with the differences (not a whole zone, as AXFR).'''
+    rrsets = []
+    for message in dns.query.xfr(ADDRESS, zone, rdtype=dns.rdatatype.IXFR, serial=serial, port=port,
+                                 timeout=5, relativize=False):
+        rrsets.extend(message.answer)
+    # Incremental: new SOA, old SOA, deletions, new SOA, additions, new SOA
+    return len(rrsets) > 1 and rrsets[1].rdtype == dns.rdatatype.SOA and rrsets[1][0].serial == serial
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--primary-port', type=int, default=5300)
+    parser.add_argument('--secondary-port', type=int, default=5301)
+    parser.add_argument('--timeout', type=float, default=10, help='Seconds to wait for each step')
+    parser.add_argument('--keep', action='store_true', help='Keep the working directory and its logs')
+    args = parser.parse_args()
+    if not shutil.which('named') or not shutil.which('rndc'):
+        parser.error('needs BIND (named, rndc) in PATH')
+
+    work_dir = Path(tempfile.mkdtemp(prefix='replication-'))
+    primary_dir = work_dir / 'primary'
+    secondary_dir = work_dir / 'secondary'
+    (primary_dir / 'user-zones').mkdir(parents=True)
+    (secondary_dir / 'user-zones').mkdir(parents=True)
+    secret = base64.b64encode(secrets.token_bytes(32)).decode()
+    jinja_env = Environment(loader=FileSystemLoader(TEMPLATES_DIR))
+    user_origin = f'{USER}.{ORIGIN}'
+
+    # Primary: zones from the platform templates
+    for origin, template, path in ((ORIGIN, 'main-zone.j2', primary_dir / 'main-zone'),
+                                   (user_origin, 'user-zone.j2', primary_dir / 'user-zones' / USER)):
+        path.write_text(jinja_env.get_template(template).render(
+            origin=origin, serial=next_serial(None), ns_ip=ADDRESS, includes=[], custom_records='') +
+            'www IN A 198.51.100.1\n')
+    transfer = jinja_env.get_template('zone-transfer.j2').render(
+        secondaries=[f'{ADDRESS} port {args.secondary_port}'], transfer_addresses=[ADDRESS])
+    zones = ''.join(f'zone "{origin}" {{\n  type master;\n  file "{path}";\n{transfer}}};\n'
+                    for origin, path in ((ORIGIN, primary_dir / 'main-zone'),
+                                         (user_origin, primary_dir / 'user-zones' / USER)))
+    primary_conf = primary_dir / 'named.conf'
+    primary_conf.write_text(named_conf(primary_dir, args.primary_port, args.primary_port + 1000, secret, zones))
+
+    # Secondary: config as served by GET /secondary/named.conf
+    zones = jinja_env.get_template('named.conf.secondary.j2').render(
+        origin=ORIGIN, primary=f'{ADDRESS} port {args.primary_port}', zones_dir=str(secondary_dir),
+        user_list=[USER])
+    secondary_conf = secondary_dir / 'named.conf'
+    secondary_conf.write_text(named_conf(secondary_dir, args.secondary_port, args.secondary_port + 1000, secret, zones))
+    (work_dir / 'rndc.conf').write_text(rndc_conf(secret))
+
+    processes = []
+    result = {'work_dir': str(work_dir)}
+    try:
+        for conf in (primary_conf, secondary_conf):
+            log = open(conf.with_name('named.log'), 'w')
+            processes.append(subprocess.Popen(['named', '-g', '-c', str(conf)], stdout=log, stderr=subprocess.STDOUT))
+
+        zonefile = primary_dir / 'user-zones' / USER
+        serial = zone_text_serial(zonefile.read_text())
+        result['initial_sync_seconds'] = wait_for(
+            lambda: soa_serial(args.secondary_port, user_origin) == serial, args.timeout)
+        if result['initial_sync_seconds'] is None:
+            raise RuntimeError('The secondary did not transfer the user zone')
+
+        # Change as the platform does: record edit, new serial, file replaced, zone reloaded
+        zone = UserZone.from_text(user_origin, zonefile.read_text()).draft()
+        zone.replace('www', 'A', ['198.51.100.2'])
+        zone.bump_serial()
+        zonefile.write_text(zone.to_text())
+        subprocess.run(['rndc', '-c', str(work_dir / 'rndc.conf'), '-p', str(args.primary_port + 1000),
+                        'reload', user_origin], check=True, capture_output=True)
+        result['serials'] = [serial, zone.serial]
+        result['notify_propagation_seconds'] = wait_for(
+            lambda: addresses(args.secondary_port, f'www.{user_origin}') == {'198.51.100.2'}, args.timeout)
+        if result['notify_propagation_seconds'] is None:
+            raise RuntimeError('The secondary did not follow the change')
+        result['ixfr_incremental'] = ixfr_is_incremental(args.primary_port, user_origin, serial)
+        if not result['ixfr_incremental']:
+            raise RuntimeError('The primary answered the IXFR with the whole zone')
+        result['ok'] = True
+    except (RuntimeError, OSError, subprocess.CalledProcessError, dns.exception.DNSException) as e:
+        result['ok'] = False
+        result['error'] = str(e)
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait(timeout=10)
+        if not args.keep and result.get('ok'):
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(json.dumps(result, indent=2))
+    return 0 if result['ok'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())